@@ -1,6 +1,8 @@
+from ussb import feed
 from ussb.feed import create_feed, create_child_feed
 from ussb.feed_manager import FeedManager
-from ussb.node import Node
+from ussb.node import UDP_BATCH_FRAMES, Node
+from ussb.storage import FileStore
 from ussb.util import listdir, PYCOM
 import os
 import sys
@@ -44,18 +46,18 @@ def init_and_export() -> None:
     master_feed = create_feed(mfid)
 
     # export root of master feed and configuration file, does not include key
+    # (as .head/.log files, taken over by every storage backend)
     os.mkdir("ROOT_EXPORT")
     os.mkdir("ROOT_EXPORT/_feeds")
-    for file in listdir("_feeds"):
-        if file.endswith(".head") or file.endswith(".log"):
-            f = open("_feeds/{}".format(file), "rb")
-            content = f.read()
-            f.close()
-
-            f = open("ROOT_EXPORT/_feeds/{}".format(file), "wb")
-            f.write(content)
-            f.close()
-            del content
+    export = FileStore("ROOT_EXPORT/_feeds")
+    export.write_header(mfid, feed.store.read_header(mfid))
+    size = feed.store.log_size(mfid)
+    if size:
+        content = bytearray(size)
+        feed.store.read_log(mfid, 0, content)
+        export.append_log(mfid, content)
+        del content
+    export.close()
 
     # create new child feed, unassigned
     ckey, cfid = fm.generate_keypair()
@@ -89,7 +91,14 @@ def clean() -> None:
     """
     if "_feeds" in listdir():
         for file in listdir("_feeds"):
-            if file.endswith(".log") or file.endswith(".head"):
+            if (
+                file.endswith(".log")
+                or file.endswith(".head")
+                or file.endswith(".idx")
+                or file.endswith(".jnl")
+                or file.endswith(".pack")
+                or file.endswith(".snap")
+            ):
                 os.remove("_feeds/{}".format(file))
         os.rmdir("_feeds")
 
@@ -111,6 +120,10 @@ def clean() -> None:
         for file in listdir("_blobs"):
             if file.startswith("."):
                 continue
+            if file.startswith("blobs."):
+                # packfile and its pointers
+                os.remove("_blobs/{}".format(file))
+                continue
             for file2 in listdir("_blobs/{}".format(file)):
                 if file2.startswith("."):
                     continue
@@ -170,6 +183,11 @@ else:
     # non-pycom code, handle arguments
 
     def main() -> int:
+        # "b": several frames per UDP datagram (once all peers sent batches)
+        batch = UDP_BATCH_FRAMES if "b" in sys.argv else 1
+        if "s" in sys.argv:
+            # all feeds in a single file (kept on later runs without "s")
+            feed.use_backend("packed")
         if "c" in sys.argv:
             clean()
             return 0
@@ -179,17 +197,20 @@ else:
         if "rr" in sys.argv:
             clean()
             init()
-            n = Node()
+            n = Node(batch_frames=batch)
             n.io()
         if "r" in sys.argv:
-            n = Node()
+            n = Node(batch_frames=batch)
             n.io()
         if "w" in sys.argv:
-            n = Node(enable_http=True)
+            n = Node(enable_http=True, batch_frames=batch)
             n.io()
         if "e" in sys.argv:
             init_and_export()
             return 0
+        if "p" in sys.argv:
+            Node().prune()
+            return 0
         return 1
 
     if __name__ == "__main__":
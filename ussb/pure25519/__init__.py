@@ -6,7 +6,11 @@ from sha.sha512 import sha512
 
 from .basic import (bytes_to_clamped_scalar,
                     bytes_to_scalar, scalar_to_bytes,
-                    bytes_to_element, Base)
+                    bytes_to_element, Base, L, Q, FMASK, _zero_bytes,
+                    decodepoint, xform_affine_to_extended, negate_element,
+                    add_elements, double_element,
+                    multi_scalarmult_vartime, double_scalarmult_vartime,
+                    is_extended_zero, NAF_WIDTH_BASE, NAF_WIDTH_VAR)
 
 # adapt pure25519/ed25519.py to behave like (C/glue) ed25519/_ed25519.py, so
 # ed25519_oop.py doesn't have to change
@@ -73,27 +77,111 @@ def sign(msg, skvk):
     sig = R_bytes + scalar_to_bytes(S)
     return sig + msg
 
-def open(sigmsg, vk):
+def _times8(pt): # extended->extended
+    return double_element(double_element(double_element(pt)))
+
+def _decode_R(R_bytes):
+    # R of a signature in extended coordinates. Only canonical encodings
+    # (y < Q, no sign bit for x == 0) of elements that are not of small
+    # order are accepted, signing never produces anything else
+    unclamped = int.from_bytes(R_bytes, 'little')
+    if unclamped & FMASK >= Q:
+        raise BadSignatureError("R is not canonical")
+    x, y = decodepoint(R_bytes)
+    if x % Q == 0 and unclamped >> 255:
+        raise BadSignatureError("R is not canonical")
+    R = xform_affine_to_extended((x, y))
+    if is_extended_zero(_times8(R)):
+        raise BadSignatureError("R is of small order")
+    return R
+
+def open(sigmsg, vk, A=None):
+    # A: the already decoded (and subgroup-checked) element of vk, if known
+    # Cofactored check 8*(S*B - h*A - R) == 0 (RFC 8032, 5.1.7), the same
+    # equation as verify_batch, so both always agree on a signature.
+    # S*B - h*A is computed in one pass
     assert len(vk) == 32
     sig = sigmsg[:64]
     msg = sigmsg[64:]
+    R_bytes = sig[:32]
+    if R_bytes == _zero_bytes:
+        raise BadSignatureError("element was Zero")
     try:
-        R = bytes_to_element(sig[:32])
-        A = bytes_to_element(vk)
+        if A is None:
+            A = bytes_to_element(vk)
+        R = _decode_R(R_bytes)
         S = bytes_to_scalar(sig[32:])
-        h = Hint(sig[:32] + vk + msg)
-        v1 = Base.scalarmult(S)
-        v2 = R.add(A.scalarmult(h))
+        h = Hint(R_bytes + vk + msg)
+        v = double_scalarmult_vartime(S % L, Base.get_naf_table(),
+                                      NAF_WIDTH_BASE, L - (h % L), A.XYTZ,
+                                      NAF_WIDTH_VAR)
     except ValueError as e:
         raise BadSignatureError(e)
     except Exception as e:
         if str(e) == "decoding point that is not on curve":
             raise BadSignatureError(e)
         raise
-    if v1 != v2:
+    if not is_extended_zero(_times8(add_elements(v, negate_element(R)))):
         raise BadSignatureError()
     return msg
 
+def verify_batch(items, entropy=os.urandom):
+    # items: [(vk, msg, sig), ...], vk as bytes or VerifyingKey (which keeps
+    # its decoded element around). Checks all signatures at once with the
+    # random linear combination
+    #   (sum z_i*S_i)*B - sum z_i*R_i - sum (z_i*h_i)*A_i == 0
+    # where the z_i are random 128-bit scalars. Terms of the same key are
+    # merged, so a run of packets from one feed costs a single pass over
+    # R_1..R_n plus one A. Raises BadSignatureError if any signature in the
+    # batch is invalid, without telling which one (check them one by one).
+    # The equation is multiplied by the cofactor 8 like in open(), so small
+    # order components of the R_i cannot cancel each other out, and R_i are
+    # decoded as strictly as there (_decode_R): a signature is accepted here
+    # if and only if open() accepts it (up to the 2^-128 chance of the z_i).
+    if not items:
+        return
+    s = 0
+    coefs = {} # vk -> sum z_i*h_i
+    keys = {} # vk -> VerifyingKey, if given
+    scalars = []
+    pts = []
+    try:
+        for vk, msg, sig in items:
+            if isinstance(vk, VerifyingKey):
+                keys[vk.vk_s] = vk
+                vk = vk.vk_s
+            assert len(vk) == 32
+            assert len(sig) == 64
+            R_bytes = sig[:32]
+            if R_bytes == _zero_bytes:
+                raise BadSignatureError("element was Zero")
+            z = int.from_bytes(entropy(16), 'little') | 1
+            S = bytes_to_scalar(sig[32:])
+            h = Hint(R_bytes + vk + msg)
+            s = (s + z*S) % L
+            coefs[vk] = (coefs.get(vk, 0) + z*h) % L
+            # -z*R, the negation is free in extended coordinates
+            R = negate_element(_decode_R(R_bytes))
+            scalars.append(z)
+            pts.append(R)
+        for vk in coefs:
+            if vk in keys:
+                A = keys[vk].get_element()
+            else:
+                A = bytes_to_element(vk)
+            scalars.append(L - coefs[vk])
+            pts.append(A.XYTZ)
+        v = multi_scalarmult_vartime(s, Base.get_naf_table(), NAF_WIDTH_BASE,
+                                     scalars, pts, NAF_WIDTH_VAR)
+    except ValueError as e:
+        raise BadSignatureError(e)
+    except Exception as e:
+        if str(e) == "decoding point that is not on curve":
+            raise BadSignatureError(e)
+        raise
+    if not is_extended_zero(_times8(v)):
+        raise BadSignatureError()
+
 # ed25519_oop.py ------------------------------------------------------------
 
 # import os
@@ -111,14 +199,18 @@ def create_keypair(entropy=os.urandom):
 
 class SigningKey(object):
     # this can only be used to reconstruct a key created by create_keypair().
+    # The secret scalar and the nonce prefix are derived once, so keep the
+    # SigningKey around instead of re-creating it for every signature.
     def __init__(self, sk_s):
         assert isinstance(sk_s, bytes)
+        if len(sk_s) != 32 and len(sk_s) != 32+32:
+            raise ValueError("SigningKey takes 32-byte seed or 64-byte string")
+        h = H(sk_s[:32])
+        self.a = bytes_to_clamped_scalar(h[:32]) # secret scalar
+        self.prefix = h[32:] # nonce prefix
         if len(sk_s) == 32:
             # create from seed
-            vk_s, sk_s = publickey(sk_s)
-        else:
-            if len(sk_s) != 32+32:
-                raise ValueError("SigningKey takes 32-byte seed or 64-byte string")
+            sk_s = sk_s + Base.scalarmult(self.a).to_bytes()
         self.sk_s = sk_s # seed+pubkey
         self.vk_s = sk_s[32:] # just pubkey
 
@@ -131,21 +223,26 @@ class SigningKey(object):
         return VerifyingKey(self.vk_s)
 
     def sign(self, msg):
+        # same as sign(msg, self.sk_s)[:64], without re-hashing the seed
         assert isinstance(msg, bytes)
-        sig_and_msg = sign(msg, self.sk_s)
-        # the response is R+S+msg
-        sig_R = sig_and_msg[0:32]
-        sig_S = sig_and_msg[32:64]
-        msg_out = sig_and_msg[64:]
-        sig_out = sig_R + sig_S
-        assert msg_out == msg
-        return sig_out
+        r = Hint(self.prefix + msg)
+        R_bytes = Base.scalarmult(r).to_bytes()
+        S = r + Hint(R_bytes + self.vk_s + msg) * self.a
+        return R_bytes + scalar_to_bytes(S)
 
 class VerifyingKey(object):
     def __init__(self, vk_s):
         assert isinstance(vk_s, bytes)
         assert len(vk_s) == 32
         self.vk_s = vk_s
+        self.A = None # decoded element, see get_element()
+
+    def get_element(self):
+        # decoding and the subgroup check are done once per key, keep the
+        # VerifyingKey around when verifying many signatures of one key
+        if self.A is None:
+            self.A = bytes_to_element(self.vk_s)
+        return self.A
 
     def __eq__(self, them):
         if not isinstance(them, object): return False
@@ -159,11 +256,20 @@ class VerifyingKey(object):
         sig_R = sig[:32]
         sig_S = sig[32:]
         sig_and_msg = sig_R + sig_S + msg
+        try:
+            A = self.get_element()
+        except ValueError as e:
+            raise BadSignatureError(e)
+        except Exception as e:
+            if str(e) == "decoding point that is not on curve":
+                raise BadSignatureError(e)
+            raise
         # this might raise BadSignatureError
-        msg2 = open(sig_and_msg, self.vk_s)
+        msg2 = open(sig_and_msg, self.vk_s, A)
         assert msg2 == msg
 
-__all__ = ['create_keypair', 'SigningKey', 'VerifyingKey', 'BadSignatureError']
+__all__ = ['create_keypair', 'SigningKey', 'VerifyingKey', 'BadSignatureError',
+           'verify_batch']
 
 '''
 def selftest():
@@ -16,8 +16,51 @@ def pow3(b, exp, m):
         exp >>= 1
     return (b * res) % m
 
+# Field arithmetic modulo Q. Since 2^255 = 19 (mod Q), the bits above 2^255
+# can be folded back in as 19*(x >> 255) instead of dividing by Q. Two folds
+# bring any value below 2^520 under 2^256. The point formulas keep their
+# coordinates in that "loose" range (non-negative, but not necessarily < Q)
+# and only reduce fully with % Q when a point is encoded or compared. A
+# subtraction adds FBIAS first, so nothing ever goes negative. The fold only
+# needs masks, shifts and small multiplications, so, like the per-byte mod()
+# it replaces, it never divides a 510-bit product on the Pycom stack.
+
+FMASK = (1 << 255) - 1
+FBIAS = 8*Q # > 2^257, larger than anything that gets subtracted
+
+def fred(x): # 0 <= x < 2^520 -> loose, congruent mod Q
+    x = (x & FMASK) + 19 * (x >> 255)
+    return (x & FMASK) + 19 * (x >> 255)
+
+def fsqn(x, n): # x^(2^n)
+    for _ in range(n):
+        x = fred(x*x)
+    return x
+
+def _pow_2_250_1(z):
+    # z^(2^250-1) and z^11, the common part of the inversion and square root
+    # exponents (same addition chain as ref10)
+    z2 = fred(z*z)
+    z9 = fred(fsqn(z2, 2) * z)
+    z11 = fred(z9 * z2)
+    t = fred(fred(z11*z11) * z9) # 2^5-1
+    t10 = fred(fsqn(t, 5) * t) # 2^10-1
+    t = fred(fsqn(t10, 10) * t10) # 2^20-1
+    t = fred(fsqn(t, 20) * t) # 2^40-1
+    t50 = fred(fsqn(t, 10) * t10) # 2^50-1
+    t = fred(fsqn(t50, 50) * t50) # 2^100-1
+    t = fred(fsqn(t, 100) * t) # 2^200-1
+    return fred(fsqn(t, 50) * t50), z11 # 2^250-1
+
 def inv(x):
-    return pow3(x, Q-2, Q)
+    # x^(Q-2) = x^(2^255-21)
+    (t, z11) = _pow_2_250_1(x % Q)
+    return (fsqn(t, 5) * z11) % Q
+
+def pow22523(x):
+    # x^((Q-5)/8) = x^(2^252-3)
+    (t, _) = _pow_2_250_1(x % Q)
+    return (fsqn(t, 2) * x) % Q
 
 # d = -121665 * inv(121666)
 # I = pow3(2, (Q-1)//4, Q)
@@ -25,10 +68,15 @@ d = -451324906254155733768289493009262417378564128519112524162894159188290092459
 I = 19681161376707505956807079304988542015446066515923890162744021073123829784752
 
 def xrecover(y):
+    # x = sqrt(u/v) with u = y^2-1, v = d*y^2+1. Computing the candidate as
+    # u*v^3 * (u*v^7)^((Q-5)/8) needs a single exponentiation instead of an
+    # inversion followed by a square root (RFC 8032, 5.1.3)
     yy = (y*y) % Q
-    xx = ( (yy-1) * inv((d*yy)%Q + 1) ) % Q
-    x = pow3(xx, (Q+3)//8, Q)
-    if (((x*x) % Q) - xx) % Q != 0: x = (x*I) % Q
+    u = (yy-1) % Q
+    v = (d*yy + 1) % Q
+    v3 = (v*v*v) % Q
+    x = (u*v3*pow22523(u*v3*v3*v)) % Q
+    if (v*x*x - u) % Q != 0: x = (x*I) % Q
     if x % 2 != 0: x = Q-x
     return x
 
@@ -48,83 +96,47 @@ def xform_affine_to_extended(pt):
 
 def xform_extended_to_affine(pt):
     (x, y, z, _) = pt
-    return ((x*inv(z))%Q, (y*inv(z))%Q)
+    zi = inv(z) # inversion is expensive, only do it once
+    return ((x*zi)%Q, (y*zi)%Q)
 
 def double_element(pt): # extended->extended
     # dbl-2008-hwcd
     (X1, Y1, Z1, _) = pt
-    A = (X1*X1) % Q
-    B = (Y1*Y1) % Q
-    C = (2*Z1*Z1) % Q
-    D = (-A) % Q
-    J = (X1+Y1) % Q
-    E = (J*J-A-B) % Q
-    G = (D+B) % Q
-    F = (G-C) % Q
-    H = (D-B) % Q
-    X3 = (E*F) % Q
-    Y3 = (G*H) % Q
-    Z3 = (F*G) % Q
-    T3 = (E*H) % Q
+    A = fred(X1*X1)
+    B = fred(Y1*Y1)
+    C = fred(2*Z1*Z1)
+    J = X1+Y1
+    E = fred(J*J) + FBIAS - A - B
+    G = B + FBIAS - A # D+B with D = -A
+    F = G + FBIAS - C
+    H = FBIAS - A - B # D-B
+    X3 = fred(E*F)
+    Y3 = fred(G*H)
+    Z3 = fred(F*G)
+    T3 = fred(E*H)
     return (X3, Y3, Z3, T3)
-"""
-def add_elements(pt1, pt2): # extended->extended
-    # add-2008-hwcd-3 . Slightly slower than add-2008-hwcd-4, but -3 is
-    # unified, so it's safe for general-purpose addition
-    (X1, Y1, Z1, T1) = pt1
-    (X2, Y2, Z2, T2) = pt2
-    A = (((Y1-X1)%Q)*((Y2-X2)%Q)) % Q
-    B = (((Y1+X1)%Q)*((Y2+X2)%Q)) % Q
-    C = T1*(2*d)*T2 % Q
-    D = Z1*2*Z2 % Q
-    E = (B-A) % Q
-    F = (D-C) % Q
-    G = (D+C) % Q
-    H = (B+A) % Q
-    X3 = (E*F) % Q
-    Y3 = (G*H) % Q
-    T3 = (E*H) % Q
-    temp = F*G
-    temp2 = mod(temp, Q)
-    Z3 = temp2
-    return (X3, Y3, Z3, T3)
-"""
+
+d2 = (2*d) % Q
+
 def add_elements(pt1, pt2): # extended->extended
     # add-2008-hwcd-3 . Slightly slower than add-2008-hwcd-4, but -3 is
     # unified, so it's safe for general-purpose addition
     (X1, Y1, Z1, T1) = pt1
     (X2, Y2, Z2, T2) = pt2
-    A = (((Y1-X1)%Q)*((Y2-X2)%Q)) % Q
-    B = (((Y1+X1)%Q)*((Y2+X2)%Q)) % Q
-    C = T1*(2*d)*T2 % Q
-    D = Z1*2*Z2 % Q
-    E = (B-A) % Q
-    F = (D-C) % Q
-    G = (D+C) % Q
-    H = (B+A) % Q
-    X3 = (E*F) % Q
-    Y3 = (G*H) % Q
-    T3 = (E*H) % Q
-    Z3 = mod(F*G, Q)
+    A = fred((Y1+FBIAS-X1)*(Y2+FBIAS-X2))
+    B = fred((Y1+X1)*(Y2+X2))
+    C = fred(fred(T1*d2)*T2)
+    D = fred(2*Z1*Z2)
+    E = B + FBIAS - A
+    F = D + FBIAS - C
+    G = D + C
+    H = B + A
+    X3 = fred(E*F)
+    Y3 = fred(G*H)
+    Z3 = fred(F*G)
+    T3 = fred(E*H)
     return (X3, Y3, Z3, T3)
 
-
-def mod(num, a):
-    # num = str(num)
-    # Initialize result
-    # res = 0
- 
-    # One by one process all digits
-    # of 'num'
-    # for i in range(0, len(num)):
-        # res = (res * 10 + int(num[i])) % a
- 
-    # return res
-    res = num >> (33 * 8)
-    num = num.to_bytes(64, "big")
-    for i in range(31, 64):
-        res = ((res << 8) | num[i]) % a
-    return res
 '''
 def scalarmult_element_safe_slow(pt, n):
     # this form is slightly slower, but tolerates arbitrary points, including
@@ -163,18 +175,18 @@ def _add_elements_nonunfied(pt1, pt2): # extended->extended
     # aren't using points of order 1/2/4/8
     (X1, Y1, Z1, T1) = pt1
     (X2, Y2, Z2, T2) = pt2
-    A = ((Y1-X1)*(Y2+X2)) % Q
-    B = ((Y1+X1)*(Y2-X2)) % Q
-    C = (Z1*2*T2) % Q
-    D = (T1*2*Z2) % Q
-    E = (D+C) % Q
-    F = (B-A) % Q
-    G = (B+A) % Q
-    H = (D-C) % Q
-    X3 = (E*F) % Q
-    Y3 = (G*H) % Q
-    Z3 = (F*G) % Q
-    T3 = (E*H) % Q
+    A = fred((Y1+FBIAS-X1)*(Y2+X2))
+    B = fred((Y1+X1)*(Y2+FBIAS-X2))
+    C = fred(2*Z1*T2)
+    D = fred(2*T1*Z2)
+    E = D + C
+    F = B + FBIAS - A
+    G = B + A
+    H = D + FBIAS - C
+    X3 = fred(E*F)
+    Y3 = fred(G*H)
+    Z3 = fred(F*G)
+    T3 = fred(E*H)
     return (X3, Y3, Z3, T3)
 
 '''
@@ -209,6 +221,190 @@ def scalarmult_element(pt, n):
             v = _add_elements_nonunfied(v, pt)
     return v
 
+# Fixed-base comb (Lim-Lee) for the base point. A scalar n < 2^(teeth*spacing)
+# is cut into 'teeth' rows of 'spacing' bits. Column i of the comb selects the
+# table entry sum(2^(k*spacing) * B for every row k whose bit i is set), so a
+# scalarmult costs 'spacing' doublings and at most 'spacing' additions instead
+# of ~255 doublings and ~128 additions. Table entries are affine points in
+# "precomputed" form (y+x, y-x, 2*d*x*y), see _add_elements_precomputed.
+
+COMB_TEETH = 6
+COMB_MAGIC = b"comb"
+
+def _add_elements_precomputed(pt1, pre): # extended+precomputed->extended
+    # madd-2008-hwcd-3 (Z2=1): unified, so it also tolerates pt1==pt2 and Zero
+    (X1, Y1, Z1, T1) = pt1
+    (YpX2, YmX2, T2d2) = pre
+    A = fred((Y1+FBIAS-X1)*YmX2)
+    B = fred((Y1+X1)*YpX2)
+    C = fred(T1*T2d2)
+    D = 2*Z1
+    E = B + FBIAS - A
+    F = D + FBIAS - C
+    G = D + C
+    H = B + A
+    X3 = fred(E*F)
+    Y3 = fred(G*H)
+    Z3 = fred(F*G)
+    T3 = fred(E*H)
+    return (X3, Y3, Z3, T3)
+
+def _batch_to_precomputed(pts):
+    # Montgomery's trick: one inversion for the whole list of extended points
+    acc = [1] * len(pts)
+    prod = 1
+    for i in range(len(pts)):
+        acc[i] = prod
+        prod = (prod * pts[i][2]) % Q
+    prod = inv(prod)
+    pre = [None] * len(pts)
+    for i in range(len(pts) - 1, -1, -1):
+        (X, Y, Z, _) = pts[i]
+        zinv = (prod * acc[i]) % Q
+        prod = (prod * Z) % Q
+        x = (X * zinv) % Q
+        y = (Y * zinv) % Q
+        pre[i] = ((y+x) % Q, (y-x) % Q, (2*d*x*y) % Q)
+    return pre
+
+def comb_spacing(teeth):
+    # scalars are reduced mod L before use, so 253 bits are enough
+    return (253 + teeth - 1) // teeth
+
+def build_comb_table(pt, teeth):
+    # entry j-1 holds the combination selected by the bits of j (1 <= j < 2^teeth)
+    spacing = comb_spacing(teeth)
+    rows = [pt]
+    for _ in range(teeth - 1):
+        row = rows[-1]
+        for _ in range(spacing):
+            row = double_element(row)
+        rows.append(row)
+    table = [None] * ((1 << teeth) - 1)
+    for j in range(1, 1 << teeth):
+        low = j & -j # lowest set bit of j
+        k = 0
+        while (1 << k) != low:
+            k += 1
+        if j == low:
+            table[j-1] = rows[k]
+        else:
+            table[j-1] = add_elements(table[j-low-1], rows[k])
+        gc.collect()
+    return _batch_to_precomputed(table)
+
+def comb_scalarmult(table, teeth, n):
+    assert 0 <= n < L
+    spacing = comb_spacing(teeth)
+    # bytes allow cheap bit lookups without shifting the full scalar each time
+    b = n.to_bytes((teeth*spacing + 7) // 8, 'little')
+    v = xform_affine_to_extended((0,1))
+    for i in range(spacing - 1, -1, -1):
+        v = double_element(v)
+        j = 0
+        pos = i
+        for k in range(teeth):
+            j |= ((b[pos >> 3] >> (pos & 7)) & 1) << k
+            pos += spacing
+        if j:
+            v = _add_elements_precomputed(v, table[j-1])
+    return v
+
+# Double-scalar multiplication a*P1 + b*P2 (Straus/Shamir): both scalars are
+# recoded to width-w NAF and share a single run of doublings, adding odd
+# multiples of the points (or their negatives) wherever a digit is non-zero.
+# Variable time, only use it with public scalars (signature verification).
+
+NAF_WIDTH_BASE = 7
+NAF_WIDTH_VAR = 5
+
+def wnaf(n, w):
+    # least significant digit first, every non-zero digit is odd and
+    # -2^(w-1) < digit < 2^(w-1), at most one of any w consecutive digits is
+    # non-zero
+    assert n >= 0
+    naf = []
+    window = 1 << w
+    while n > 0:
+        if n & 1:
+            digit = n & (window - 1)
+            if digit >= (window >> 1):
+                digit -= window
+            n -= digit
+        else:
+            digit = 0
+        naf.append(digit)
+        n >>= 1
+    return naf
+
+def _odd_multiples(pt, w):
+    # [1*pt, 3*pt, 5*pt, ..., (2^(w-1)-1)*pt] in extended coordinates
+    pts = [pt]
+    dbl = double_element(pt)
+    for _ in range((1 << (w-2)) - 1):
+        pts.append(add_elements(pts[-1], dbl))
+    return pts
+
+def _to_cached(pt): # extended->cached
+    (X, Y, Z, T) = pt
+    return ((Y+X) % Q, (Y-X) % Q, (2*Z) % Q, (2*d*T) % Q)
+
+def _add_elements_cached(pt1, c): # extended+cached->extended
+    # add-2008-hwcd-3 with the second point prepared by _to_cached: unified
+    (X1, Y1, Z1, T1) = pt1
+    (YpX2, YmX2, Z2x2, T2d2) = c
+    A = fred((Y1+FBIAS-X1)*YmX2)
+    B = fred((Y1+X1)*YpX2)
+    C = fred(T1*T2d2)
+    D = fred(Z1*Z2x2)
+    E = B + FBIAS - A
+    F = D + FBIAS - C
+    G = D + C
+    H = B + A
+    X3 = fred(E*F)
+    Y3 = fred(G*H)
+    Z3 = fred(F*G)
+    T3 = fred(E*H)
+    return (X3, Y3, Z3, T3)
+
+def multi_scalarmult_vartime(a, pre1, w1, scalars, pts, w2):
+    # a*P1 + sum(scalars[i]*pts[i]), where pre1 =
+    # _batch_to_precomputed(_odd_multiples(P1, w1)) is typically kept around
+    # (fixed base) and pts are fresh extended points
+    naf1 = wnaf(a, w1)
+    nafs = [wnaf(n, w2) for n in scalars]
+    pres = [[_to_cached(p) for p in _odd_multiples(pt, w2)] for pt in pts]
+    i = max([len(naf1)] + [len(naf) for naf in nafs]) - 1
+    v = xform_affine_to_extended((0,1))
+    while i >= 0:
+        v = double_element(v)
+        if i < len(naf1) and naf1[i]:
+            digit = naf1[i]
+            if digit > 0:
+                v = _add_elements_precomputed(v, pre1[digit >> 1])
+            else:
+                (YpX, YmX, T2d) = pre1[(-digit) >> 1]
+                v = _add_elements_precomputed(v, (YmX, YpX, (-T2d) % Q))
+        for j in range(len(nafs)):
+            naf = nafs[j]
+            if i < len(naf) and naf[i]:
+                digit = naf[i]
+                if digit > 0:
+                    v = _add_elements_cached(v, pres[j][digit >> 1])
+                else:
+                    (YpX, YmX, Z2x2, T2d) = pres[j][(-digit) >> 1]
+                    v = _add_elements_cached(v, (YmX, YpX, Z2x2, (-T2d) % Q))
+        i -= 1
+    return v
+
+def double_scalarmult_vartime(a, pre1, w1, b, pt2, w2):
+    # a*P1 + b*P2, see multi_scalarmult_vartime
+    return multi_scalarmult_vartime(a, pre1, w1, [b], [pt2], w2)
+
+def negate_element(pt): # extended->extended
+    (X, Y, Z, T) = pt
+    return ((-X) % Q, Y, Z, (-T) % Q)
+
 # points are encoded as 32-bytes little-endian, b255 is sign, b2b1b0 are 0
 
 def encodepoint(P):
@@ -284,7 +480,7 @@ def is_extended_zero(XYTZ):
     (X, Y, Z, T) = XYTZ
     Y = Y % Q
     Z = Z % Q
-    if X==0 and Y==Z and Y!=0:
+    if X % Q == 0 and Y==Z and Y!=0:
         return True
     return False
 
@@ -313,7 +509,10 @@ class ElementOfUnknownGroup:
     def to_bytes(self):
         return encodepoint(xform_extended_to_affine(self.XYTZ))
     def __eq__(self, other):
-        return self.to_bytes() == other.to_bytes()
+        # X1/Z1 == X2/Z2 and Y1/Z1 == Y2/Z2, without the two inversions
+        (X1, Y1, Z1, _) = self.XYTZ
+        (X2, Y2, Z2, _) = other.XYTZ
+        return (X1*Z2 - X2*Z1) % Q == 0 and (Y1*Z2 - Y2*Z1) % Q == 0
     def __ne__(self, other):
         return not self == other
 
@@ -354,6 +553,86 @@ class Element(ElementOfUnknownGroup):
     def subtract(self, other):
         return self.add(other.negate())
 
+class FixedBaseElement(Element):
+    # the base point. scalarmult uses the comb table, which is built on first
+    # use. load_comb_table() keeps it in a file, so it survives a reboot.
+
+    def __init__(self, XYTZ, teeth=COMB_TEETH):
+        Element.__init__(self, XYTZ)
+        self.teeth = teeth
+        self.comb_table = None
+        self.naf_table = None
+
+    def scalarmult(self, s):
+        if isinstance(s, ElementOfUnknownGroup):
+            raise TypeError("elements cannot be multiplied together")
+        s = s % L
+        if s == 0:
+            return Zero
+        if self.comb_table is None:
+            self.comb_table = build_comb_table(self.XYTZ, self.teeth)
+        return Element(comb_scalarmult(self.comb_table, self.teeth, s))
+
+    def scalarmult_plain(self, s):
+        # double-and-add without the table, kept for comparison
+        return Element.scalarmult(self, s)
+
+    def get_naf_table(self):
+        # odd multiples of self for the wNAF based multiplications
+        if self.naf_table is None:
+            self.naf_table = _batch_to_precomputed(
+                _odd_multiples(self.XYTZ, NAF_WIDTH_BASE))
+        return self.naf_table
+
+    def double_scalarmult(self, a, other, b):
+        # a*self + b*other in a single pass, variable time (public scalars only)
+        if not isinstance(other, Element):
+            raise TypeError("other must be an element of the main subgroup")
+        XYTZ = double_scalarmult_vartime(a % L, self.get_naf_table(),
+                                         NAF_WIDTH_BASE, b % L, other.XYTZ,
+                                         NAF_WIDTH_VAR)
+        if is_extended_zero(XYTZ):
+            return Zero
+        return Element(XYTZ)
+
+    def save_comb_table(self, file_name):
+        if self.comb_table is None:
+            self.comb_table = build_comb_table(self.XYTZ, self.teeth)
+        f = open(file_name, "wb")
+        f.write(COMB_MAGIC + bytes([self.teeth]))
+        for entry in self.comb_table:
+            for coord in entry:
+                f.write(coord.to_bytes(32, 'little'))
+        f.close()
+
+    def load_comb_table(self, file_name):
+        # falls back to building (and saving) the table if the file is
+        # missing, truncated or was written for a different number of teeth
+        size = 5 + ((1 << self.teeth) - 1) * 96
+        try:
+            f = open(file_name, "rb")
+            raw = f.read()
+            f.close()
+        except OSError:
+            raw = b""
+        if len(raw) != size or raw[:5] != COMB_MAGIC + bytes([self.teeth]):
+            self.comb_table = None
+            self.save_comb_table(file_name)
+            return
+        table = []
+        for i in range(5, size, 96):
+            table.append((int.from_bytes(raw[i:i+32], 'little'),
+                          int.from_bytes(raw[i+32:i+64], 'little'),
+                          int.from_bytes(raw[i+64:i+96], 'little')))
+        del raw
+        # first entry is the base point itself
+        (x, y) = xform_extended_to_affine(self.XYTZ)
+        if table[0] != ((y+x) % Q, (y-x) % Q, (2*d*x*y) % Q):
+            self.comb_table = None
+            self.save_comb_table(file_name)
+            return
+        self.comb_table = table
+
 class _ZeroElement(ElementOfUnknownGroup):
     def add(self, other):
         return other # zero+anything = anything
@@ -365,7 +644,7 @@ class _ZeroElement(ElementOfUnknownGroup):
         return self.add(other.negate())
 
 
-Base = Element(xform_affine_to_extended(B))
+Base = FixedBaseElement(xform_affine_to_extended(B))
 Zero = _ZeroElement(xform_affine_to_extended((0,1))) # the neutral (identity) element
 
 _zero_bytes = Zero.to_bytes()
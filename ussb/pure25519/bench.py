@@ -0,0 +1,120 @@
+# pure25519/bench.py
+
+# rough timings of the Ed25519 hot paths, e.g.:
+#   micropython -c "import pure25519.bench as b; b.run()"
+
+import os
+
+try:
+    from time import ticks_ms, ticks_diff
+except ImportError:
+    # regular python
+    from time import perf_counter
+    ticks_ms = lambda: int(perf_counter() * 1000)
+    ticks_diff = lambda end, start: end - start
+
+from . import create_keypair, SigningKey, VerifyingKey, Hint, verify_batch
+from .basic import (Base, L, FixedBaseElement, COMB_TEETH, bytes_to_element,
+                    bytes_to_scalar, double_element, add_elements,
+                    scalarmult_element)
+
+def _random_scalars(n):
+    return [int.from_bytes(os.urandom(32), 'little') % L for _ in range(n)]
+
+def timeit(fn, args):
+    # returns the average time per call in ms
+    start = ticks_ms()
+    for a in args:
+        fn(a)
+    return ticks_diff(ticks_ms(), start) / len(args)
+
+def _report(name, ms, reference=None):
+    if reference is None:
+        print("{:<28} {:>9.3f} ms".format(name, ms))
+    else:
+        print("{:<28} {:>9.3f} ms  ({:.1f}x)".format(name, ms, reference / ms))
+
+def bench_point_ops(n=1000):
+    # the field arithmetic underneath everything else
+    pts = [Base.scalarmult(s).XYTZ for s in _random_scalars(8)]
+    pairs = [(pts[i % 8], pts[(i+3) % 8]) for i in range(n)]
+    _report("double_element", timeit(lambda p: double_element(p[0]), pairs))
+    _report("add_elements", timeit(lambda p: add_elements(p[0], p[1]), pairs))
+    scalars = _random_scalars(10)
+    _report("scalarmult_element", timeit(lambda s: scalarmult_element(pts[0], s), scalars))
+    elements = [Base.scalarmult(s) for s in _random_scalars(n // 10)]
+    _report("Element.__eq__", timeit(lambda e: e == Base, elements))
+
+def bench_base_scalarmult(n=20, teeth=COMB_TEETH):
+    scalars = _random_scalars(n)
+    base = FixedBaseElement(Base.XYTZ, teeth)
+
+    start = ticks_ms()
+    base.scalarmult(1) # builds the comb table
+    _report("comb table build (t={})".format(teeth), ticks_diff(ticks_ms(), start))
+
+    plain = timeit(base.scalarmult_plain, scalars)
+    _report("Base.scalarmult (plain)", plain)
+    _report("Base.scalarmult (comb)", timeit(base.scalarmult, scalars), plain)
+
+def bench_sign(n=10):
+    seeds = [os.urandom(32) for _ in range(n)]
+    keys = [SigningKey(s) for s in seeds]
+    msg = bytes(120)
+    table = Base.comb_table
+
+    Base.comb_table = None
+    Base.scalarmult = Base.scalarmult_plain
+    plain_kg = timeit(lambda _: create_keypair(), seeds)
+    plain_sign = timeit(lambda k: k.sign(msg), keys)
+    del Base.scalarmult
+
+    Base.comb_table = table
+    Base.scalarmult(1) # make sure the table exists
+    _report("create_keypair (plain)", plain_kg)
+    _report("create_keypair (comb)", timeit(lambda _: create_keypair(), seeds), plain_kg)
+    _report("sign (plain)", plain_sign)
+    _report("sign (comb)", timeit(lambda k: k.sign(msg), keys), plain_sign)
+
+def _verify_separate(vk, sig, msg):
+    # verification with two independent scalar multiplications
+    R = bytes_to_element(sig[:32])
+    A = bytes_to_element(vk)
+    S = bytes_to_scalar(sig[32:])
+    h = Hint(sig[:32] + vk + msg)
+    assert Base.scalarmult(S) == R.add(A.scalarmult(h))
+
+def bench_verify(n=10):
+    msg = bytes(120)
+    sigs = []
+    for _ in range(n):
+        sk, vk = create_keypair()
+        sigs.append((vk.vk_s, sk.sign(msg)))
+
+    separate = timeit(lambda t: _verify_separate(t[0], t[1], msg), sigs)
+    _report("verify (separate)", separate)
+    _report("verify (double-scalar)",
+            timeit(lambda t: VerifyingKey(t[0]).verify(t[1], msg), sigs), separate)
+
+def bench_verify_batch(n=16):
+    # a run of packets from the same feed
+    sk, vk = create_keypair()
+    items = []
+    for i in range(n):
+        msg = i.to_bytes(120, 'big')
+        items.append((vk.vk_s, msg, sk.sign(msg)))
+
+    single = timeit(lambda t: VerifyingKey(t[0]).verify(t[2], t[1]), items)
+    _report("verify (one by one)", single)
+    batch = timeit(verify_batch, [items]) / n
+    _report("verify_batch ({} sigs)".format(n), batch, single)
+
+def run():
+    bench_point_ops()
+    bench_base_scalarmult()
+    bench_sign()
+    bench_verify()
+    bench_verify_batch()
+
+if __name__ == "__main__":
+    run()
@@ -1,520 +1,318 @@
 """
-This code was Ported from CPython's sha512module.c
+SHA-512 (and SHA-384) for pure25519.
+
+sha512 and sha384 are the firmware's native implementation (uhashlib, or
+hashlib on regular python) if there is one that passes the known-answer
+test, else the pure python sha512_py / sha384_py below. BACKEND tells which
+one was picked. The pure version was originally ported from CPython's
+sha512module.c; it keeps the state and the message schedule in arrays of
+64 bit words (lists on ports without array("Q")), the pending input in a
+bytearray and compresses whole 128B blocks straight from the input.
 """
 
+try:
+    from ubinascii import hexlify, unhexlify
+except ImportError:
+    # regular python
+    from binascii import hexlify, unhexlify
+
 SHA_BLOCKSIZE = 128
 SHA_DIGESTSIZE = 64
 
+MASK64 = 0xFFFFFFFFFFFFFFFF
+
+try:
+    from array import array
+
+    array("Q", [MASK64])
+
+    def words(values):
+        return array("Q", values)
+
+    def schedule():
+        return array("Q", bytes(640))
+
+except (ImportError, ValueError, OverflowError):
+    # no unsigned 64 bit arrays on this port
+    words = list
+
+    def schedule():
+        return [0] * 80
+
+K = (
+    0x428A2F98D728AE22, 0x7137449123EF65CD, 0xB5C0FBCFEC4D3B2F, 0xE9B5DBA58189DBBC,
+    0x3956C25BF348B538, 0x59F111F1B605D019, 0x923F82A4AF194F9B, 0xAB1C5ED5DA6D8118,
+    0xD807AA98A3030242, 0x12835B0145706FBE, 0x243185BE4EE4B28C, 0x550C7DC3D5FFB4E2,
+    0x72BE5D74F27B896F, 0x80DEB1FE3B1696B1, 0x9BDC06A725C71235, 0xC19BF174CF692694,
+    0xE49B69C19EF14AD2, 0xEFBE4786384F25E3, 0x0FC19DC68B8CD5B5, 0x240CA1CC77AC9C65,
+    0x2DE92C6F592B0275, 0x4A7484AA6EA6E483, 0x5CB0A9DCBD41FBD4, 0x76F988DA831153B5,
+    0x983E5152EE66DFAB, 0xA831C66D2DB43210, 0xB00327C898FB213F, 0xBF597FC7BEEF0EE4,
+    0xC6E00BF33DA88FC2, 0xD5A79147930AA725, 0x06CA6351E003826F, 0x142929670A0E6E70,
+    0x27B70A8546D22FFC, 0x2E1B21385C26C926, 0x4D2C6DFC5AC42AED, 0x53380D139D95B3DF,
+    0x650A73548BAF63DE, 0x766A0ABB3C77B2A8, 0x81C2C92E47EDAEE6, 0x92722C851482353B,
+    0xA2BFE8A14CF10364, 0xA81A664BBC423001, 0xC24B8B70D0F89791, 0xC76C51A30654BE30,
+    0xD192E819D6EF5218, 0xD69906245565A910, 0xF40E35855771202A, 0x106AA07032BBD1B8,
+    0x19A4C116B8D2D0C8, 0x1E376C085141AB53, 0x2748774CDF8EEB99, 0x34B0BCB5E19B48A8,
+    0x391C0CB3C5C95A63, 0x4ED8AA4AE3418ACB, 0x5B9CCA4F7763E373, 0x682E6FF3D6B2B8A3,
+    0x748F82EE5DEFB2FC, 0x78A5636F43172F60, 0x84C87814A1F0AB72, 0x8CC702081A6439EC,
+    0x90BEFFFA23631E28, 0xA4506CEBDE82BDE9, 0xBEF9A3F7B2C67915, 0xC67178F2E372532B,
+    0xCA273ECEEA26619C, 0xD186B8C721C0C207, 0xEADA7DD6CDE0EB1E, 0xF57D4F7FEE6ED178,
+    0x06F067AA72176FBA, 0x0A637DC5A2C898A6, 0x113F9804BEF90DAE, 0x1B710B35131C471B,
+    0x28DB77F523047D84, 0x32CAAB7B40C72493, 0x3C9EBE0A15C9BEBC, 0x431D67C49C100D4C,
+    0x4CC5D4BECB3E42B6, 0x597F299CFC657E2A, 0x5FCB6FAB3AD6FAEC, 0x6C44198C4A475817,
+)
 
-def new_shaobject():
-    return {
-        "digest": [0] * 8,
-        "count_lo": 0,
-        "count_hi": 0,
-        "data": [0] * SHA_BLOCKSIZE,
-        "local": 0,
-        "digestsize": 0,
-    }
-
+SHA512_IV = (
+    0x6A09E667F3BCC908, 0xBB67AE8584CAA73B, 0x3C6EF372FE94F82B, 0xA54FF53A5F1D36F1,
+    0x510E527FADE682D1, 0x9B05688C2B3E6C1F, 0x1F83D9ABFB41BD6B, 0x5BE0CD19137E2179,
+)
 
-ROR64 = (
-    lambda x, y: (((x & 0xFFFFFFFFFFFFFFFF) >> (y & 63)) | (x << (64 - (y & 63))))
-    & 0xFFFFFFFFFFFFFFFF
+SHA384_IV = (
+    0xCBBB9D5DC1059ED8, 0x629A292A367CD507, 0x9159015A3070DD17, 0x152FECD8F70E5939,
+    0x67332667FFC00B31, 0x8EB44A8768581511, 0xDB0C2E0D64F98FA7, 0x47B5481DBEFA4FA4,
 )
-Ch = lambda x, y, z: (z ^ (x & (y ^ z)))
-Maj = lambda x, y, z: (((x | y) & z) | (x & y))
-S = lambda x, n: ROR64(x, n)
-R = lambda x, n: (x & 0xFFFFFFFFFFFFFFFF) >> n
-Sigma0 = lambda x: (S(x, 28) ^ S(x, 34) ^ S(x, 39))
-Sigma1 = lambda x: (S(x, 14) ^ S(x, 18) ^ S(x, 41))
-Gamma0 = lambda x: (S(x, 1) ^ S(x, 8) ^ R(x, 7))
-Gamma1 = lambda x: (S(x, 19) ^ S(x, 61) ^ R(x, 6))
-
-
-def sha_transform(sha_info):
-    W = []
-
-    d = sha_info["data"]
-    for i in range(0, 16):
-        W.append(
-            (d[8 * i] << 56)
-            + (d[8 * i + 1] << 48)
-            + (d[8 * i + 2] << 40)
-            + (d[8 * i + 3] << 32)
-            + (d[8 * i + 4] << 24)
-            + (d[8 * i + 5] << 16)
-            + (d[8 * i + 6] << 8)
-            + d[8 * i + 7]
-        )
-
-    for i in range(16, 80):
-        W.append(
-            (Gamma1(W[i - 2]) + W[i - 7] + Gamma0(W[i - 15]) + W[i - 16])
-            & 0xFFFFFFFFFFFFFFFF
-        )
-
-    ss = sha_info["digest"][:]
-
-    def RND(a, b, c, d, e, f, g, h, i, ki):
-        t0 = (h + Sigma1(e) + Ch(e, f, g) + ki + W[i]) & 0xFFFFFFFFFFFFFFFF
-        t1 = (Sigma0(a) + Maj(a, b, c)) & 0xFFFFFFFFFFFFFFFF
-        d = (d + t0) & 0xFFFFFFFFFFFFFFFF
-        h = (t0 + t1) & 0xFFFFFFFFFFFFFFFF
-        return d & 0xFFFFFFFFFFFFFFFF, h & 0xFFFFFFFFFFFFFFFF
-
-    ss[3], ss[7] = RND(
-        ss[0], ss[1], ss[2], ss[3], ss[4], ss[5], ss[6], ss[7], 0, 0x428A2F98D728AE22
-    )
-    ss[2], ss[6] = RND(
-        ss[7], ss[0], ss[1], ss[2], ss[3], ss[4], ss[5], ss[6], 1, 0x7137449123EF65CD
-    )
-    ss[1], ss[5] = RND(
-        ss[6], ss[7], ss[0], ss[1], ss[2], ss[3], ss[4], ss[5], 2, 0xB5C0FBCFEC4D3B2F
-    )
-    ss[0], ss[4] = RND(
-        ss[5], ss[6], ss[7], ss[0], ss[1], ss[2], ss[3], ss[4], 3, 0xE9B5DBA58189DBBC
-    )
-    ss[7], ss[3] = RND(
-        ss[4], ss[5], ss[6], ss[7], ss[0], ss[1], ss[2], ss[3], 4, 0x3956C25BF348B538
-    )
-    ss[6], ss[2] = RND(
-        ss[3], ss[4], ss[5], ss[6], ss[7], ss[0], ss[1], ss[2], 5, 0x59F111F1B605D019
-    )
-    ss[5], ss[1] = RND(
-        ss[2], ss[3], ss[4], ss[5], ss[6], ss[7], ss[0], ss[1], 6, 0x923F82A4AF194F9B
-    )
-    ss[4], ss[0] = RND(
-        ss[1], ss[2], ss[3], ss[4], ss[5], ss[6], ss[7], ss[0], 7, 0xAB1C5ED5DA6D8118
-    )
-    ss[3], ss[7] = RND(
-        ss[0], ss[1], ss[2], ss[3], ss[4], ss[5], ss[6], ss[7], 8, 0xD807AA98A3030242
-    )
-    ss[2], ss[6] = RND(
-        ss[7], ss[0], ss[1], ss[2], ss[3], ss[4], ss[5], ss[6], 9, 0x12835B0145706FBE
-    )
-    ss[1], ss[5] = RND(
-        ss[6], ss[7], ss[0], ss[1], ss[2], ss[3], ss[4], ss[5], 10, 0x243185BE4EE4B28C
-    )
-    ss[0], ss[4] = RND(
-        ss[5], ss[6], ss[7], ss[0], ss[1], ss[2], ss[3], ss[4], 11, 0x550C7DC3D5FFB4E2
-    )
-    ss[7], ss[3] = RND(
-        ss[4], ss[5], ss[6], ss[7], ss[0], ss[1], ss[2], ss[3], 12, 0x72BE5D74F27B896F
-    )
-    ss[6], ss[2] = RND(
-        ss[3], ss[4], ss[5], ss[6], ss[7], ss[0], ss[1], ss[2], 13, 0x80DEB1FE3B1696B1
-    )
-    ss[5], ss[1] = RND(
-        ss[2], ss[3], ss[4], ss[5], ss[6], ss[7], ss[0], ss[1], 14, 0x9BDC06A725C71235
-    )
-    ss[4], ss[0] = RND(
-        ss[1], ss[2], ss[3], ss[4], ss[5], ss[6], ss[7], ss[0], 15, 0xC19BF174CF692694
-    )
-    ss[3], ss[7] = RND(
-        ss[0], ss[1], ss[2], ss[3], ss[4], ss[5], ss[6], ss[7], 16, 0xE49B69C19EF14AD2
-    )
-    ss[2], ss[6] = RND(
-        ss[7], ss[0], ss[1], ss[2], ss[3], ss[4], ss[5], ss[6], 17, 0xEFBE4786384F25E3
-    )
-    ss[1], ss[5] = RND(
-        ss[6], ss[7], ss[0], ss[1], ss[2], ss[3], ss[4], ss[5], 18, 0x0FC19DC68B8CD5B5
-    )
-    ss[0], ss[4] = RND(
-        ss[5], ss[6], ss[7], ss[0], ss[1], ss[2], ss[3], ss[4], 19, 0x240CA1CC77AC9C65
-    )
-    ss[7], ss[3] = RND(
-        ss[4], ss[5], ss[6], ss[7], ss[0], ss[1], ss[2], ss[3], 20, 0x2DE92C6F592B0275
-    )
-    ss[6], ss[2] = RND(
-        ss[3], ss[4], ss[5], ss[6], ss[7], ss[0], ss[1], ss[2], 21, 0x4A7484AA6EA6E483
-    )
-    ss[5], ss[1] = RND(
-        ss[2], ss[3], ss[4], ss[5], ss[6], ss[7], ss[0], ss[1], 22, 0x5CB0A9DCBD41FBD4
-    )
-    ss[4], ss[0] = RND(
-        ss[1], ss[2], ss[3], ss[4], ss[5], ss[6], ss[7], ss[0], 23, 0x76F988DA831153B5
-    )
-    ss[3], ss[7] = RND(
-        ss[0], ss[1], ss[2], ss[3], ss[4], ss[5], ss[6], ss[7], 24, 0x983E5152EE66DFAB
-    )
-    ss[2], ss[6] = RND(
-        ss[7], ss[0], ss[1], ss[2], ss[3], ss[4], ss[5], ss[6], 25, 0xA831C66D2DB43210
-    )
-    ss[1], ss[5] = RND(
-        ss[6], ss[7], ss[0], ss[1], ss[2], ss[3], ss[4], ss[5], 26, 0xB00327C898FB213F
-    )
-    ss[0], ss[4] = RND(
-        ss[5], ss[6], ss[7], ss[0], ss[1], ss[2], ss[3], ss[4], 27, 0xBF597FC7BEEF0EE4
-    )
-    ss[7], ss[3] = RND(
-        ss[4], ss[5], ss[6], ss[7], ss[0], ss[1], ss[2], ss[3], 28, 0xC6E00BF33DA88FC2
-    )
-    ss[6], ss[2] = RND(
-        ss[3], ss[4], ss[5], ss[6], ss[7], ss[0], ss[1], ss[2], 29, 0xD5A79147930AA725
-    )
-    ss[5], ss[1] = RND(
-        ss[2], ss[3], ss[4], ss[5], ss[6], ss[7], ss[0], ss[1], 30, 0x06CA6351E003826F
-    )
-    ss[4], ss[0] = RND(
-        ss[1], ss[2], ss[3], ss[4], ss[5], ss[6], ss[7], ss[0], 31, 0x142929670A0E6E70
-    )
-    ss[3], ss[7] = RND(
-        ss[0], ss[1], ss[2], ss[3], ss[4], ss[5], ss[6], ss[7], 32, 0x27B70A8546D22FFC
-    )
-    ss[2], ss[6] = RND(
-        ss[7], ss[0], ss[1], ss[2], ss[3], ss[4], ss[5], ss[6], 33, 0x2E1B21385C26C926
-    )
-    ss[1], ss[5] = RND(
-        ss[6], ss[7], ss[0], ss[1], ss[2], ss[3], ss[4], ss[5], 34, 0x4D2C6DFC5AC42AED
-    )
-    ss[0], ss[4] = RND(
-        ss[5], ss[6], ss[7], ss[0], ss[1], ss[2], ss[3], ss[4], 35, 0x53380D139D95B3DF
-    )
-    ss[7], ss[3] = RND(
-        ss[4], ss[5], ss[6], ss[7], ss[0], ss[1], ss[2], ss[3], 36, 0x650A73548BAF63DE
-    )
-    ss[6], ss[2] = RND(
-        ss[3], ss[4], ss[5], ss[6], ss[7], ss[0], ss[1], ss[2], 37, 0x766A0ABB3C77B2A8
-    )
-    ss[5], ss[1] = RND(
-        ss[2], ss[3], ss[4], ss[5], ss[6], ss[7], ss[0], ss[1], 38, 0x81C2C92E47EDAEE6
-    )
-    ss[4], ss[0] = RND(
-        ss[1], ss[2], ss[3], ss[4], ss[5], ss[6], ss[7], ss[0], 39, 0x92722C851482353B
-    )
-    ss[3], ss[7] = RND(
-        ss[0], ss[1], ss[2], ss[3], ss[4], ss[5], ss[6], ss[7], 40, 0xA2BFE8A14CF10364
-    )
-    ss[2], ss[6] = RND(
-        ss[7], ss[0], ss[1], ss[2], ss[3], ss[4], ss[5], ss[6], 41, 0xA81A664BBC423001
-    )
-    ss[1], ss[5] = RND(
-        ss[6], ss[7], ss[0], ss[1], ss[2], ss[3], ss[4], ss[5], 42, 0xC24B8B70D0F89791
-    )
-    ss[0], ss[4] = RND(
-        ss[5], ss[6], ss[7], ss[0], ss[1], ss[2], ss[3], ss[4], 43, 0xC76C51A30654BE30
-    )
-    ss[7], ss[3] = RND(
-        ss[4], ss[5], ss[6], ss[7], ss[0], ss[1], ss[2], ss[3], 44, 0xD192E819D6EF5218
-    )
-    ss[6], ss[2] = RND(
-        ss[3], ss[4], ss[5], ss[6], ss[7], ss[0], ss[1], ss[2], 45, 0xD69906245565A910
-    )
-    ss[5], ss[1] = RND(
-        ss[2], ss[3], ss[4], ss[5], ss[6], ss[7], ss[0], ss[1], 46, 0xF40E35855771202A
-    )
-    ss[4], ss[0] = RND(
-        ss[1], ss[2], ss[3], ss[4], ss[5], ss[6], ss[7], ss[0], 47, 0x106AA07032BBD1B8
-    )
-    ss[3], ss[7] = RND(
-        ss[0], ss[1], ss[2], ss[3], ss[4], ss[5], ss[6], ss[7], 48, 0x19A4C116B8D2D0C8
-    )
-    ss[2], ss[6] = RND(
-        ss[7], ss[0], ss[1], ss[2], ss[3], ss[4], ss[5], ss[6], 49, 0x1E376C085141AB53
-    )
-    ss[1], ss[5] = RND(
-        ss[6], ss[7], ss[0], ss[1], ss[2], ss[3], ss[4], ss[5], 50, 0x2748774CDF8EEB99
-    )
-    ss[0], ss[4] = RND(
-        ss[5], ss[6], ss[7], ss[0], ss[1], ss[2], ss[3], ss[4], 51, 0x34B0BCB5E19B48A8
-    )
-    ss[7], ss[3] = RND(
-        ss[4], ss[5], ss[6], ss[7], ss[0], ss[1], ss[2], ss[3], 52, 0x391C0CB3C5C95A63
-    )
-    ss[6], ss[2] = RND(
-        ss[3], ss[4], ss[5], ss[6], ss[7], ss[0], ss[1], ss[2], 53, 0x4ED8AA4AE3418ACB
-    )
-    ss[5], ss[1] = RND(
-        ss[2], ss[3], ss[4], ss[5], ss[6], ss[7], ss[0], ss[1], 54, 0x5B9CCA4F7763E373
-    )
-    ss[4], ss[0] = RND(
-        ss[1], ss[2], ss[3], ss[4], ss[5], ss[6], ss[7], ss[0], 55, 0x682E6FF3D6B2B8A3
-    )
-    ss[3], ss[7] = RND(
-        ss[0], ss[1], ss[2], ss[3], ss[4], ss[5], ss[6], ss[7], 56, 0x748F82EE5DEFB2FC
-    )
-    ss[2], ss[6] = RND(
-        ss[7], ss[0], ss[1], ss[2], ss[3], ss[4], ss[5], ss[6], 57, 0x78A5636F43172F60
-    )
-    ss[1], ss[5] = RND(
-        ss[6], ss[7], ss[0], ss[1], ss[2], ss[3], ss[4], ss[5], 58, 0x84C87814A1F0AB72
-    )
-    ss[0], ss[4] = RND(
-        ss[5], ss[6], ss[7], ss[0], ss[1], ss[2], ss[3], ss[4], 59, 0x8CC702081A6439EC
-    )
-    ss[7], ss[3] = RND(
-        ss[4], ss[5], ss[6], ss[7], ss[0], ss[1], ss[2], ss[3], 60, 0x90BEFFFA23631E28
-    )
-    ss[6], ss[2] = RND(
-        ss[3], ss[4], ss[5], ss[6], ss[7], ss[0], ss[1], ss[2], 61, 0xA4506CEBDE82BDE9
-    )
-    ss[5], ss[1] = RND(
-        ss[2], ss[3], ss[4], ss[5], ss[6], ss[7], ss[0], ss[1], 62, 0xBEF9A3F7B2C67915
-    )
-    ss[4], ss[0] = RND(
-        ss[1], ss[2], ss[3], ss[4], ss[5], ss[6], ss[7], ss[0], 63, 0xC67178F2E372532B
-    )
-    ss[3], ss[7] = RND(
-        ss[0], ss[1], ss[2], ss[3], ss[4], ss[5], ss[6], ss[7], 64, 0xCA273ECEEA26619C
-    )
-    ss[2], ss[6] = RND(
-        ss[7], ss[0], ss[1], ss[2], ss[3], ss[4], ss[5], ss[6], 65, 0xD186B8C721C0C207
-    )
-    ss[1], ss[5] = RND(
-        ss[6], ss[7], ss[0], ss[1], ss[2], ss[3], ss[4], ss[5], 66, 0xEADA7DD6CDE0EB1E
-    )
-    ss[0], ss[4] = RND(
-        ss[5], ss[6], ss[7], ss[0], ss[1], ss[2], ss[3], ss[4], 67, 0xF57D4F7FEE6ED178
-    )
-    ss[7], ss[3] = RND(
-        ss[4], ss[5], ss[6], ss[7], ss[0], ss[1], ss[2], ss[3], 68, 0x06F067AA72176FBA
-    )
-    ss[6], ss[2] = RND(
-        ss[3], ss[4], ss[5], ss[6], ss[7], ss[0], ss[1], ss[2], 69, 0x0A637DC5A2C898A6
-    )
-    ss[5], ss[1] = RND(
-        ss[2], ss[3], ss[4], ss[5], ss[6], ss[7], ss[0], ss[1], 70, 0x113F9804BEF90DAE
-    )
-    ss[4], ss[0] = RND(
-        ss[1], ss[2], ss[3], ss[4], ss[5], ss[6], ss[7], ss[0], 71, 0x1B710B35131C471B
-    )
-    ss[3], ss[7] = RND(
-        ss[0], ss[1], ss[2], ss[3], ss[4], ss[5], ss[6], ss[7], 72, 0x28DB77F523047D84
-    )
-    ss[2], ss[6] = RND(
-        ss[7], ss[0], ss[1], ss[2], ss[3], ss[4], ss[5], ss[6], 73, 0x32CAAB7B40C72493
-    )
-    ss[1], ss[5] = RND(
-        ss[6], ss[7], ss[0], ss[1], ss[2], ss[3], ss[4], ss[5], 74, 0x3C9EBE0A15C9BEBC
-    )
-    ss[0], ss[4] = RND(
-        ss[5], ss[6], ss[7], ss[0], ss[1], ss[2], ss[3], ss[4], 75, 0x431D67C49C100D4C
-    )
-    ss[7], ss[3] = RND(
-        ss[4], ss[5], ss[6], ss[7], ss[0], ss[1], ss[2], ss[3], 76, 0x4CC5D4BECB3E42B6
-    )
-    ss[6], ss[2] = RND(
-        ss[3], ss[4], ss[5], ss[6], ss[7], ss[0], ss[1], ss[2], 77, 0x597F299CFC657E2A
-    )
-    ss[5], ss[1] = RND(
-        ss[2], ss[3], ss[4], ss[5], ss[6], ss[7], ss[0], ss[1], 78, 0x5FCB6FAB3AD6FAEC
-    )
-    ss[4], ss[0] = RND(
-        ss[1], ss[2], ss[3], ss[4], ss[5], ss[6], ss[7], ss[0], 79, 0x6C44198C4A475817
-    )
 
-    dig = []
-    for i, x in enumerate(sha_info["digest"]):
-        dig.append((x + ss[i]) & 0xFFFFFFFFFFFFFFFF)
-    sha_info["digest"] = dig
-
-
-def sha_init():
-    sha_info = new_shaobject()
-    sha_info["digest"] = [
-        0x6A09E667F3BCC908,
-        0xBB67AE8584CAA73B,
-        0x3C6EF372FE94F82B,
-        0xA54FF53A5F1D36F1,
-        0x510E527FADE682D1,
-        0x9B05688C2B3E6C1F,
-        0x1F83D9ABFB41BD6B,
-        0x5BE0CD19137E2179,
-    ]
-    sha_info["count_lo"] = 0
-    sha_info["count_hi"] = 0
-    sha_info["local"] = 0
-    sha_info["digestsize"] = 64
-    return sha_info
-
-
-def sha384_init():
-    sha_info = new_shaobject()
-    sha_info["digest"] = [
-        0xCBBB9D5DC1059ED8,
-        0x629A292A367CD507,
-        0x9159015A3070DD17,
-        0x152FECD8F70E5939,
-        0x67332667FFC00B31,
-        0x8EB44A8768581511,
-        0xDB0C2E0D64F98FA7,
-        0x47B5481DBEFA4FA4,
-    ]
-    sha_info["count_lo"] = 0
-    sha_info["count_hi"] = 0
-    sha_info["local"] = 0
-    sha_info["digestsize"] = 48
-    return sha_info
+
+def sha_transform(state, block, off, W):
+    """
+    Compresses the 128B block starting at block[off] into state (8 words),
+    using W (80 words) for the message schedule. The rotations are written
+    out, every word is below 2^64.
+    """
+    for t in range(16):
+        i = off + 8 * t
+        W[t] = int.from_bytes(block[i : i + 8], "big")
+    for t in range(16, 80):
+        x = W[t - 15]
+        s0 = ((x >> 1 | x << 63) ^ (x >> 8 | x << 56) ^ (x >> 7)) & MASK64
+        x = W[t - 2]
+        s1 = ((x >> 19 | x << 45) ^ (x >> 61 | x << 3) ^ (x >> 6)) & MASK64
+        W[t] = (W[t - 16] + s0 + W[t - 7] + s1) & MASK64
+
+    a, b, c, d, e, f, g, h = state
+    for t in range(80):
+        S1 = ((e >> 14 | e << 50) ^ (e >> 18 | e << 46) ^ (e >> 41 | e << 23)) & MASK64
+        t1 = h + S1 + (g ^ (e & (f ^ g))) + K[t] + W[t]
+        S0 = ((a >> 28 | a << 36) ^ (a >> 34 | a << 30) ^ (a >> 39 | a << 25)) & MASK64
+        t2 = S0 + ((a & b) | (c & (a | b)))
+        h = g
+        g = f
+        f = e
+        e = (d + t1) & MASK64
+        d = c
+        c = b
+        b = a
+        a = (t1 + t2) & MASK64
+
+    state[0] = (state[0] + a) & MASK64
+    state[1] = (state[1] + b) & MASK64
+    state[2] = (state[2] + c) & MASK64
+    state[3] = (state[3] + d) & MASK64
+    state[4] = (state[4] + e) & MASK64
+    state[5] = (state[5] + f) & MASK64
+    state[6] = (state[6] + g) & MASK64
+    state[7] = (state[7] + h) & MASK64
 
 
 def getbuf(s):
     if isinstance(s, str):
         return s.encode("ascii")
     else:
-        return bytes(s)
-
-
-def sha_update(sha_info, buffer):
-    if isinstance(buffer, str):
-        raise TypeError("Unicode strings must be encoded before hashing")
-    count = len(buffer)
-    buffer_idx = 0
-    clo = (sha_info["count_lo"] + (count << 3)) & 0xFFFFFFFF
-    if clo < sha_info["count_lo"]:
-        sha_info["count_hi"] += 1
-    sha_info["count_lo"] = clo
-
-    sha_info["count_hi"] += count >> 29
-
-    if sha_info["local"]:
-        i = SHA_BLOCKSIZE - sha_info["local"]
-        if i > count:
-            i = count
-
-        # copy buffer
-        for x in enumerate(buffer[buffer_idx : buffer_idx + i]):
-            sha_info["data"][sha_info["local"] + x[0]] = x[1]
-
-        count -= i
-        buffer_idx += i
-
-        sha_info["local"] += i
-        if sha_info["local"] == SHA_BLOCKSIZE:
-            sha_transform(sha_info)
-            sha_info["local"] = 0
-        else:
-            return
-
-    while count >= SHA_BLOCKSIZE:
-        # copy buffer
-        sha_info["data"] = list(buffer[buffer_idx : buffer_idx + SHA_BLOCKSIZE])
-        count -= SHA_BLOCKSIZE
-        buffer_idx += SHA_BLOCKSIZE
-        sha_transform(sha_info)
-
-    # copy buffer
-    pos = sha_info["local"]
-    sha_info["data"][pos : pos + count] = list(buffer[buffer_idx : buffer_idx + count])
-    sha_info["local"] = count
-
-
-def sha_final(sha_info):
-    lo_bit_count = sha_info["count_lo"]
-    hi_bit_count = sha_info["count_hi"]
-    count = (lo_bit_count >> 3) & 0x7F
-    sha_info["data"][count] = 0x80
-    count += 1
-    if count > SHA_BLOCKSIZE - 16:
-        # zero the bytes in data after the count
-        sha_info["data"] = sha_info["data"][:count] + ([0] * (SHA_BLOCKSIZE - count))
-        sha_transform(sha_info)
-        # zero bytes in data
-        sha_info["data"] = [0] * SHA_BLOCKSIZE
-    else:
-        sha_info["data"] = sha_info["data"][:count] + ([0] * (SHA_BLOCKSIZE - count))
-
-    sha_info["data"][112] = 0
-    sha_info["data"][113] = 0
-    sha_info["data"][114] = 0
-    sha_info["data"][115] = 0
-    sha_info["data"][116] = 0
-    sha_info["data"][117] = 0
-    sha_info["data"][118] = 0
-    sha_info["data"][119] = 0
-
-    sha_info["data"][120] = (hi_bit_count >> 24) & 0xFF
-    sha_info["data"][121] = (hi_bit_count >> 16) & 0xFF
-    sha_info["data"][122] = (hi_bit_count >> 8) & 0xFF
-    sha_info["data"][123] = (hi_bit_count >> 0) & 0xFF
-    sha_info["data"][124] = (lo_bit_count >> 24) & 0xFF
-    sha_info["data"][125] = (lo_bit_count >> 16) & 0xFF
-    sha_info["data"][126] = (lo_bit_count >> 8) & 0xFF
-    sha_info["data"][127] = (lo_bit_count >> 0) & 0xFF
-
-    sha_transform(sha_info)
-
-    dig = []
-    for i in sha_info["digest"]:
-        dig.extend(
-            [
-                ((i >> 56) & 0xFF),
-                ((i >> 48) & 0xFF),
-                ((i >> 40) & 0xFF),
-                ((i >> 32) & 0xFF),
-                ((i >> 24) & 0xFF),
-                ((i >> 16) & 0xFF),
-                ((i >> 8) & 0xFF),
-                (i & 0xFF),
-            ]
-        )
-    return bytes(dig)
-
-
-class sha512(object):
+        return s
+
+
+class sha512_py(object):
     digest_size = digestsize = SHA_DIGESTSIZE
     block_size = SHA_BLOCKSIZE
+    _iv = SHA512_IV
 
     def __init__(self, s=None):
-        self._sha = sha_init()
+        self._state = words(self._iv)
+        self._w = schedule()  # message schedule, see sha_transform
+        self._buf = bytearray(SHA_BLOCKSIZE)  # pending input
+        self._local = 0  # number of bytes in _buf
+        self._count = 0  # total number of bytes
         if s:
-            sha_update(self._sha, getbuf(s))
+            self.update(s)
 
     def update(self, s):
-        sha_update(self._sha, getbuf(s))
+        if isinstance(s, str):
+            raise TypeError("Unicode strings must be encoded before hashing")
+        data = memoryview(getbuf(s))
+        count = len(data)
+        self._count += count
+        idx = 0
+        if self._local:
+            i = min(SHA_BLOCKSIZE - self._local, count)
+            self._buf[self._local : self._local + i] = data[:i]
+            self._local += i
+            idx = i
+            if self._local < SHA_BLOCKSIZE:
+                return
+            sha_transform(self._state, self._buf, 0, self._w)
+            self._local = 0
+        # whole blocks are compressed without copying them into _buf
+        while count - idx >= SHA_BLOCKSIZE:
+            sha_transform(self._state, data, idx, self._w)
+            idx += SHA_BLOCKSIZE
+        self._buf[: count - idx] = data[idx:]
+        self._local = count - idx
 
     def digest(self):
-        return sha_final(self._sha.copy())[: self._sha["digestsize"]]
+        # padding: 0x80, zeros, 128 bit length (big endian)
+        state = words(self._state)
+        buf = bytearray(self._buf[: self._local])
+        buf.append(0x80)
+        pad = (SHA_BLOCKSIZE - 16 - len(buf)) % SHA_BLOCKSIZE
+        buf.extend(bytes(pad))
+        buf.extend((self._count << 3).to_bytes(16, "big"))
+        for off in range(0, len(buf), SHA_BLOCKSIZE):
+            sha_transform(state, buf, off, self._w)
+        dig = b"".join([x.to_bytes(8, "big") for x in state])
+        return dig[: self.digest_size]
 
     def hexdigest(self):
         return "".join(["%.2x" % i for i in self.digest()])
 
     def copy(self):
-        new = sha512()
-        new._sha = self._sha.copy()
+        new = self.__class__()
+        new._state = words(self._state)
+        new._buf[:] = self._buf
+        new._local = self._local
+        new._count = self._count
         return new
 
 
-class sha384(sha512):
+class sha384_py(sha512_py):
     digest_size = digestsize = 48
-
-    def __init__(self, s=None):
-        self._sha = sha384_init()
-        if s:
-            sha_update(self._sha, getbuf(s))
-
-    def copy(self):
-        new = sha384()
-        new._sha = self._sha.copy()
-        return new
-
-
-def test():
-    a_str = "just a test string"
+    _iv = SHA384_IV
+
+
+def _native(name):
+    # the firmware's implementation, if it has one and it gets "abc" right
+    for mod_name in ("uhashlib", "hashlib"):
+        try:
+            mod = __import__(mod_name)
+            cls = getattr(mod, name)
+            if cls(b"abc").digest() == KAT_ABC[name]:
+                return cls, mod_name
+        except (ImportError, AttributeError, ValueError, OSError):
+            pass
+    return None, None
+
+
+KAT_ABC = {
+    "sha512": unhexlify(
+        "ddaf35a193617abacc417349ae20413112e6fa4e89a97ea20a9eeee64b55d39a"
+        "2192992a274fc1a836ba3c23a3feebbd454d4423643ce80e2a9ac94fa54ca49f"
+    ),
+    "sha384": unhexlify(
+        "cb00753f45a35e8bb5a03d699ac65007272c32ab0eded163"
+        "1a8b605a43ff5bed8086072ba1e7cc2358baeca134c825a7"
+    ),
+}
+
+sha512, BACKEND = _native("sha512")
+if sha512 is None:
+    sha512, BACKEND = sha512_py, "python"
+sha384, _ = _native("sha384")
+if sha384 is None:
+    sha384 = sha384_py
+
+
+def test(impl=sha512_py):
+    a_str = b"just a test string"
 
     assert (
-        sha512().digest()
+        impl().digest()
         == b"\xcf\x83\xe15~\xef\xb8\xbd\xf1T(P\xd6m\x80\x07\xd6 \xe4\x05\x0bW\x15\xdc\x83\xf4\xa9!\xd3l\xe9\xceG\xd0\xd1<]\x85\xf2\xb0\xff\x83\x18\xd2\x87~\xec/c\xb91\xbdGAz\x81\xa582z\xf9'\xda>"
     )
+    assert impl(b"abc").digest() == KAT_ABC["sha512"]
     assert (
-        sha512().hexdigest()
-        == "cf83e1357eefb8bdf1542850d66d8007d620e4050b5715dc83f4a921d36ce9ce47d0d13c5d85f2b0ff8318d2877eec2f63b931bd47417a81a538327af927da3e"
-    )
-    assert (
-        sha512(a_str).hexdigest()
+        hexlify(impl(a_str).digest()).decode()
         == "68be4c6664af867dd1d01c8d77e963d87d77b702400c8fabae355a41b8927a5a5533a7f1c28509bbd65c5f3ac716f33be271fbda0ca018b71a84708c9fae8a53"
     )
     assert (
-        sha512(a_str * 7).hexdigest()
+        hexlify(impl(a_str * 7).digest()).decode()
         == "3233acdbfcfff9bff9fc72401d31dbffa62bd24e9ec846f0578d647da73258d9f0879f7fde01fe2cc6516af3f343807fdef79e23d696c923d79931db46bf1819"
     )
-
-    s = sha512(a_str)
+    # FIPS 180-2, two block message
+    assert (
+        hexlify(impl(
+            b"abcdefghbcdefghicdefghijdefghijkefghijklfghijklmghijklmn"
+            b"hijklmnoijklmnopjklmnopqklmnopqrlmnopqrsmnopqrstnopqrstu"
+        ).digest()).decode()
+        == "8e959b75dae313da8cf4f72814fc143f8f7779c6eb9f7fa17299aeadb6889018501d289e4900f7e4331b99dec4b5433ac7d329eeb6dd26545e96e55b874be909"
+    )
+
+    # around the padding and block boundaries, bytes 0, 1, 2, ...
+    boundaries = {
+        111: "a1a111449b198d9b1f538bad7f3fc1022b3a5b1a5e90a0bc860de8512746cbc31599e6c834de3a3235327af0b51ff57bf7acf1974a73014d9c3953812edc7c8d",
+        112: "c5fbd731d19d2ae1180f001be72c2c1aaba1d7b094b3748880e24593b8e117a750e11c1bd867cc2f96dace8c8b74abd2d5c4f236be444e77d30d1916174070b9",
+        127: "eab89674feaa34e27aebeeff3c0a4d70070bb872d5e9f186cf1dbbdee517b6e35724d629ff025a5b07185e911ada7e3c8acf830aa0e4f71777bd2d44f504f7f0",
+        128: "1dffd5e3adb71d45d2245939665521ae001a317a03720a45732ba1900ca3b8351fc5c9b4ca513eba6f80bc7b1d1fdad4abd13491cb824d61b08d8c0e1561b3f7",
+        129: "1d9da57fbbdab09afb3506ab2d223d06109d65c1c8ad197f50138f714bc4c3f2fe5787922639c680acad1c651f955990425954ce2cba0c5cc83f2667d878eb0f",
+        239: "cb4c7fd522756d5781ad3a4f590a1d862906b960e7720136cb3fb36b563caa1ea5689134291fa79c80ccc2b4092b41df32ebdcb36dbe79db483440228c1622a8",
+        1000: "6cd2eda9bf9c0597129029b0054b81e433f6b8b7b499a75eb705efd74bac194149835b1d1a14c48be696e4d588456d512a22eae7aa1b57be2b56eae7d35e08cb",
+    }
+    for n in boundaries:
+        data = bytes([i & 0xFF for i in range(n)])
+        assert hexlify(impl(data).digest()).decode() == boundaries[n]
+        # same thing, fed in uneven pieces
+        s = impl()
+        for i in range(0, n, 37):
+            s.update(data[i : i + 37])
+        assert hexlify(s.digest()).decode() == boundaries[n]
+
+    s = impl(a_str)
     s.update(a_str)
     assert (
-        s.hexdigest()
+        hexlify(s.digest()).decode()
         == "341aeb668730bbb48127d5531115f3c39d12cb9586a6ca770898398aff2411087cfe0b570689adf328cddeb1f00803acce6737a19f310b53bbdb0320828f75bb"
     )
 
+    if impl is sha512_py:
+        assert sha384_py(b"abc").digest() == KAT_ABC["sha384"]
+        # digest() must not change the state
+        s = impl(a_str)
+        assert s.digest() == s.digest()
+        assert s.copy().digest() == s.digest()
+
+
+def bench(size=16384, rounds=4):
+    """
+    Prints the throughput (MB/s) of the selected backend and the pure one,
+    both for bulk data and for the short messages pure25519 hashes.
+    """
+    try:
+        from time import ticks_ms, ticks_diff
+    except ImportError:
+        from time import perf_counter
+
+        ticks_ms = lambda: int(perf_counter() * 1000)
+        ticks_diff = lambda end, start: end - start
+
+    data = bytes(size)
+    short = bytes(184)
+    impls = [(BACKEND, sha512)]
+    if sha512 is not sha512_py:
+        impls.append(("python", sha512_py))
+    for name, impl in impls:
+        for label, msg, n in (("bulk", data, rounds), ("184B", short, 200)):
+            start = ticks_ms()
+            for _ in range(n):
+                impl(msg).digest()
+            ms = max(ticks_diff(ticks_ms(), start), 1)
+            print(
+                "sha512 {:<9} {:<5} {:>9.3f} MB/s".format(
+                    name, label, len(msg) * n / ms / 1000
+                )
+            )
+
 
 if __name__ == "__main__":
     test()
+    if sha512 is not sha512_py:
+        test(sha512)
+    print("sha512: known answers ok, backend", BACKEND)
+    bench()
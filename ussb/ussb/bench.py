@@ -0,0 +1,133 @@
+"""
+Rough timings of feed access. Run it in a node directory, e.g.:
+    micropython -c "import ussb.bench as b; b.run()"
+Everything happens in the scratch directory _bench, which is removed again.
+"""
+
+from . import feed as feeds
+from .feed import (
+    create_feed,
+    get_children,
+    get_feed,
+    get_newest_apply,
+    get_types,
+    get_wire,
+    list_fids,
+    save_header,
+    use_backend,
+)
+from .packet import MKCHILD, PLAIN48
+from .storage import FEED_BACKEND, LOG_POOL_SIZE
+from .util import listdir
+from os import urandom
+from uos import chdir, mkdir, remove, rmdir
+
+try:
+    from time import ticks_ms, ticks_diff
+except ImportError:
+    # regular python
+    from time import perf_counter
+
+    ticks_ms = lambda: int(perf_counter() * 1000)
+    ticks_diff = lambda end, start: end - start
+
+
+BENCH_DIR = "_bench"
+
+
+def _report(name: str, ms: float, reference: float = None) -> None:
+    if reference is None:
+        print("{:<32} {:>9.1f} ms".format(name, ms))
+    else:
+        print(
+            "{:<32} {:>9.1f} ms  ({:.1f}x)".format(name, ms, reference / max(ms, 0.1))
+        )
+
+
+def make_feed(n: int) -> bytearray:
+    """
+    Creates a feed with n packets and returns its feed ID.
+    The (unsigned) packets are written straight to the log, scans do not
+    verify them.
+    """
+    fid = bytearray(urandom(32))
+    feed = create_feed(fid)
+    wires = bytearray(128 * 100)
+    wires[128 * 99 + 15] = MKCHILD
+    for i in range(0, n, 100):
+        feeds.store.append_log(fid, wires[: 128 * min(100, n - i)])
+    feed.front_seq = n
+    save_header(feed)
+    get_types(feed)  # builds the type index
+    return fid
+
+
+def _scan_types(feed) -> None:
+    # reads the type of every packet from the log
+    for i in range(feed.anchor_seq + 1, feed.front_seq + 1):
+        get_wire(feed, i)[15]
+
+
+def _time_scans(fid: bytearray, pool_size: int, rounds: int) -> float:
+    feeds.store.pool.resize(pool_size)
+    feed = get_feed(fid)
+    start = ticks_ms()
+    for _ in range(rounds):
+        _scan_types(feed)
+    return ticks_diff(ticks_ms(), start) / rounds
+
+
+def bench_feed_scan(n: int = 10000, rounds: int = 3) -> None:
+    """
+    Full-feed scans with and without pooled log file handles, and the
+    lookups that use the type index instead (file-per-feed backend).
+    """
+    use_backend("file")
+    fid = make_feed(n)
+    unpooled = _time_scans(fid, 0, rounds)
+    _report("scan {} pkts (open per read)".format(n), unpooled)
+    pooled = _time_scans(fid, LOG_POOL_SIZE, rounds)
+    _report("scan {} pkts (pooled handle)".format(n), pooled, unpooled)
+
+    feed = get_feed(fid)
+    start = ticks_ms()
+    for _ in range(rounds):
+        get_children(feed)
+        get_newest_apply(feed, bytearray(32))
+    indexed = ticks_diff(ticks_ms(), start) / rounds
+    _report("children + apply ({} pkts, .idx)".format(n), indexed, pooled)
+
+
+def bench_list_fids(n: int = 200, rounds: int = 20) -> None:
+    """
+    Listing n feeds and reading their headers with both storage backends.
+    """
+    # packed first: it would take over the feeds stored as files
+    times = {}
+    for backend in ("packed", "file"):
+        use_backend(backend)
+        for _ in range(n):
+            make_feed(1)
+        start = ticks_ms()
+        for _ in range(rounds):
+            for fid in list_fids():
+                feeds.store.read_header(fid)
+        times[backend] = ticks_diff(ticks_ms(), start) / rounds
+    _report("list {} feeds (file)".format(n), times["file"])
+    _report("list {} feeds (packed)".format(n), times["packed"], times["file"])
+
+
+def run() -> None:
+    mkdir(BENCH_DIR)
+    chdir(BENCH_DIR)
+    try:
+        mkdir("_feeds")
+        bench_feed_scan()
+        bench_list_fids()
+    finally:
+        use_backend(FEED_BACKEND)
+        for file in listdir("_feeds"):
+            remove("_feeds/{}".format(file))
+        rmdir("_feeds")
+        chdir("..")
+        rmdir(BENCH_DIR)
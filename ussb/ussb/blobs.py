@@ -0,0 +1,313 @@
+from .util import listdir, sync_file
+from _thread import allocate_lock
+from sys import implementation
+from ubinascii import unhexlify
+from uhashlib import sha256
+from uos import remove, rename, rmdir, stat
+
+
+# helps with debugging in vim
+if implementation.name != "micropython":
+    from typing import List, Optional, Tuple
+
+
+BLOB_DIR = "_blobs"
+PACK_FN = "_blobs/blobs.pack"
+PTRS_FN = "_blobs/blobs.ptrs"
+BLOB_SIZE = 128
+PTR_SIZE = 20
+
+
+def _exists(fn: str) -> bool:
+    try:
+        stat(fn)
+        return True
+    except OSError:
+        return False
+
+
+class BlobStore:
+    """
+    Append-only store of 128B blobs, addressed by their 20B pointer
+    (sha256(blob[8:])[:20]).
+    The blobs are appended to PACK_FN, their pointers in the same order to
+    PTRS_FN, so the n-th pointer belongs to the blob at offset n * 128.
+    The pointers are kept in memory as {pointer: offset}.
+    If the pack holds more blobs than there are pointers (interrupted write),
+    the missing pointers are computed from the blobs on load. The same
+    happens if the pointers do not belong to the pack (see compact).
+    Blobs stored as single files by older versions (_blobs/xx/...) are moved
+    into the pack on load.
+    """
+
+    __slots__ = (
+        "_count",
+        "_index",
+        "_lock",
+        "_reader",
+        "loaded",
+    )
+
+    def __init__(self) -> None:
+        self._index = {}  # {pointer: offset in PACK_FN}
+        self._count = 0  # number of blobs in PACK_FN
+        self._lock = allocate_lock()
+        self._reader = None  # read handle of PACK_FN, closed on every write
+        self.loaded = False
+
+    def _load(self) -> None:
+        # called with the lock held
+        self._finish_compact()
+        try:
+            pack_size = stat(PACK_FN)[6]
+        except OSError:
+            pack_size = 0
+        try:
+            f = open(PTRS_FN, "rb")
+            ptrs = f.read()
+            f.close()
+        except OSError:
+            ptrs = b""
+
+        n_ptrs = len(ptrs) // PTR_SIZE
+        n = min(n_ptrs, pack_size // BLOB_SIZE)
+        self._index = {}
+        for i in range(n):
+            ptr = ptrs[i * PTR_SIZE : (i + 1) * PTR_SIZE]
+            self._index[ptr] = i * BLOB_SIZE
+        del ptrs
+
+        # the last pointer read has to be the one of its blob, otherwise
+        # the pointers belong to another pack -> compute all of them
+        if n and not self._matches(ptr, (n - 1) * BLOB_SIZE):
+            self._index = {}
+            n = n_ptrs = 0
+
+        if pack_size % BLOB_SIZE:
+            # partially written blob: complete it, its pointer will not be wanted
+            f = open(PACK_FN, "ab")
+            f.write(bytes(BLOB_SIZE - pack_size % BLOB_SIZE))
+            f.close()
+            pack_size += BLOB_SIZE - pack_size % BLOB_SIZE
+
+        # rewrite the pointers if they do not match the pack
+        self._count = pack_size // BLOB_SIZE
+        if n_ptrs != self._count:
+            self._recover(n, self._count)
+
+        self.loaded = True
+        self._migrate()
+
+    def _matches(self, ptr: bytes, offset: int) -> bool:
+        # checks the pointer of the blob at the given offset of the pack
+        f = open(PACK_FN, "rb")
+        f.seek(offset)
+        blob = f.read(BLOB_SIZE)
+        f.close()
+        return sha256(blob[8:]).digest()[:PTR_SIZE] == ptr
+
+    def _finish_compact(self) -> None:
+        # called with the lock held, cleans up after an interrupted compact:
+        # the new pack is complete once the old one is removed
+        if _exists(PACK_FN + ".tmp"):
+            if _exists(PACK_FN):
+                remove(PACK_FN + ".tmp")
+            else:
+                rename(PACK_FN + ".tmp", PACK_FN)
+        if _exists(PTRS_FN + ".tmp"):
+            remove(PTRS_FN + ".tmp")
+
+    def _recover(self, n: int, total: int) -> None:
+        # recomputes the pointers of blobs n..total and rewrites PTRS_FN
+        if n < total:
+            f = open(PACK_FN, "rb")
+            f.seek(n * BLOB_SIZE)
+            for i in range(n, total):
+                blob = f.read(BLOB_SIZE)
+                self._index[sha256(blob[8:]).digest()[:PTR_SIZE]] = i * BLOB_SIZE
+            f.close()
+
+        ptrs = bytearray(total * PTR_SIZE)
+        for ptr, offset in self._index.items():
+            i = offset // BLOB_SIZE
+            ptrs[i * PTR_SIZE : (i + 1) * PTR_SIZE] = ptr
+        f = open(PTRS_FN, "wb")
+        f.write(ptrs)
+        f.close()
+
+    def _migrate(self) -> None:
+        # moves the blob files of older versions (_blobs/xx/...) into the pack
+        if BLOB_DIR not in listdir():
+            return
+        for dir_name in listdir(BLOB_DIR):
+            if len(dir_name) != 2:
+                continue
+            path = "{}/{}".format(BLOB_DIR, dir_name)
+            entries = []
+            for file_name in listdir(path):
+                f = open("{}/{}".format(path, file_name), "rb")
+                entries.append((unhexlify(dir_name + file_name), f.read(BLOB_SIZE)))
+                f.close()
+            self._append(entries)
+            for file_name in listdir(path):
+                remove("{}/{}".format(path, file_name))
+            rmdir(path)
+
+    def _append(self, entries: List[Tuple[bytes, bytes]]) -> None:
+        # called with the lock held, writes all new blobs at once
+        pack = bytearray()
+        ptrs = bytearray()
+        offset = self._count * BLOB_SIZE
+        for ptr, blob in entries:
+            ptr = bytes(ptr)
+            if ptr in self._index:
+                continue
+            self._index[ptr] = offset + len(pack)
+            pack += blob
+            ptrs += ptr
+        if not pack:
+            return
+        self._count += len(pack) // BLOB_SIZE
+
+        if self._reader is not None:
+            self._reader.close()
+            self._reader = None
+        f = open(PACK_FN, "ab")
+        f.write(pack)
+        f.close()
+        f = open(PTRS_FN, "ab")
+        f.write(ptrs)
+        f.close()
+
+    def put(self, ptr: bytearray, blob: bytearray) -> None:
+        """
+        Stores the given blob under the given pointer (not verified).
+        Already stored blobs are skipped.
+        """
+        self.put_many([(ptr, blob)])
+
+    def put_many(self, entries: List[Tuple[bytearray, bytearray]]) -> None:
+        """
+        Stores the given (pointer, blob) pairs with a single write,
+        e.g. a whole blob chain. Already stored blobs are skipped.
+        """
+        with self._lock:
+            if not self.loaded:
+                self._load()
+            self._append(entries)
+
+    def get(self, ptr: bytearray) -> Optional[bytearray]:
+        """
+        Returns the blob with the given pointer, or None if it is not stored.
+        Unlike find and read, the blob cannot be moved in between (compact).
+        """
+        with self._lock:
+            if not self.loaded:
+                self._load()
+            offset = self._index.get(bytes(ptr))
+            if offset is None:
+                return None
+            return self._read(offset, bytearray(BLOB_SIZE))
+
+    def find(self, ptr: bytearray) -> Optional[int]:
+        """
+        Returns the offset of the blob with the given pointer in the pack,
+        or None if it is not stored. Offsets stay valid until the pack is
+        compacted (see compact).
+        """
+        with self._lock:
+            if not self.loaded:
+                self._load()
+            return self._index.get(bytes(ptr))
+
+    def read(self, offset: int, blob: Optional[bytearray] = None) -> bytearray:
+        """
+        Returns the blob at the given offset of the pack (see find), read into
+        the given 128B buffer (e.g. reused while walking a chain) or a new one.
+        """
+        if blob is None:
+            blob = bytearray(BLOB_SIZE)
+        with self._lock:
+            return self._read(offset, blob)
+
+    def _read(self, offset: int, blob: bytearray) -> bytearray:
+        # called with the lock held
+        if self._reader is None:
+            self._reader = open(PACK_FN, "rb")
+        self._reader.seek(offset)
+        self._reader.readinto(blob)
+        return blob
+
+    def contains(self, ptr: bytearray) -> bool:
+        """
+        Returns True if the blob with the given pointer is stored.
+        """
+        with self._lock:
+            if not self.loaded:
+                self._load()
+            return bytes(ptr) in self._index
+
+    def compact(self, keep: set) -> int:
+        """
+        Rewrites the pack with only the blobs whose pointers are in keep.
+        Offsets returned by find before are invalid afterwards.
+        Returns the number of bytes reclaimed.
+        The new pack and pointers are written to temporary files first. The
+        old pointers are removed before the old pack, so that a crash never
+        leaves pointers of one pack next to the other one: the new pack is
+        used once the old one is gone, missing pointers are computed again
+        (see _load).
+        """
+        with self._lock:
+            if not self.loaded:
+                self._load()
+            kept = sorted(
+                [(offset, ptr) for ptr, offset in self._index.items() if ptr in keep]
+            )
+            if len(kept) == self._count:
+                return 0
+
+            if self._reader is not None:
+                self._reader.close()
+                self._reader = None
+
+            # copy the kept blobs, in their previous order
+            src = open(PACK_FN, "rb")
+            pack = open(PACK_FN + ".tmp", "wb")
+            ptrs = open(PTRS_FN + ".tmp", "wb")
+            index = {}
+            for offset, ptr in kept:
+                src.seek(offset)
+                index[ptr] = len(index) * BLOB_SIZE
+                pack.write(src.read(BLOB_SIZE))
+                ptrs.write(ptr)
+            src.close()
+            sync_file(pack)
+            pack.close()
+            sync_file(ptrs)
+            ptrs.close()
+            remove(PTRS_FN)
+            remove(PACK_FN)
+            rename(PACK_FN + ".tmp", PACK_FN)
+            rename(PTRS_FN + ".tmp", PTRS_FN)
+
+            reclaimed = (self._count - len(kept)) * (BLOB_SIZE + PTR_SIZE)
+            self._index = index
+            self._count = len(kept)
+            return reclaimed
+
+    def close(self) -> None:
+        """
+        Closes the read handle and forgets the index (reloaded on next use).
+        """
+        with self._lock:
+            if self._reader is not None:
+                self._reader.close()
+                self._reader = None
+            self._index = {}
+            self._count = 0
+            self.loaded = False
+
+
+# shared by every blob access (see feed.py)
+blob_store = BlobStore()
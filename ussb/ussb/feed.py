@@ -1,3 +1,4 @@
+from .blobs import blob_store
 from .packet import (
     APPLYUP,
     CHAIN20,
@@ -20,7 +21,12 @@ from .packet import (
     new_packet,
     pkt_from_wire,
 )
-from .util import listdir, from_var_int
+from .journal import AppendJournal
+from .storage import default_backend, open_store
+from .tree import FeedTree
+from .util import PYCOM, from_var_int
+from _thread import allocate_lock
+from pure25519 import SigningKey
 from sys import implementation
 from ubinascii import hexlify
 from uctypes import (
@@ -34,7 +40,6 @@ from uctypes import (
     struct,
 )
 from uhashlib import sha256
-from uos import mkdir, stat
 
 
 # helps with debugging in vim
@@ -44,7 +49,9 @@ if implementation.name != "micropython":
 
 # struct definition
 FEED = {
-    "reserved": (0 | ARRAY, 12 | UINT8),
+    "blob_seq": 0 | UINT32,  # blob cursor, see waiting_for_blob
+    "blob_pos": 4 | UINT32,
+    "blob_off": 8 | UINT32,
     "fid": (12 | ARRAY, 32 | UINT8),
     "parent_fid": (44 | ARRAY, 32 | UINT8),
     "parent_seq": 76 | UINT32,
@@ -55,40 +62,292 @@ FEED = {
 }
 
 
-# helper functions
-get_log_fn = lambda fid: "_feeds/{}.log".format(hexlify(fid).decode())
-get_header_fn = lambda fid: "_feeds/{}.head".format(hexlify(fid).decode())
+# blob_off of a complete blob chain
+BLOB_DONE = 0xFFFFFFFF
+
+
+# number of packets read at once when scanning a whole log
+LOG_SCAN_CHUNK = 8 if PYCOM else 64
+
+
+# storage of all headers and logs, see use_backend
+store = open_store(default_backend())
+
+
+def use_backend(backend: str) -> None:
+    """
+    Switches the storage of the feeds to the given backend ("file" or
+    "packed", see storage.open_store). Cached headers are dropped.
+    """
+    global store
+    store.close()
+    store = open_store(backend)
+    header_cache.clear()
+
+
+def list_fids() -> List[bytearray]:
+    """
+    Returns the feed IDs of all locally saved feeds.
+    """
+    return store.fids()
+
+
+# group commit of all appends, see recover_feeds
+journal = AppendJournal(lambda fid: store.sync(fid))
+
+
+# parent/child/continuation relations of all local feeds, see get_tree
+feed_tree = FeedTree()
+
+
+def get_tree() -> FeedTree:
+    """
+    Returns the feed tree, loading it on first use. If it was never saved
+    (e.g. feeds from an older version), it is rebuilt from the local feeds.
+    """
+    if not feed_tree.loaded and not feed_tree.load():
+        rebuild_tree()
+    return feed_tree
+
+
+def rebuild_tree() -> None:
+    """
+    Rebuilds the feed tree from the packets of all locally saved feeds.
+    Only the MKCHILD packets and the first/last packet of every feed are read.
+    """
+    feed_tree.clear()
+    for fid in list_fids():
+        feed = get_feed(fid)
+        for seq in find_type(feed, MKCHILD):
+            feed_tree.add_child(feed.fid, get_wire(feed, seq)[16:48], seq)
+        if feed.front_seq - feed.anchor_seq < 1:
+            continue
+        if feed.anchor_seq == 0:
+            wire = get_wire(feed, 1)
+            if wire[15] == ISCHILD:
+                feed_tree.set_parent(feed.fid, wire[16:48])
+            elif wire[15] == ISCONTN:
+                feed_tree.set_prev(feed.fid, wire[16:48])
+        wire = get_wire(feed, -1)
+        if wire[15] == CONTDAS:
+            feed_tree.set_contn(feed.fid, wire[16:48])
+    feed_tree.save()
+
+
+# number of FEED headers kept in memory (see HeaderCache)
+HEADER_CACHE_SIZE = 8 if PYCOM else 64
+
+
+class HeaderCache:
+    """
+    Bounded LRU cache of FEED structs, keyed by feed ID. Headers are loaded
+    from the store on first use and handed out shared, so every user
+    of a feed sees the same front_seq/front_mid. Changes are written through
+    to disk by save_header. A size of 0 disables the cache.
+    Owned by the FeedManager, which sets the size.
+    """
+
+    __slots__ = (
+        "_feeds",
+        "_lock",
+        "_order",
+        "hits",
+        "misses",
+        "size",
+    )
+
+    def __init__(self, size: int) -> None:
+        self.size = size
+        self._feeds = {}
+        self._order = []  # least recently used first
+        self._lock = allocate_lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, fid: bytearray) -> struct[FEED]:
+        """
+        Returns the shared header of the given feed, reading it from the
+        store if it is not cached.
+        """
+        b_fid = bytes(fid)
+        with self._lock:
+            if b_fid in self._feeds:
+                self.hits += 1
+                if self._order[-1] != b_fid:
+                    self._order.remove(b_fid)
+                    self._order.append(b_fid)
+                return self._feeds[b_fid]
+            self.misses += 1
+
+        feed = load_header(fid)
+        with self._lock:
+            # another thread may have loaded it in the meantime
+            if b_fid in self._feeds:
+                return self._feeds[b_fid]
+            self._insert(b_fid, feed)
+        return feed
+
+    def update(self, feed: struct[FEED]) -> None:
+        """
+        Updates the cache with the content of the given header. If another
+        struct is cached for the feed, its content is overwritten, so it
+        stays valid for everybody holding it.
+        """
+        b_fid = bytes(feed.fid)
+        with self._lock:
+            if b_fid not in self._feeds:
+                self._insert(b_fid, feed)
+                return
+            cached = self._feeds[b_fid]
+            if addressof(cached) != addressof(feed):
+                bytearray_at(addressof(cached), sizeof(FEED))[:] = bytearray_at(
+                    addressof(feed), sizeof(FEED)
+                )
+
+    def _insert(self, b_fid: bytes, feed: struct[FEED]) -> None:
+        if self.size <= 0:
+            return
+        self._feeds[b_fid] = feed
+        self._order.append(b_fid)
+        while len(self._order) > self.size:
+            del self._feeds[self._order.pop(0)]
+
+    def resize(self, size: int) -> None:
+        """
+        Changes the maximum number of cached headers, evicting surplus ones.
+        """
+        with self._lock:
+            self.size = size
+            while len(self._order) > max(size, 0):
+                del self._feeds[self._order.pop(0)]
+
+    def clear(self) -> None:
+        """
+        Drops all cached headers.
+        """
+        with self._lock:
+            self._feeds = {}
+            self._order = []
+
+
+header_cache = HeaderCache(HEADER_CACHE_SIZE)
 
 
 def save_header(feed: struct[FEED]) -> None:
     """
-    Saves the content of the given feed struct into a .head file with the
-    feed ID as file name.
+    Saves the content of the given feed struct in the store.
+    The header cache is updated as well.
     """
-    f = open(get_header_fn(feed.fid), "wb")
-    f.write(bytearray_at(addressof(feed), sizeof(FEED)))
-    f.close()
+    store.write_header(feed.fid, bytearray_at(addressof(feed), sizeof(FEED)))
+    header_cache.update(feed)
 
 
-def get_feed(fid: bytearray) -> struct[FEED]:
+def load_header(fid: bytearray) -> struct[FEED]:
     """
     Creates a feed struct instance from the given feed ID.
-    This is done by reading the corresponding .head file.
-    Leads to an error if the file does not exist -> only use if feed exists.
+    This is done by reading the corresponding header from the store.
+    Leads to an error if it does not exist -> only use if feed exists.
     """
-    # reserve memory for header
-    feed_header = bytearray(128)
-
-    # read file
-    f = open(get_header_fn(fid), "rb")
-    feed_header[:] = f.read(128)
-    f.close()
+    feed_header = store.read_header(fid)
 
     # create struct
     feed = struct(addressof(feed_header), FEED, BIG_ENDIAN)
     return feed
 
 
+def recover_feeds() -> int:
+    """
+    Brings the logs and headers back in agreement after a crash.
+    The committed journal records are replayed first, then the header of
+    every feed is matched with its log (see _match_log).
+    Returns the number of feeds that were repaired, the feed tree is then
+    rebuilt from the repaired logs.
+    Called once at startup (FeedManager.__init__), before any append.
+    """
+    repaired = set()
+    for header, wires in journal.read():
+        rec = struct(addressof(header), FEED, BIG_ENDIAN)
+        fid = bytearray(rec.fid)
+        try:
+            feed = load_header(fid)
+        except OSError:
+            feed = None  # header of a new feed was lost
+
+        if feed is not None and feed.anchor_seq != rec.anchor_seq:
+            continue  # pruned since
+
+        # rewrite the packets if the log is shorter
+        offset = 128 * (rec.front_seq - rec.anchor_seq) - len(wires)
+        size = store.log_size(fid)
+        if offset <= size < offset + len(wires):
+            store.write_log(fid, offset, wires)
+            repaired.add(bytes(fid))
+
+        if feed is None or feed.front_seq < rec.front_seq:
+            store.write_header(fid, header)
+            repaired.add(bytes(fid))
+    journal.reset()
+
+    for fid in list_fids():
+        if _match_log(load_header(fid)):
+            repaired.add(bytes(fid))
+
+    for b_fid in repaired:
+        header_cache.update(load_header(b_fid))
+    if repaired:
+        # packets were taken over or cut off, the feed tree may differ
+        rebuild_tree()
+    return len(repaired)
+
+
+def _match_log(feed: struct[FEED]) -> bool:
+    """
+    Matches the header of the given feed with its log: packets that
+    made it into the log without a header update are taken over (if their
+    signatures are valid), otherwise the header falls back to the last
+    packet in the log. Returns True if something had to be changed.
+    """
+    n = feed.front_seq - feed.anchor_seq
+    size = store.log_size(feed.fid)
+    if size == 128 * n:
+        return False
+
+    # chain the message IDs up to the last complete (and valid) packet
+    if size > 128 * n:
+        count, mid = n, bytearray(feed.front_mid)
+    else:
+        count, mid = 0, bytearray(feed.anchor_mid)
+    wire = bytearray(128)
+    while 128 * (count + 1) <= size:
+        store.read_log(feed.fid, 128 * count, wire)
+        seq = (feed.anchor_seq + 1 + count).to_bytes(4, "big")
+        pkt = pkt_from_wire(feed.fid, seq, mid, wire, verify=count >= n)
+        if pkt is None:
+            break
+        mid[:] = pkt.mid
+        del pkt
+        count += 1
+
+    if size != 128 * count:
+        # cut off torn or invalid packets
+        store.cut_log(feed.fid, 0, 128 * count)
+
+    feed.front_seq = feed.anchor_seq + count
+    feed.front_mid[:] = mid
+    store.write_header(feed.fid, bytearray_at(addressof(feed), sizeof(FEED)))
+    store.drop_types(feed.fid)  # rebuilt on demand
+    return True
+
+
+def get_feed(fid: bytearray) -> struct[FEED]:
+    """
+    Returns the (shared) feed struct of the given feed ID from the header
+    cache, see HeaderCache.
+    Leads to an error if the file does not exist -> only use if feed exists.
+    """
+    return header_cache.get(fid)
+
+
 def create_feed(
     fid: bytearray,
     trusted_seq: int = 0,
@@ -97,7 +356,7 @@ def create_feed(
     parent_fid: bytearray = bytearray(32),
 ) -> struct[FEED]:
     """
-    Creates a new feed instance and saves the .head file.
+    Creates a new feed instance and saves its header.
     """
     if trusted_mid is None:
         trusted_mid = fid[:20]  # tinyssb convention, self-signed
@@ -122,13 +381,13 @@ def create_feed(
 
 def create_child_feed(
     parent_feed: struct[FEED],
-    parent_key: bytearray,
+    parent_key: Union[bytearray, SigningKey],
     child_fid: bytearray,
-    child_key: bytearray,
+    child_key: Union[bytearray, SigningKey],
 ) -> struct[FEED]:
     """
     Creates a new child feed from the given parent feed.
-    Also saves the .head file of the new child feed.
+    Also saves the header of the new child feed.
     """
     parent_seq = (parent_feed.front_seq + 1).to_bytes(4, "big")
     parent_pkt = create_parent_pkt(
@@ -161,13 +420,13 @@ def create_child_feed(
 
 def create_contn_feed(
     ending_feed: struct[FEED],
-    ending_key: bytearray,
+    ending_key: Union[bytearray, SigningKey],
     contn_fid: bytearray,
-    contn_key: bytearray,
+    contn_key: Union[bytearray, SigningKey],
 ) -> struct[FEED]:
     """
     Creates a continuation feed from the given (ending) feed.
-    Also saves the .head file of the new continuation feed.
+    Also saves the header of the new continuation feed.
     """
     ending_seq = (ending_feed.front_seq + 1).to_bytes(4, "big")
     ending_pkt = create_end_pkt(
@@ -196,10 +455,10 @@ def create_contn_feed(
     return cont_feed
 
 
-def get_wire(feed: struct[FEED], i: int) -> bytearray:
+def _log_offset(feed: struct[FEED], i: int) -> int:
     """
-    Returns the (128B) wire packet with the given sequence number of the
-    given feed. Also accepts negative indices (-1 => last packet).
+    Returns the offset of the packet with the given sequence number in the
+    log of the given feed. Also accepts negative indices.
     """
     # transform negative indices
     if i < 0:
@@ -210,16 +469,17 @@ def get_wire(feed: struct[FEED], i: int) -> bytearray:
     if i > feed.front_seq or i <= anchor_seq:
         raise IndexError
 
-    # get wire packet
-    relative_i = i - anchor_seq
-    del anchor_seq
+    # -1 because the header is stored separately
+    return 128 * (i - anchor_seq - 1)
 
-    wire_array = bytearray(128)
-    f = open(get_log_fn(feed.fid), "rb")
-    f.seek(128 * (relative_i - 1))  # -1 because header is in a separate file
-    wire_array[:] = f.read(128)
-    f.close()
 
+def get_wire(feed: struct[FEED], i: int) -> bytearray:
+    """
+    Returns the (128B) wire packet with the given sequence number of the
+    given feed. Also accepts negative indices (-1 => last packet).
+    """
+    wire_array = bytearray(128)
+    store.read_log(feed.fid, _log_offset(feed, i), wire_array)
     return wire_array
 
 
@@ -250,28 +510,20 @@ def get_payload(feed: struct[FEED], i: int) -> bytearray:
     ptr = wpkt.payload[-20:]
     del wpkt
 
-    # unwrap chain
+    # unwrap chain, reading every blob into the same buffer
     null_ptr = bytearray(20)
+    blob_array = bytearray(128)
     while ptr != null_ptr:
-        # search for file
-        hex_ptr = hexlify(ptr).decode()
-        file_name = "_blobs/{}/{}".format(hex_ptr[:2], hex_ptr[2:])
-
-        # read blob
-        blob_array = bytearray(128)
-        f = open(file_name, "rb")
-        blob_array[:] = f.read(128)
-        f.close()
-        del file_name
+        blob_store.read(blob_store.find(ptr), blob_array)
 
         # get next pointer
-        ptr = blob_array[108:]
+        ptr = bytes(blob_array[108:])
         if ptr == null_ptr:
             content_array[current_i:] = blob_array[8 : content_size - current_i + 8]
         else:
             content_array[current_i : current_i + 100] = blob_array[8:108]
             current_i += 100
-        del blob_array
+    del blob_array
 
     return content_array
 
@@ -298,20 +550,235 @@ def append_packet(feed: struct[FEED], pkt: struct[PACKET]) -> None:
     Appends the given packet to the given feed. The signature of the
     packet is not checked. Only meant to be used by the producer of a feed.
     """
-    # FIXME: check for CONTDAS packet (feed has ended).
+    append_packets(feed, [pkt])
+
 
-    # append packet to .log file
-    f = open(get_log_fn(feed.fid), "ab")
-    f.write(bytearray_at(addressof(pkt.wire[0]), sizeof(WIRE_PACKET)))
-    f.close()
+def append_packets(feed: struct[FEED], pkts: List[struct[PACKET]]) -> None:
+    """
+    Appends the given packets (in order) to the given feed, using a single
+    write to the log and a single header update.
+    The signatures of the packets are not checked.
+    """
+    # FIXME: check for CONTDAS packet (feed has ended).
+    if not pkts:
+        return
+
+    wpkt_size = sizeof(WIRE_PACKET)
+    wires = bytearray(wpkt_size * len(pkts))
+    types = bytearray(len(pkts))
+    for i in range(len(pkts)):
+        wires[i * wpkt_size : (i + 1) * wpkt_size] = bytearray_at(
+            addressof(pkts[i].wire[0]), wpkt_size
+        )
+        types[i] = wires[i * wpkt_size + 15]
+
+    # bring the type index up to date first (rebuilt if its size is off),
+    # it is extended below
+    if store.types_size(feed.fid) != feed.front_seq - feed.anchor_seq:
+        get_types(feed)
+
+    # append packets to the log
+    store.append_log(feed.fid, wires)
+
+    # packets that change the feed tree: (seq, type, other feed ID)
+    relations = [
+        (
+            feed.front_seq + 1 + i,
+            types[i],
+            wires[i * wpkt_size + 16 : i * wpkt_size + 48],
+        )
+        for i in range(len(pkts))
+        if types[i] in (MKCHILD, ISCHILD, CONTDAS, ISCONTN)
+    ]
+
+    # append types to the type index
+    store.append_types(feed.fid, types)
+    del types
+
+    # record the relations before the header is saved: after a crash in
+    # between, recover_feeds takes the packets over and rebuilds the tree
+    if relations:
+        _record_relations(feed, relations)
 
     # update and save header
-    feed.front_mid[:] = pkt.mid
-    feed.front_seq += 1
+    feed.front_mid[:] = pkts[-1].mid
+    feed.front_seq += len(pkts)
     save_header(feed)
+    journal.record(bytearray_at(addressof(feed), sizeof(FEED)), wires)
+    del wires
 
 
-def append_bytes(feed: struct[FEED], payload: bytearray, key: bytearray) -> None:
+def _record_relations(
+    feed: struct[FEED], relations: List[Tuple[int, int, bytearray]]
+) -> None:
+    """
+    Adds the given (seq, packet type, other feed ID) relations of the given
+    feed to the feed tree and saves it if something changed.
+    """
+    tree = get_tree()
+    changed = False
+    for seq, pkt_type, other in relations:
+        if pkt_type == MKCHILD:
+            changed = tree.add_child(feed.fid, other, seq) or changed
+        elif pkt_type == CONTDAS:
+            changed = tree.set_contn(feed.fid, other) or changed
+        elif seq == 1 and pkt_type == ISCHILD:
+            changed = tree.set_parent(feed.fid, other) or changed
+        elif seq == 1 and pkt_type == ISCONTN:
+            changed = tree.set_prev(feed.fid, other) or changed
+    if changed:
+        tree.save()
+
+
+def get_types(feed: struct[FEED]) -> bytearray:
+    """
+    Returns the packet types of the given feed, one byte per sequence number
+    (starting at feed.anchor_seq + 1).
+    They are kept by the store (e.g. a .idx file next to the .log file),
+    maintained by append_packets. If the index is missing or does not match
+    the length of the feed (e.g. feed from an older version), it is rebuilt
+    from the log.
+    """
+    n = feed.front_seq - feed.anchor_seq
+    types = store.read_types(feed.fid)
+    if types is not None and len(types) == n:
+        return types
+
+    # rebuild, reading LOG_SCAN_CHUNK packets at once into the same buffer
+    types = bytearray(n)
+    wires = memoryview(bytearray(128 * min(LOG_SCAN_CHUNK, n)))
+    for start in range(0, n, LOG_SCAN_CHUNK):
+        count = min(LOG_SCAN_CHUNK, n - start)
+        store.read_log(feed.fid, 128 * start, wires[: 128 * count])
+        for i in range(count):
+            types[start + i] = wires[128 * i + 15]
+    del wires
+    store.write_types(feed.fid, types)
+    return types
+
+
+def find_type(feed: struct[FEED], pkt_type: int) -> List[int]:
+    """
+    Returns the sequence numbers of all packets with the given type
+    (e.g. MKCHILD) in the given feed, in ascending order.
+    """
+    types = get_types(feed)
+    first = feed.anchor_seq + 1
+    return [first + i for i in range(len(types)) if types[i] == pkt_type]
+
+
+def find_last(feed: struct[FEED], pkt_type: int) -> Optional[int]:
+    """
+    Returns the sequence number of the last packet with the given type
+    (e.g. APPLYUP) in the given feed, or None if there is none.
+    """
+    types = get_types(feed)
+    for i in range(len(types) - 1, -1, -1):
+        if types[i] == pkt_type:
+            return feed.anchor_seq + 1 + i
+    return None
+
+
+def prune_feed(feed: struct[FEED], seq: int) -> int:
+    """
+    Advances the anchor of the given feed to the given sequence number:
+    the packets up to and including seq are removed from the log and the
+    type index and the header is updated. The front packet is always kept.
+    Relations in the feed tree are kept, unreferenced blobs are removed
+    separately (see collect_blobs).
+    Returns the number of bytes reclaimed.
+    """
+    if seq <= feed.anchor_seq:
+        return 0
+    if seq >= feed.front_seq:
+        raise IndexError
+
+    # journal records refer to the current anchor
+    journal.checkpoint()
+
+    # message ID of the new anchor packet
+    mid = bytearray(feed.anchor_mid)
+    for i in range(feed.anchor_seq + 1, seq + 1):
+        pkt = pkt_from_wire(
+            feed.fid, i.to_bytes(4, "big"), mid, get_wire(feed, i), verify=False
+        )
+        mid[:] = pkt.mid
+        del pkt
+
+    # only keep the remaining packets
+    n = seq - feed.anchor_seq
+    types = get_types(feed)
+    store.cut_log(feed.fid, 128 * n, 128 * (feed.front_seq - feed.anchor_seq))
+    store.write_types(feed.fid, types[n:])
+
+    feed.anchor_seq = seq
+    feed.anchor_mid[:] = mid
+    save_header(feed)
+    return n * 129  # packet and its type byte
+
+
+def move_anchor(feed: struct[FEED], seq: int, mid: bytearray) -> None:
+    """
+    Moves the anchor of the given feed ahead of its front, to the given
+    sequence number and message ID: the locally saved packets are removed
+    and the packet after seq is expected next. Used to continue a feed of
+    which the other nodes pruned the packets up to seq (see get_anchor),
+    the anchor has to be verified with the packet after it beforehand.
+    """
+    if seq <= feed.front_seq:
+        raise IndexError
+
+    # journal records refer to the current anchor
+    journal.checkpoint()
+    if store.log_size(feed.fid):
+        store.cut_log(feed.fid, 0, 0)
+    store.write_types(feed.fid, bytearray())
+
+    feed.blob_seq = 0
+    feed.blob_pos = 0
+    feed.blob_off = 0
+    feed.anchor_seq = seq
+    feed.anchor_mid[:] = mid
+    feed.front_seq = seq
+    feed.front_mid[:] = mid
+    save_header(feed)
+
+
+def collect_blobs() -> int:
+    """
+    Removes the blobs that are not referenced by a CHAIN20 packet of any
+    locally saved feed (anymore), e.g. after prune_feed.
+    Returns the number of bytes reclaimed.
+    """
+    null_ptr = bytes(20)
+    keep = set()
+    feeds = []
+    blob = bytearray(128)
+    for fid in list_fids():
+        feed = get_feed(fid)
+        feeds.append(feed)
+        for seq in find_type(feed, CHAIN20):
+            ptr = bytes(get_wire(feed, seq)[44:64])
+            while ptr != null_ptr and ptr not in keep:
+                offset = blob_store.find(ptr)
+                if offset is None:
+                    break  # incomplete chain
+                keep.add(ptr)
+                ptr = bytes(blob_store.read(offset, blob)[-20:])
+
+    reclaimed = blob_store.compact(keep)
+    if reclaimed:
+        # pack offsets changed -> incomplete chains are walked again
+        for feed in feeds:
+            if feed.blob_seq != 0 and feed.blob_off != BLOB_DONE:
+                feed.blob_seq = 0
+                save_header(feed)
+    return reclaimed
+
+
+def append_bytes(
+    feed: struct[FEED], payload: bytearray, key: Union[bytearray, SigningKey]
+) -> None:
     """
     Append given payload as a PLAIN48 packet (max 48B) to a given feed.
     The packet is signed with the given key.
@@ -341,7 +808,9 @@ def append_bytes(feed: struct[FEED], payload: bytearray, key: bytearray) -> None
     append_packet(feed, pkt)
 
 
-def append_blob(feed: struct[FEED], payload: bytearray, key: bytearray) -> None:
+def append_blob(
+    feed: struct[FEED], payload: bytearray, key: Union[bytearray, SigningKey]
+) -> None:
     """
     Appends the given payload as a blob to the given feed.
     No size limitation other than memory.
@@ -350,28 +819,17 @@ def append_blob(feed: struct[FEED], payload: bytearray, key: bytearray) -> None:
         feed.fid, (feed.front_seq + 1).to_bytes(4, "big"), feed.front_mid, payload, key
     )
 
-    # save blob files
-    # pointer: a3e26124...
-    # saved as: _blobs/a3/e26124...
-    ptr = hexlify(pkt.wire[0].payload[-20:]).decode()
+    # save the whole chain with a single write
+    entries = []
+    ptr = bytes(pkt.wire[0].payload[-20:])
     for blob in blobs:
-        dir_name = ptr[:2]
-        file_name = ptr[2:]
-        del ptr
-
-        if dir_name not in listdir("_blobs"):
-            mkdir("_blobs/{}".format(dir_name))
-
-        # write blob
-        f = open("_blobs/{}/{}".format(dir_name, file_name), "wb")
-        f.write(bytearray_at(addressof(blob), sizeof(blob)))
-        f.close()
-
-        # get next ptr
-        ptr = hexlify(blob.pointer).decode()
-
+        entries.append((ptr, bytes(bytearray_at(addressof(blob), sizeof(blob)))))
+        ptr = bytes(blob.pointer)
     del blobs
-    assert ptr == hexlify(bytes(20)).decode()  # null pointer
+    assert ptr == bytes(20)  # null pointer
+    blob_store.put_many(entries)
+    del entries
+
     # append packet to feed
     append_packet(feed, pkt)
 
@@ -398,17 +856,11 @@ def get_parent(feed: struct[FEED]) -> Optional[bytearray]:
     """
     Returns the feed ID of the given feed's parent feed.
     If the given feed does not have a parent, None is returned.
+    The relation is kept in the feed tree, so it survives prune_feed.
     """
-    if feed.anchor_seq != 0 or feed.front_seq < 1:
-        return None
-    wire = get_wire(feed, 1)
-
-    # check type
-    if wire[15:16] != ISCHILD.to_bytes(1, "big"):
+    if feed.front_seq < 1:
         return None
-
-    # return parent fid
-    return wire[16:48]
+    return get_tree().get_parent(feed.fid)
 
 
 def get_children(
@@ -418,19 +870,9 @@ def get_children(
     Returns a list of all feed IDs of this feed's children feeds.
     Does not return children of child feeds.
     If the feed does not have children, an empty list is returned.
-    ! This function has to iterate over every packet of the given feed.
+    Looked up in the feed tree (see get_tree), no packets are read.
     """
-    children = []
-    mk_child = MKCHILD.to_bytes(1, "big")
-    for i in range(feed.anchor_seq + 1, feed.front_seq + 1):
-        wpkt = get_wire(feed, i)
-        if wpkt[15:16] == mk_child:
-            if index:
-                children.append((wpkt[16:48], i))
-            else:
-                children.append(wpkt[16:48])
-
-    return children
+    return get_tree().get_children(feed.fid, index)
 
 
 def get_contn(feed: struct[FEED]) -> Optional[bytearray]:
@@ -441,12 +883,7 @@ def get_contn(feed: struct[FEED]) -> Optional[bytearray]:
     """
     if feed.front_seq < 1:
         return None
-
-    wpkt = get_wire(feed, -1)
-    if wpkt[15:16] == CONTDAS.to_bytes(1, "big"):
-        return wpkt[16:48]
-
-    return None
+    return get_tree().get_contn(feed.fid)
 
 
 def get_prev(feed: struct[FEED]) -> Optional[bytearray]:
@@ -454,25 +891,26 @@ def get_prev(feed: struct[FEED]) -> Optional[bytearray]:
     Returns the feed ID of the given feed's predecessor feed.
     None is returned if it does not exist.
     """
-    if feed.anchor_seq != 0:
-        return None
-
-    wpkt = get_wire(feed, 1)
-    if wpkt[15:16] == ISCONTN.to_bytes(1, "big"):
-        return wpkt[16:48]
-
-    return None
+    return get_tree().get_prev(feed.fid)
 
 
 def get_next_dmx(feed: struct[FEED]) -> bytearray:
     """
     Returns the expected DMX value of the next packet.
     """
+    return compute_dmx(feed.fid, feed.front_seq + 1, feed.front_mid)
+
+
+def compute_dmx(fid: bytearray, seq: int, prev_mid: bytearray) -> bytearray:
+    """
+    Returns the DMX value of the packet with the given sequence number and
+    previous message ID in the feed with the given feed ID.
+    """
     dmx = bytearray(64)
     dmx[:8] = PKT_PREFIX
-    dmx[8:40] = feed.fid
-    dmx[40:44] = (feed.front_seq + 1).to_bytes(4, "big")
-    dmx[44:64] = feed.front_mid
+    dmx[8:40] = fid
+    dmx[40:44] = seq.to_bytes(4, "big")
+    dmx[44:64] = prev_mid
     return sha256(dmx).digest()[:7]
 
 
@@ -480,37 +918,54 @@ def waiting_for_blob(feed: struct[FEED]) -> Optional[bytearray]:
     """
     Returns the pointer to the missing blob.
     If there is no incomplete blob, None is returned.
+    The chain is not walked from its start every time: the header keeps a
+    cursor (blob_seq, blob_pos, blob_off) with the sequence number of the
+    chain, the number of blobs present and the pack offset of the last one
+    (BLOB_DONE once complete). Only blobs added since the last call are read.
     """
     if feed.front_seq < 1:
         return None
 
     # only check front packet
+    if feed.blob_seq == feed.front_seq and feed.blob_off == BLOB_DONE:
+        return None
     wpkt = get_wire(feed, -1)
     if wpkt[15:16] != CHAIN20.to_bytes(1, "BIG"):
         return None
 
-    # check if blob chain is complete
-    ptr = wpkt[44:64]
+    # continue at the cursor
     null_ptr = bytearray(20)
+    blob = bytearray(128)
+    if feed.blob_seq == feed.front_seq and feed.blob_pos > 0:
+        ptr = bytes(blob_store.read(feed.blob_off, blob)[-20:])
+        pos = feed.blob_pos
+        offset = feed.blob_off
+    else:
+        # new chain, no blob present yet
+        ptr = wpkt[44:64]
+        pos = 0
+        offset = 0
+    del wpkt
+
+    # check if blob chain is complete
     while ptr != null_ptr:
-        hex_ptr = hexlify(ptr).decode()
-        file_name = "_blobs/{}/{}".format(hex_ptr[:2], hex_ptr[2:])
+        found = blob_store.find(ptr)
+        if found is None:
+            # not received yet, return pointer
+            break
+        offset = found
+        pos += 1
+        ptr = bytes(blob_store.read(offset, blob)[-20:])
 
-        # check if file exists
-        try:
-            blob = bytearray(128)
-            f = open(file_name, "rb")
-            blob[:] = f.read(128)
-            f.close()
-        except Exception:
-            # does not exist yet, return pointer
-            del blob
-            return ptr
-
-        ptr[:] = blob[-20:]
-        del blob
+    if ptr == null_ptr:
+        offset = BLOB_DONE
+    if (feed.blob_seq, feed.blob_pos, feed.blob_off) != (feed.front_seq, pos, offset):
+        feed.blob_seq = feed.front_seq
+        feed.blob_pos = pos
+        feed.blob_off = offset
+        save_header(feed)
 
-    return None
+    return None if offset == BLOB_DONE else ptr
 
 
 def verify_and_append_blob(feed: struct[FEED], blob: bytearray) -> bool:
@@ -526,35 +981,29 @@ def verify_and_append_blob(feed: struct[FEED], blob: bytearray) -> bool:
         # not waiting for this blob
         return False
 
-    # save blob file
-    hex_blob = hexlify(blob_hash).decode()
-
-    if hex_blob[:2] not in listdir("_blobs"):
-        mkdir("_blobs/{}".format(hex_blob[:2]))
-
-    file_name = "_blobs/{}/{}".format(hex_blob[:2], hex_blob[2:])
-    f = open(file_name, "wb")
-    f.write(blob)
-    f.close()
+    blob_store.put(blob_hash, blob)
     return True
 
 
-def get_want(feed: struct[FEED]) -> bytearray:
+def get_want(feed: struct[FEED], count: int = 1) -> bytearray:
     """
     Returns the "want" bytearray for a given feed.
     This is used for requesting packets/blobs from other nodes.
+    If count > 1 and a packet is missing, count packets are requested at
+    once (44B: the sequence number is followed by the count).
     """
     want_dmx = bytearray(7)
     want_dmx[:] = sha256(feed.fid + b"want").digest()[:7]
 
-    # FIXME: this may be inefficient for long blob chains
     blob_ptr = waiting_for_blob(feed)
     if blob_ptr is None:
         # packet missing
-        want = bytearray(43)
+        want = bytearray(43 if count <= 1 else 44)
         want[:7] = want_dmx
         want[7:39] = feed.fid
-        want[39:] = (feed.front_seq + 1).to_bytes(4, "big")
+        want[39:43] = (feed.front_seq + 1).to_bytes(4, "big")
+        if count > 1:
+            want[43] = min(count, 255)
         return want
     else:
         want = bytearray(63)
@@ -565,8 +1014,25 @@ def get_want(feed: struct[FEED]) -> bytearray:
         return want
 
 
+def get_anchor(feed: struct[FEED]) -> bytearray:
+    """
+    Returns the "anchor" bytearray (31B) for a given feed: the answer to a
+    want of a pruned packet. It carries the dmx value of the wants of the
+    feed, the sequence number and the message ID of the anchor, so that
+    the requesting node can continue after it (see move_anchor).
+    """
+    anchor = bytearray(31)
+    anchor[:7] = sha256(feed.fid + b"want").digest()[:7]
+    anchor[7:11] = feed.anchor_seq.to_bytes(4, "big")
+    anchor[11:31] = feed.anchor_mid
+    return anchor
+
+
 def add_upd(
-    feed: struct[FEED], file_name: str, key: bytearray, v_number: int = 0
+    feed: struct[FEED],
+    file_name: str,
+    key: Union[bytearray, SigningKey],
+    v_number: int = 0,
 ) -> None:
     """
     Adds a packet of type UPDFILE to the given feed, containing the given
@@ -609,7 +1075,10 @@ def get_upd(feed: struct[FEED]) -> Optional[Tuple[str, int]]:
 
 
 def add_apply(
-    feed: struct[FEED], file_fid: bytearray, v_num: int, key: bytearray
+    feed: struct[FEED],
+    file_fid: bytearray,
+    v_num: int,
+    key: Union[bytearray, SigningKey],
 ) -> None:
     """
     Adds a packet of type APPLYUP to the given feed (should be version control feed).
@@ -634,12 +1103,14 @@ def get_newest_apply(feed: struct[FEED], file_fid: bytearray) -> Optional[int]:
     the most recent packet, and searches for an APPLYUP packet containing the
     given feed ID.
     """
-    applyup = APPLYUP.to_bytes(1, "big")
-    for i in range(feed.front_seq, feed.anchor_seq, -1):
-        wpkt = get_wire(feed, i)
-        if wpkt[15:16] == applyup:
-            if wpkt[16:48] == bytes(file_fid):
-                return int.from_bytes(wpkt[48:52], "big")
+    types = get_types(feed)
+    b_fid = bytes(file_fid)
+    for i in range(len(types) - 1, -1, -1):
+        if types[i] != APPLYUP:
+            continue
+        wpkt = get_wire(feed, feed.anchor_seq + 1 + i)
+        if wpkt[16:48] == b_fid:
+            return int.from_bytes(wpkt[48:52], "big")
         del wpkt
 
     return None
@@ -668,6 +1139,7 @@ def to_string(feed: struct[FEED]) -> str:
     separator = "".join([("+-----" * (length + 1)), "+"])
     numbers = "   {}  ".format(feed.anchor_seq)
     feed_str = "| HDR |"
+    types = get_types(feed)
 
     for i in range(feed.anchor_seq + 1, feed.front_seq + 1):
         if i < 10:
@@ -675,7 +1147,7 @@ def to_string(feed: struct[FEED]) -> str:
         else:
             numbers = "".join([numbers, "  {}  ".format(i)])
 
-        pkt_type = int.from_bytes(get_wire(feed, i)[15:16], "big")
+        pkt_type = types[i - feed.anchor_seq - 1]
 
         if pkt_type == PLAIN48:
             feed_str = "".join([feed_str, " P48 |"])
@@ -1,29 +1,59 @@
+from .blobs import blob_store
 from .feed import (
     FEED,
+    HEADER_CACHE_SIZE,
     append_blob,
     append_bytes,
+    append_packets,
+    collect_blobs,
+    compute_dmx,
     create_feed,
+    get_anchor,
     get_children,
     get_feed,
     get_next_dmx,
-    get_parent,
+    get_tree,
     get_want,
     get_wire,
+    header_cache,
+    journal,
+    list_fids,
+    move_anchor,
+    prune_feed,
+    recover_feeds,
     to_string,
+    use_backend,
     verify_and_append_blob,
     verify_and_append_bytes,
     waiting_for_blob,
 )
-from .packet import CONTDAS, MKCHILD, WIRE_PACKET
-from .util import listdir
+from .packet import (
+    CHAIN20,
+    CONTDAS,
+    MKCHILD,
+    WIRE_PACKET,
+    pkt_from_wire,
+    pkts_from_wires,
+)
+from .util import PYCOM, listdir
 from _thread import allocate_lock
 from json import dumps, loads
 from os import mkdir
-from pure25519 import create_keypair
+from pure25519 import SigningKey, create_keypair
 from sys import implementation
 from ubinascii import unhexlify, hexlify
-from uctypes import struct, addressof, BIG_ENDIAN
+from uctypes import struct, addressof, BIG_ENDIAN, bytearray_at
 from uhashlib import sha256
+from uos import remove, rename
+
+try:
+    from time import ticks_ms, ticks_diff
+except ImportError:
+    # regular python
+    from time import time
+
+    ticks_ms = lambda: int(time() * 1000)
+    ticks_diff = lambda end, start: end - start
 
 
 # helps debugging in vim
@@ -31,6 +61,25 @@ if implementation.name != "micropython":
     from typing import Dict, Tuple, List, Callable, Optional, Union
 
 
+# snapshot of the dmx table, see FeedManager.save_dmx
+DMX_SNAPSHOT_FN = "_feeds/dmx.snap"
+DMX_SNAPSHOT_MAGIC = b"udmx"
+DMX_SNAPSHOT_VERSION = 1
+
+# minimum time between two snapshots
+DMX_SNAPSHOT_MS = 30000
+
+# maximum number of packets sent in reply to a single want
+WANT_MAX_ANSWER = 8 if PYCOM else 32
+
+# record: feed ID (32B), feed state (16B, see _dmx_state), kind of the next
+# value (1B), want dmx (7B), dmx of the next packet or next blob pointer (20B)
+DMX_RECORD_SIZE = 76
+DMX_NONE = 0  # own feed, nothing expected
+DMX_PACKET = 1
+DMX_BLOB = 2
+
+
 class FeedManager:
     """
     Used for managing feeds and their corresponding feeds.
@@ -38,27 +87,65 @@ class FeedManager:
     Allows registering of callback functions on feeds.
     These callback functions are called every time something is appended to the
     registered feed.
+    Also owns the cache of FEED headers that get_feed hands out.
     """
 
     # minor boost for pycom device performance
     __slots__ = (
+        "_anchors",
         "_callbacks",
+        "_dmx_dirty",
+        "_dmx_saved",
+        "_pending",
+        "_wants",
+        "batch_size",
         "callback_lock",
         "dmx_lock",
         "dmx_table",
         "fids",
+        "headers",
         "keys",
+        "pending_lock",
     )
 
-    def __init__(self) -> None:
+    def __init__(
+        self, header_cache_size: int = HEADER_CACHE_SIZE, backend: str = None
+    ) -> None:
+        # storage of the feeds ("file" or "packed"), default: the current one
+        # (see storage.default_backend)
+        if backend is not None:
+            use_backend(backend)
+
+        # shared FEED headers, handed out by get_feed
+        self.headers = header_cache
+        self.headers.resize(header_cache_size)
+
         self._create_dirs()
+        repaired = recover_feeds()
+        if repaired:
+            print("repaired {} feeds after crash".format(repaired))
         self.keys = {}
         self._load_config()
         self.fids = self.listfids()
 
+        # received packets waiting for batch verification
+        # {fid: [wire packets, next seq, mid of last wire packet, idle flag]}
+        # signatures are not checked on pycom devices -> nothing to batch
+        self.pending_lock = allocate_lock()
+        self._pending = {}
+        self.batch_size = 1 if PYCOM else 8
+
+        # anchors offered for feeds of which the other nodes pruned the
+        # packets we miss, not verified yet (see handle_want)
+        # {fid: (anchor seq, anchor mid)}
+        self._anchors = {}
+
         # dmx and callbacks
         self.dmx_lock = allocate_lock()
         self.dmx_table = {}
+        self._wants = {}  # {fid: want dmx}
+        self._dmx_dirty = False  # changed since the last snapshot
+        self._dmx_saved = ticks_ms()
         self._fill_dmx()
         self.callback_lock = allocate_lock()
         self._callbacks = {}
@@ -78,11 +165,15 @@ class FeedManager:
     def _save_config(self) -> None:
         """
         Saves the currently stored dictionary of keys and feed IDs to a .json file.
+        Only the 32B seeds are saved.
         """
         f = open("fm_config.json", "w")
         f.write(
             dumps(
-                {hexlify(k).decode(): hexlify(v).decode() for k, v in self.keys.items()}
+                {
+                    hexlify(k).decode(): hexlify(v.sk_s[:32]).decode()
+                    for k, v in self.keys.items()
+                }
             )
         )
         f.close()
@@ -90,7 +181,9 @@ class FeedManager:
     def _load_config(self) -> None:
         """
         Loads the dictionary containing keys and their corresponding feed IDs
-        from the saved .json file.
+        from the saved .json file. The keys are kept as prepared SigningKey
+        instances (secret scalar, nonce prefix and verifying key), so signing
+        a packet does not have to derive them again.
         Does nothing if the file does not exist.
         """
         file_name = "fm_config.json"
@@ -101,80 +194,52 @@ class FeedManager:
         str_dict = loads(f.read())
         f.close()
 
-        self.keys = {
-            unhexlify(k.encode()): unhexlify(v.encode()) for k, v in str_dict.items()
-        }
+        self.keys = {}
+        for k, v in str_dict.items():
+            vkey = unhexlify(k.encode())
+            # seed + verifying key -> skips deriving the verifying key
+            self.keys[vkey] = SigningKey(unhexlify(v.encode()) + vkey)
 
-    def update_keys(self, keys: Dict[bytes, bytes]) -> None:
+    def update_keys(self, keys: Dict[bytes, Union[bytes, SigningKey]]) -> None:
         """
         Updates and saves the complete key dictionary.
+        Keys that are given as 32B seeds are prepared first.
         """
-        self.keys = keys
+        self.keys = {
+            k: v if isinstance(v, SigningKey) else SigningKey(bytes(v) + bytes(k))
+            for k, v in keys.items()
+        }
         self._save_config()
 
-    def generate_keypair(self, save_keys: bool = True) -> Tuple[bytearray, bytearray]:
+    def generate_keypair(self, save_keys: bool = True) -> Tuple[SigningKey, bytearray]:
         """
         Generates a new pure25519 key pair and returns them as a tuple:
         (signing key, verification key)
+        The signing key is a prepared SigningKey instance, which can be passed
+        to every function that signs packets.
         Also saves the new key pair to the self.keys dictionary.
         This can be disabled by setting save_keys=False
         """
         key, _ = create_keypair()
-        skey = key.sk_s[:32]
         vkey = key.vk_s
 
         if save_keys:
-            self.keys[vkey] = skey
+            self.keys[vkey] = key
             self._save_config()
-        return bytearray(skey), bytearray(vkey)
+        return key, bytearray(vkey)
 
     def listfids(self) -> List[bytearray]:
         """
         Returns a list of all feed IDs that are saved locally.
         """
-        is_feed = lambda fn: fn.endswith(".head")
-        fn2bytes = lambda fn: bytearray(unhexlify(fn[:-5].encode()))
-        return list(map(fn2bytes, list(filter(is_feed, listdir("_feeds")))))
+        return list_fids()
 
     def __str__(self) -> str:
         """
         Returns a string representation of all locally saved feeds.
         This is used in the web GUI.
-        Not optimized for pycom (very slow).
         """
-        # FIXME: optimize for pycom
-        string_builder = []
-        for fid in self.fids:
-            feed = get_feed(fid)
-            if get_parent(feed):
-                continue
-            else:
-                string_builder.append(to_string(feed))
-
-            # add children below parent feed
-            children = [(x, y, 0) for x, y in get_children(feed, index=True)]
-            while children:
-                child, index, offset = children.pop(0)
-                assert type(child) is bytearray
-                child_feed = get_feed(child)
-                child_str = to_string(child_feed)
-
-                # adjust padding
-                padding_len = index - feed.anchor_seq + offset
-                padding = "      " * padding_len
-                child_str = "\n".join(
-                    ["".join([padding, s]) for s in child_str.split("\n")]
-                )
-                string_builder.append(child_str)
-
-                # check for child of child
-                child_children = get_children(child_feed, index=True)
-                del child_feed
-                child_children = [(x, y, padding_len) for x, y in child_children]
-                del padding_len
-                children = child_children + children
-
-        return "\n".join(string_builder)
+        return _overview(self.fids)
 
     def __len__(self):
         """
@@ -194,28 +259,159 @@ class FeedManager:
         Called on start-up.
         The dmx table is a dictionary containing:
         {dmx: (handling function, feed ID)}
+        The values of feeds that did not change since the last snapshot
+        (see save_dmx) are taken from it, only the others are computed.
         """
+        snapshot = self._load_dmx()
+        computed = 0
         with self.dmx_lock:
             for fid in self.listfids():
                 feed = get_feed(fid)
                 b_fid = bytes(feed.fid)
+                record = snapshot.get(b_fid)
+                if record is None or not self._restore_dmx(feed, record):
+                    self._add_dmx(feed)
+                    computed += 1
+        if computed or len(snapshot) != len(self._wants):
+            self.save_dmx()
+
+    def _add_dmx(self, feed: struct[FEED]) -> None:
+        """
+        Computes the dmx values of the given feed and adds them to the
+        dmx table. Called with the dmx lock held.
+        """
+        b_fid = bytes(feed.fid)
+
+        # add want to dmx
+        want = bytes(get_want(feed)[:7])
+        self.dmx_table[want] = (self.handle_want, b_fid)
+        self._wants[b_fid] = want
+
+        # if key is not present -> add dmx value of next blob/packet
+        if b_fid not in self.keys:
+            blob_ptr = waiting_for_blob(feed)
+            if blob_ptr:
+                self.dmx_table[bytes(blob_ptr)] = (self.handle_blob, b_fid)
+            else:
+                self.dmx_table[bytes(get_next_dmx(feed))] = (
+                    self.handle_packet,
+                    b_fid,
+                )
+        self._dmx_dirty = True
+
+    def _restore_dmx(self, feed: struct[FEED], record: bytes) -> bool:
+        """
+        Adds the dmx values of the given snapshot record to the dmx table if
+        they are still valid for the given feed (same state, same key
+        situation, next blob not received yet). Called with the dmx lock held.
+        """
+        b_fid = bytes(feed.fid)
+        kind = record[48]
+        if record[32:48] != self._dmx_state(feed):
+            return False
+        if (kind == DMX_NONE) != (b_fid in self.keys):
+            return False
+        if kind == DMX_BLOB and blob_store.contains(record[56:76]):
+            return False
+
+        want = record[49:56]
+        self.dmx_table[want] = (self.handle_want, b_fid)
+        self._wants[b_fid] = want
+        if kind == DMX_PACKET:
+            self.dmx_table[record[56:63]] = (self.handle_packet, b_fid)
+        elif kind == DMX_BLOB:
+            self.dmx_table[record[56:76]] = (self.handle_blob, b_fid)
+        return True
 
-                # add want to dmx
-                want = get_want(feed)[:7]
-                self.dmx_table[bytes(want)] = (self.handle_want, b_fid)
+    def _dmx_state(self, feed: struct[FEED]) -> bytes:
+        """
+        Returns what the dmx values of the given feed depend on: the blob
+        cursor and the sequence number of the front packet.
+        """
+        header = bytearray_at(addressof(feed), 12)
+        return bytes(header) + feed.front_seq.to_bytes(4, "big")
+
+    def update_dmx(self, fid: bytearray) -> None:
+        """
+        Replaces the dmx values of the given feed (e.g. a new one) by newly
+        computed ones, the rest of the dmx table stays as it is.
+        """
+        b_fid = bytes(fid)
+        feed = get_feed(fid)
+        with self.dmx_lock:
+            for dmx in [k for k, v in self.dmx_table.items() if v[1] == b_fid]:
+                del self.dmx_table[dmx]
+            self._add_dmx(feed)
+
+    def _load_dmx(self) -> Dict[bytes, bytes]:
+        """
+        Reads the snapshot of the dmx table: {feed ID: record}.
+        Returns an empty dictionary if there is none (or another version).
+        """
+        try:
+            f = open(DMX_SNAPSHOT_FN, "rb")
+            content = f.read()
+            f.close()
+        except OSError:
+            return {}
+        if content[:5] != DMX_SNAPSHOT_MAGIC + bytes([DMX_SNAPSHOT_VERSION]):
+            return {}
+
+        snapshot = {}
+        for i in range(5, len(content) - DMX_RECORD_SIZE + 1, DMX_RECORD_SIZE):
+            snapshot[content[i : i + 32]] = content[i : i + DMX_RECORD_SIZE]
+        return snapshot
+
+    def save_dmx(self) -> None:
+        """
+        Saves a snapshot of the dmx table to DMX_SNAPSHOT_FN, together with
+        the state of every feed. On the next start, _fill_dmx only computes
+        the values of feeds whose state changed in the meantime.
+        Feeds with buffered packets (speculative dmx values) or without a
+        next value (being updated) are left out.
+        """
+        with self.pending_lock:
+            self._save_dmx()
+
+    def _save_dmx(self) -> None:
+        # called with the pending lock held
+        with self.dmx_lock:
+            nexts = {}
+            for dmx, value in self.dmx_table.items():
+                if self._wants.get(value[1]) != dmx:
+                    nexts[value[1]] = dmx
+            wants = list(self._wants.items())
+            self._dmx_dirty = False
+            self._dmx_saved = ticks_ms()
+
+        records = [DMX_SNAPSHOT_MAGIC + bytes([DMX_SNAPSHOT_VERSION])]
+        for b_fid, want in wants:
+            if b_fid in self._pending:
+                continue
+            record = bytearray(DMX_RECORD_SIZE)
+            record[:32] = b_fid
+            record[32:48] = self._dmx_state(get_feed(b_fid))
+            record[49:56] = want
+            if b_fid in self.keys:
+                record[48] = DMX_NONE
+            elif b_fid not in nexts:
+                continue
+            else:
+                dmx = nexts[b_fid]
+                record[48] = DMX_BLOB if len(dmx) == 20 else DMX_PACKET
+                record[56 : 56 + len(dmx)] = dmx
+            records.append(record)
 
-                # if key is not present -> add dmx value of next blob/packet
-                if bytes(fid) not in self.keys:
-                    blob_ptr = waiting_for_blob(feed)
-                    if blob_ptr:
-                        self.dmx_table[bytes(blob_ptr)] = (self.handle_blob, b_fid)
-                    else:
-                        self.dmx_table[bytes(get_next_dmx(feed))] = (
-                            self.handle_packet,
-                            b_fid,
-                        )
+        f = open(DMX_SNAPSHOT_FN + ".tmp", "wb")
+        f.write(b"".join(records))
+        f.close()
+        try:
+            remove(DMX_SNAPSHOT_FN)
+        except OSError:
+            pass
+        rename(DMX_SNAPSHOT_FN + ".tmp", DMX_SNAPSHOT_FN)
 
-    def get_key(self, fid: bytearray) -> Optional[bytearray]:
+    def get_key(self, fid: bytearray) -> Optional[SigningKey]:
         """
         Returns the key of the given feed ID.
         If no key is present, None is returned.
@@ -239,42 +435,123 @@ class FeedManager:
                 return None
             return self.dmx_table[b_msg]
 
-    def handle_want(self, fid: bytearray, request: bytearray) -> Optional[bytearray]:
+    def handle_want(
+        self, fid: bytearray, request: bytearray
+    ) -> Optional[Union[bytearray, List[bytearray]]]:
         """
         Handling function for incoming want requests.
         Fetches the asked packet/blob, if available and returns it.
-        """
+        A request for a range of packets (44B) is answered with a list of the
+        available ones (at most WANT_MAX_ANSWER).
+        Pruned packets are gone, a request for them is answered with the
+        anchor of the feed (31B, see get_anchor). The anchor frame carries
+        the dmx value of the wants and is handled here as well (see
+        _handle_anchor).
+        """
+        if len(request) == 31:
+            self._handle_anchor(fid, request)
+            return None
+
         req_feed = get_feed(fid)
         req_seq = int.from_bytes(request[39:43], "big")
 
         # check seq number
         if req_feed.front_seq < req_seq:
             return None
+        if req_seq <= req_feed.anchor_seq:
+            return get_anchor(req_feed)
 
-        # get packet
-        req_wire = bytearray(128)
+        # get packet(s)
         if len(request) == 43:
-            # packet
-            req_wire[:] = get_wire(req_feed, req_seq)
-        else:
-            # blob, len(request) == 63
-            blob_ptr = request[-20:]
-            try:
-                hex_ptr = hexlify(blob_ptr).decode()
-                f = open("_blobs/{}/{}".format(hex_ptr[:2], hex_ptr[2:]), "rb")
-                req_wire[:] = f.read(128)
-                f.close()
-            except Exception:
-                # blob not found
-                return None
+            return get_wire(req_feed, req_seq)
+        if len(request) == 44:
+            count = min(request[43], WANT_MAX_ANSWER)
+            last = min(req_seq + count, req_feed.front_seq + 1)
+            return [get_wire(req_feed, i) for i in range(req_seq, last)]
+
+        # blob, len(request) == 63 (None if not found)
+        return blob_store.get(request[-20:])
+
+    def _handle_anchor(self, fid: bytearray, anchor: bytearray) -> None:
+        """
+        Handles the anchor a node sent for the given feed since it pruned
+        the packets we asked for. If the anchor is ahead of the feed, the
+        packet after it is expected (see get_want). The anchor is only
+        trusted once that packet was verified (see handle_anchored), the
+        feed stays as it is until then.
+        """
+        b_fid = bytes(fid)
+        if b_fid in self.keys:
+            return
+        seq = int.from_bytes(anchor[7:11], "big")
+        mid = bytearray(anchor[11:31])
+        with self.pending_lock:
+            if seq <= get_feed(fid).front_seq:
+                return
+            with self.dmx_lock:
+                offered = self._anchors.get(b_fid)
+                if offered is not None:
+                    dmx = bytes(compute_dmx(fid, offered[0] + 1, offered[1]))
+                    self.dmx_table.pop(dmx, None)
+                self._anchors[b_fid] = (seq, mid)
+                dmx = bytes(compute_dmx(fid, seq + 1, mid))
+                self.dmx_table[dmx] = self.handle_anchored, b_fid
+
+    def handle_anchored(self, fid: bytearray, wire: bytearray) -> None:
+        """
+        Handling function for the packet after an anchor that was offered
+        for the given feed (see _handle_anchor).
+        The packet is verified against the anchor, the signature covers the
+        message ID of the anchor. If it is valid, the locally saved packets
+        are dropped, the feed continues at the anchor and the packet is
+        appended (see move_anchor).
+        """
+        b_fid = bytes(fid)
+        with self.pending_lock:
+            if b_fid not in self._anchors:
+                return
+            seq, mid = self._anchors[b_fid]
+            pkt = pkt_from_wire(fid, (seq + 1).to_bytes(4, "big"), mid, wire)
+            if pkt is None:
+                print("verification of packet failed")
+                return
+            del self._anchors[b_fid]
 
-        return req_wire
+            # buffered packets are in front of the anchor
+            self._flush(fid)
+            feed = get_feed(fid)
+            if seq <= feed.front_seq:
+                # caught up in the meantime, the packet is asked for again
+                self.update_dmx(fid)
+                return
+            move_anchor(feed, seq, mid)
+            append_packets(feed, [pkt])
+            del pkt
+            self.update_dmx(fid)
+            if waiting_for_blob(feed) is None:
+                self._handle_front(fid, feed)
 
     def handle_packet(self, fid: bytearray, wire: bytearray) -> None:
         """
         Handling function for incoming packets.
         The packet is verified and appended.
         Updates the dmx table and executes possible callback functions.
+        Packets that do not create feeds or blob chains are buffered and
+        verified together once self.batch_size packets of the feed arrived
+        (see flush_pending).
+        """
+        with self.pending_lock:
+            if self.batch_size > 1 and wire[15] not in (CHAIN20, CONTDAS, MKCHILD):
+                self._buffer_packet(fid, wire)
+                return
+
+            # appending this packet has side effects -> flush buffer first
+            self._flush(fid)
+            self._handle_packet(fid, wire)
+
+    def _handle_packet(self, fid: bytearray, wire: bytearray) -> None:
+        """
+        Verifies, appends and handles a single packet.
         """
         feed = get_feed(fid)
         wpkt = struct(addressof(wire), WIRE_PACKET, BIG_ENDIAN)
@@ -292,12 +569,20 @@ class FeedManager:
         # update dmx value
         with self.dmx_lock:
             del self.dmx_table[bytes(wpkt.dmx)]
+            self._dmx_dirty = True
             if blob_ptr is None:
                 self.dmx_table[bytes(next_dmx)] = self.handle_packet, bytes(fid)
             else:
                 self.dmx_table[bytes(blob_ptr)] = self.handle_blob, bytes(fid)
                 return
 
+        self._handle_front(fid, feed)
+
+    def _handle_front(self, fid: bytearray, feed: struct[FEED]) -> None:
+        """
+        Creates the feed the front packet of the given feed announces (if
+        any) and executes the callback functions.
+        """
         # check for child or continuation feed
         front_wire = get_wire(feed, -1)
         if front_wire[15:16] in [
@@ -309,13 +594,176 @@ class FeedManager:
                 front_wire[16:48], parent_seq=feed.front_seq, parent_fid=fid
             )
             with self.dmx_lock:
-                b_fid = bytes(new_feed.fid)
-                want = get_want(new_feed)[:7]
-                self.dmx_table[bytes(want)] = (self.handle_want, b_fid)
-                next_dmx = get_next_dmx(new_feed)
-                self.dmx_table[bytes(next_dmx)] = (self.handle_packet, b_fid)
+                self._add_dmx(new_feed)
+
+        self._execute_callbacks(fid)
+
+    def _buffer_packet(self, fid: bytearray, wire: bytearray) -> None:
+        """
+        Adds the given (unverified) wire packet to the batch of its feed.
+        The dmx table is already advanced to the packet after it, so that a
+        run of packets can be received before the batch is verified.
+        The dmx values of the buffered packets stay in the table until the
+        batch is verified: anyone can compute them, so a forged frame may
+        have taken the place of a packet. If a different frame with the dmx
+        value of a buffered packet arrives, the batch is verified right away
+        and the frame is handled again against the verified feed.
+        """
+        b_fid = bytes(fid)
+        if b_fid not in self._pending:
+            feed = get_feed(fid)
+            self._pending[b_fid] = [
+                [],
+                feed.front_seq + 1,
+                bytearray(feed.front_mid),
+                False,
+            ]
+            del feed
+
+        pending = self._pending[b_fid]
+        wires, seq, prev_mid, _ = pending
+        if compute_dmx(fid, seq, prev_mid) != wire[8:15]:
+            # not the next packet: a buffered one again, or a competing frame
+            for buffered in wires:
+                if buffered[8:15] == wire[8:15] and buffered != wire:
+                    self._flush(fid)
+                    self._buffer_packet(fid, wire)
+                    break
+            return
+
+        # compute mid without verification -> dmx of next packet
+        pkt = pkt_from_wire(
+            fid, seq.to_bytes(4, "big"), prev_mid, wire, verify=False
+        )
+        wires.append(wire)
+        pending[1] = seq + 1
+        pending[2] = bytearray(pkt.mid)
+        pending[3] = False
+        del pkt
+
+        with self.dmx_lock:
+            next_dmx = compute_dmx(fid, seq + 1, pending[2])
+            self.dmx_table[bytes(next_dmx)] = self.handle_packet, b_fid
+
+        if len(wires) >= self.batch_size:
+            self._flush(fid)
+
+    def _flush(self, fid: bytearray) -> None:
+        """
+        Verifies the buffered packets of the given feed as a batch and
+        appends every valid packet (up to the first invalid one) at once.
+        If callbacks are registered on the feed, the packets are appended
+        one by one and the callbacks are executed after each of them.
+        """
+        b_fid = bytes(fid)
+        if b_fid not in self._pending:
+            return
+
+        wires, seq, prev_mid, _ = self._pending.pop(b_fid)
+        speculative = [bytes(wire[8:15]) for wire in wires]
+        speculative.append(bytes(compute_dmx(fid, seq, prev_mid)))
+        del seq, prev_mid
+
+        feed = get_feed(fid)
+        pkts = pkts_from_wires(
+            feed.fid,
+            (feed.front_seq + 1).to_bytes(4, "big"),
+            feed.front_mid,
+            wires,
+        )
+        if len(pkts) < len(wires):
+            print("verification of packet failed")
+
+        with self.callback_lock:
+            has_callbacks = b_fid in self._callbacks
+        if has_callbacks:
+            # callbacks look at the front packet -> one at a time
+            for pkt in pkts:
+                append_packets(feed, [pkt])
+                self._execute_callbacks(fid)
+        else:
+            append_packets(feed, pkts)
+        del pkts, wires
+
+        # replace speculative dmx values (the next one differs if a packet
+        # was invalid, which re-arms the dmx value of that packet)
+        with self.dmx_lock:
+            for dmx in speculative:
+                self.dmx_table.pop(dmx, None)
+            self.dmx_table[bytes(get_next_dmx(feed))] = self.handle_packet, b_fid
+            self._dmx_dirty = True
+
+    def flush_pending(self, force: bool = False) -> None:
+        """
+        Verifies and appends buffered packets, also if the batches are not
+        full yet. Only batches that did not grow since the last call are
+        flushed (end of a run of packets), unless force=True.
+        Called periodically by the node, also commits the append journal
+        once its oldest record is old enough and saves a snapshot of the
+        changed dmx table every DMX_SNAPSHOT_MS.
+        """
+        with self.pending_lock:
+            for b_fid in list(self._pending.keys()):
+                pending = self._pending[b_fid]
+                if force or pending[3]:
+                    self._flush(b_fid)
+                else:
+                    pending[3] = True
+            age = ticks_diff(ticks_ms(), self._dmx_saved)
+            if self._dmx_dirty and age >= DMX_SNAPSHOT_MS:
+                self._save_dmx()
+        journal.tick()
+
+    def prune(self, policy: Callable[[struct[FEED]], Optional[int]]) -> int:
+        """
+        Prunes the locally saved feeds: policy returns the new anchor
+        sequence number for a given feed, or None to keep it as it is.
+        Afterwards, blobs that are no longer referenced are removed.
+        Holds the pending lock, no packets or blobs are appended meanwhile.
+        Returns the number of bytes reclaimed.
+        """
+        self.flush_pending(force=True)
+        reclaimed = 0
+        with self.pending_lock:
+            for fid in self.listfids():
+                feed = get_feed(fid)
+                seq = policy(feed)
+                if seq is not None:
+                    reclaimed += prune_feed(feed, min(seq, feed.front_seq - 1))
+            reclaimed += collect_blobs()
+        return reclaimed
 
-        # execute callbacks, extract functions first to avoid blocked lock
+    def get_want(self, fid: bytearray, count: int = 1) -> bytearray:
+        """
+        Returns the "want" bytearray for the given feed ID (for count packets,
+        see feed.get_want).
+        Unlike feed.get_want, buffered packets are already counted as received
+        and the packets after an offered anchor are asked for (see
+        _handle_anchor).
+        """
+        feed = get_feed(fid)
+        want = get_want(feed, count)
+        with self.pending_lock:
+            b_fid = bytes(fid)
+            anchor = self._anchors.get(b_fid)
+            if anchor is not None and anchor[0] <= feed.front_seq:
+                # caught up without it
+                del self._anchors[b_fid]
+            elif anchor is not None:
+                # also instead of a blob of a pruned chain
+                want = want[:43]
+                want[39:43] = (anchor[0] + 1).to_bytes(4, "big")
+                if count > 1:
+                    want.append(min(count, 255))
+            elif len(want) != 63 and b_fid in self._pending:
+                want[39:43] = self._pending[b_fid][1].to_bytes(4, "big")
+        return want
+
+    def _execute_callbacks(self, fid: bytearray) -> None:
+        """
+        Executes the callback functions that are registered on the given feed.
+        """
+        # extract functions first to avoid blocked lock
         fn_lst = []
         self.callback_lock.acquire()
         if fid in self._callbacks:
@@ -331,43 +779,39 @@ class FeedManager:
         Handling function for incoming blobs.
         The blob is verified and appended.
         Updates the dmx table and executes possible callback functions.
+        Holds the pending lock, so that the blob is not stored while unused
+        blobs are collected (see prune).
         """
-        feed = get_feed(fid)
-
-        if not verify_and_append_blob(feed, blob):
-            # invalid blob
-            return
+        with self.pending_lock:
+            feed = get_feed(fid)
 
-        # update dmx table
-        signature = sha256(blob[8:]).digest()[:20]
-        with self.dmx_lock:
-            del self.dmx_table[signature]
+            if not verify_and_append_blob(feed, blob):
+                # invalid blob
+                return
 
-        next_ptr = waiting_for_blob(feed)
-        if not next_ptr:
-            # blob was last of chain, packet is next
+            # update dmx table
+            signature = sha256(blob[8:]).digest()[:20]
             with self.dmx_lock:
-                self.dmx_table[bytes(get_next_dmx(feed))] = self.handle_packet, bytes(
-                    fid
-                )
-
-            # execute callbacks, avoid blocked lock
-            fn_lst = []
-            self.callback_lock.acquire()
-            if fid in self._callbacks:
-                fn_lst.append(self._callbacks[fid])
-            self.callback_lock.release()
-
-            # execute
-            for fns in fn_lst:
-                [fn(fid) for fn in fns]
-            return
+                del self.dmx_table[signature]
+                self._dmx_dirty = True
+
+            next_ptr = waiting_for_blob(feed)
+            if not next_ptr:
+                # blob was last of chain, packet is next
+                with self.dmx_lock:
+                    self.dmx_table[bytes(get_next_dmx(feed))] = (
+                        self.handle_packet,
+                        bytes(fid),
+                    )
+
+                self._execute_callbacks(fid)
+                return
 
-        # expecting another blob
-        with self.dmx_lock:
-            self.dmx_table[bytes(next_ptr)] = self.handle_blob, bytes(fid)
+            # expecting another blob
+            with self.dmx_lock:
+                self.dmx_table[bytes(next_ptr)] = self.handle_blob, bytes(fid)
 
-        # no callback functions, since the blob is not complete
+            # no callback functions, since the blob is not complete
 
     def register_callback(self, fid: bytearray, function) -> None:
         """
@@ -424,11 +868,14 @@ class FeedManager:
         Appends the given payload as a CHAIN20 packet/blob chain to the given feed.
         If the key cannot be found, the packet is not appended and
         False is returned.
+        Like handle_blob, this does not happen while unused blobs are
+        collected (see prune).
         """
         if type(feed) is bytearray:
             feed = get_feed(feed)
         try:
-            append_blob(feed, payload, self.keys[bytes(feed.fid)])
+            with self.pending_lock:
+                append_blob(feed, payload, self.keys[bytes(feed.fid)])
             return True
         except Exception:
             print("key not in dictionary")
@@ -440,27 +887,27 @@ def get_feed_overview() -> str:
     Identical to FeedManager.__str__.
     Used for creating a string representation of all available feeds without
     creating or passing an instance of the FeedManager class.
-    Not optimized for pycom devices, very slow.
     """
-    string_builder = []
-    is_feed = lambda fn: fn.endswith(".head")
-    fn2bytes = lambda fn: bytearray(unhexlify(fn[:-5].encode()))
-    fids = list(map(fn2bytes, list(filter(is_feed, listdir("_feeds")))))
+    return _overview(list_fids())
+
 
-    for fid in fids:
+def _overview(fids: List[bytearray]) -> str:
+    """
+    Returns the string representations of the given feeds, every child feed
+    indented below its parent at the position of its MKCHILD packet.
+    The structure is taken from the feed tree, only to_string reads packets.
+    """
+    tree = get_tree()
+    string_builder = []
+    for fid in tree.get_roots(fids):
         feed = get_feed(fid)
-        if get_parent(feed) is not None:
-            continue
-        else:
-            string_builder.append(to_string(feed))
+        string_builder.append(to_string(feed))
 
         # add children of feed below
-        children = [(x, y, 0) for x, y in get_children(feed, index=True)]
+        children = [(x, y, 0) for x, y in tree.get_children(fid, index=True)]
         while children:
             child, index, offset = children.pop(0)
-            assert type(child) is bytearray
-            child_feed = get_feed(child)
-            child_str = to_string(child_feed)
+            child_str = to_string(get_feed(child))
 
             # adjust padding
             padding_len = index - feed.anchor_seq + offset
@@ -471,10 +918,9 @@ def get_feed_overview() -> str:
             string_builder.append(child_str)
 
             # check for child of child
-            child_children = get_children(child_feed, index=True)
-            del child_feed
-            child_children = [(x, y, padding_len) for x, y in child_children]
-            del padding_len
+            child_children = [
+                (x, y, padding_len) for x, y in tree.get_children(child, index=True)
+            ]
             children = child_children + children
 
     return "\n".join(string_builder)
@@ -0,0 +1,172 @@
+from .util import PYCOM, SYNC, sync_file
+from _thread import allocate_lock
+from sys import implementation
+from uos import stat
+
+try:
+    from time import ticks_ms, ticks_diff
+except ImportError:
+    # regular python
+    from time import time
+
+    ticks_ms = lambda: int(time() * 1000)
+    ticks_diff = lambda end, start: end - start
+
+
+# helps with debugging in vim
+if implementation.name != "micropython":
+    from typing import Callable, List, Tuple
+
+
+JOURNAL_FN = "_feeds/append.jnl"
+
+# pending bytes / age of the oldest pending record that trigger a commit
+JOURNAL_MAX_BYTES = 2048 if PYCOM else 32768
+JOURNAL_MAX_MS = 1000
+
+# size of the journal file that triggers a checkpoint
+JOURNAL_MAX_FILE = 16384 if PYCOM else 1048576
+
+
+class AppendJournal:
+    """
+    Group-commit journal of feed appends.
+    Every append (after its unsynchronized log and header writes) records
+    the new 128B FEED header and the appended wire packets. Records are
+    collected in memory and written to JOURNAL_FN with a single write and
+    a single sync, once JOURNAL_MAX_BYTES are pending or the oldest record
+    is JOURNAL_MAX_MS old (see tick). A crash thus loses at most the
+    uncommitted appends, and feed.recover_feeds replays the committed ones.
+    Once the file reaches JOURNAL_MAX_FILE, the stored logs and headers of
+    the journaled feeds are synced and the journal is emptied (checkpoint).
+    Nothing is recorded if the port cannot sync files (util.SYNC): the
+    journal would be no more durable than the logs and headers, which
+    recover_feeds then only matches with each other.
+    """
+
+    __slots__ = (
+        "_dirty",
+        "_file_size",
+        "_sync",
+        "_lock",
+        "_pending",
+        "_pending_size",
+        "_since",
+        "commits",
+    )
+
+    def __init__(self, sync: Callable[[bytes], None]) -> None:
+        self._sync = sync  # syncs the log and header of a feed ID
+        self._lock = allocate_lock()
+        self._pending = []
+        self._pending_size = 0
+        self._since = 0  # ticks of the oldest pending record
+        self._dirty = set()  # feed IDs in the journal file
+        try:
+            self._file_size = stat(JOURNAL_FN)[6]
+        except OSError:
+            self._file_size = 0
+        self.commits = 0
+
+    def record(self, header: bytearray, wires: bytearray) -> None:
+        """
+        Records an append: the updated header and the appended wire packets.
+        """
+        if not SYNC:
+            return
+        rec = bytearray(130 + len(wires))
+        rec[:128] = header
+        rec[128:130] = (len(wires) // 128).to_bytes(2, "big")
+        rec[130:] = wires
+        with self._lock:
+            if not self._pending:
+                self._since = ticks_ms()
+            self._pending.append(rec)
+            self._pending_size += len(rec)
+            if self._pending_size >= JOURNAL_MAX_BYTES:
+                self._commit()
+
+    def tick(self) -> None:
+        """
+        Commits the pending records if the oldest one is old enough.
+        Called periodically.
+        """
+        with self._lock:
+            age = ticks_diff(ticks_ms(), self._since)
+            if self._pending and age >= JOURNAL_MAX_MS:
+                self._commit()
+
+    def commit(self) -> None:
+        """
+        Commits all pending records.
+        """
+        with self._lock:
+            self._commit()
+
+    def _commit(self) -> None:
+        # called with the lock held
+        if not self._pending:
+            return
+        f = open(JOURNAL_FN, "ab")
+        f.write(b"".join(self._pending))
+        sync_file(f)
+        f.close()
+        for rec in self._pending:
+            self._dirty.add(bytes(rec[12:44]))  # FEED.fid
+        self._file_size += self._pending_size
+        self._pending = []
+        self._pending_size = 0
+        self.commits += 1
+
+        if self._file_size >= JOURNAL_MAX_FILE:
+            self._checkpoint()
+
+    def checkpoint(self) -> None:
+        """
+        Commits the pending records, syncs the storage of all journaled feeds
+        and empties the journal.
+        """
+        with self._lock:
+            self._commit()
+            self._checkpoint()
+
+    def _checkpoint(self) -> None:
+        # called with the lock held
+        for b_fid in self._dirty:
+            self._sync(b_fid)
+        self._dirty = set()
+        self.reset()
+
+    def reset(self) -> None:
+        """
+        Empties the journal file (pending records are kept).
+        """
+        f = open(JOURNAL_FN, "wb")
+        sync_file(f)
+        f.close()
+        self._file_size = 0
+
+    def read(self) -> List[Tuple[bytearray, bytearray]]:
+        """
+        Returns the committed (header, wire packets) records in order.
+        A torn record at the end of the file is ignored.
+        """
+        try:
+            f = open(JOURNAL_FN, "rb")
+            content = f.read()
+            f.close()
+        except OSError:
+            return []
+
+        records = []
+        i = 0
+        while i + 130 <= len(content):
+            n = int.from_bytes(content[i + 128 : i + 130], "big")
+            end = i + 130 + 128 * n
+            if end > len(content):
+                break
+            records.append(
+                (bytearray(content[i : i + 128]), bytearray(content[i + 130 : end]))
+            )
+            i = end
+        return records
@@ -1,16 +1,27 @@
-from .feed import get_children, length, get_want, get_feed, FEED
+from .feed import get_children, length, get_feed, FEED
 from .feed_manager import FeedManager
 from .html import Holder as HTMLHolder
 from .http import Holder as HTTPHolder
 from .http import run_http
+from .scheduler import (
+    LORA_AIRTIME_BURST,
+    LORA_AIRTIME_RATE,
+    UDP_TX_BURST,
+    UDP_TX_RATE,
+    WANT_MAX_MS,
+    TxScheduler,
+    WantScheduler,
+    lora_airtime,
+)
 from .util import PYCOM, listdir
 from .version_manager import VersionManager
 from .visualizer import Visualizer
 from _thread import start_new_thread, allocate_lock
 from hashlib import sha256
 from json import dumps, loads
+from micropython import const
 from os import urandom
-from sys import platform
+from sys import implementation, platform
 from time import sleep
 from ubinascii import hexlify, unhexlify
 from uctypes import struct
@@ -28,6 +39,88 @@ from usocket import (
 if PYCOM:
     from socket import AF_LORA, SOCK_RAW
 
+try:
+    from time import ticks_ms, ticks_diff
+except ImportError:
+    # regular python
+    from time import time
+
+    ticks_ms = lambda: int(time() * 1000)
+    ticks_diff = lambda end, start: end - start
+
+# helps with debugging in vim
+if implementation.name != "micropython":
+    from typing import Callable, List, Optional, Tuple
+
+
+# maximum number of received frames waiting for the RX worker
+RX_QUEUE_SIZE = const(64)
+
+# pause of the LoRa loop if nothing was sent or received (s)
+LORA_POLL_INTERVAL = 0.05
+
+# packets requested at once per feed, and the time after which the packets
+# of a window that did not arrive are requested again
+WANT_WINDOW = 4 if PYCOM else 16
+WANT_WINDOW_MS = 8000 if PYCOM else 2000
+
+# received frames that arrived before the packets they follow (see _reorder)
+REORDER_SIZE = 2 * WANT_WINDOW
+
+# UDP: frames per datagram in batching mode (see pack_frames), and the
+# maximum size of a received datagram
+UDP_BATCH_FRAMES = 8
+UDP_MAX_DATAGRAM = 2048
+
+# UDP: interval of the empty batch announcing that a node unpacks batches,
+# and the time after which a silent peer is forgotten (see _batch_size)
+PEER_HELLO_MS = 5000
+PEER_TIMEOUT_MS = 2 * WANT_MAX_MS
+
+# lengths of a single frame: anchor, want, range want, blob want, packet/blob
+FRAME_LENGTHS = (31, 43, 44, 63, 128)
+
+
+def pack_frames(frames: List[bytearray]) -> bytes:
+    """
+    Returns the payload of a UDP datagram carrying the given frames.
+    A single frame is sent as it is. Several frames are preceded by their
+    count and each one by its length (1B each), the payload length then
+    never equals the length of a single frame (see unpack_frames).
+    No frames (a single zero byte) announce that the sender unpacks
+    batches, nodes without batching drop it as an invalid frame.
+    """
+    if len(frames) == 1:
+        return bytes(frames[0])
+    parts = [bytes([len(frames)])]
+    for frame in frames:
+        parts.append(bytes([len(frame)]))
+        parts.append(bytes(frame))
+    return b"".join(parts)
+
+
+def unpack_frames(payload: bytes) -> List[bytes]:
+    """
+    Returns the frames carried by the given datagram payload (see
+    pack_frames). Malformed batches are dropped.
+    """
+    if len(payload) in FRAME_LENGTHS:
+        return [payload]
+    if not payload:
+        return []
+
+    frames = []
+    i = 1
+    for _ in range(payload[0]):
+        if i >= len(payload):
+            return []
+        end = i + 1 + payload[i]
+        frames.append(payload[i + 1 : end])
+        i = end
+    if i != len(payload):
+        return []
+    return frames
+
 
 class Node:
     """
@@ -41,30 +134,75 @@ class Node:
 
     # minor performance boost
     __slots__ = (
+        "batch_frames",
         "feed_manager",
         "group",
         "http",
+        "hello_sent",
         "master_fid",
+        "peer_lock",
+        "peers",
         "prev_send",
         "prev_send_lock",
-        "queue",
-        "queue_lock",
+        "reorder",
+        "reorder_lock",
+        "rx_dropped",
+        "rx_lock",
+        "rx_max_depth",
+        "rx_queue",
+        "rx_wake",
         "this",
+        "tx",
         "version_manager",
         "viz",
+        "want_scheduler",
+        "window_lock",
+        "windows",
     )
 
-    def __init__(self, enable_http: bool = False) -> None:
-        self.feed_manager = FeedManager()
+    def __init__(
+        self, enable_http: bool = False, batch_frames: int = 1, backend: str = None
+    ) -> None:
+        self.feed_manager = FeedManager(backend=backend)
         self.master_fid = None
         self._load_config()
 
-        # queue containing outgoing messages and requests
-        self.queue_lock = allocate_lock()
-        self.queue = []
-
-        # UDP group (not on pycom devices)
+        # queue containing outgoing messages and requests, paced by frames
+        # per second (UDP) or by airtime (LoRa)
+        if PYCOM:
+            self.tx = TxScheduler(LORA_AIRTIME_RATE, LORA_AIRTIME_BURST, lora_airtime)
+        else:
+            self.tx = TxScheduler(UDP_TX_RATE, UDP_TX_BURST)
+
+        # received frames waiting for verification/appending (not on pycom)
+        # [(handling function, feed ID, is packet, frame)]
+        self.rx_lock = allocate_lock()
+        self.rx_queue = []
+        self.rx_wake = allocate_lock()  # held while the queue is empty
+        self.rx_wake.acquire()
+        self.rx_dropped = 0
+        self.rx_max_depth = 0
+
+        # which feeds are asked for new packets periodically
+        self.want_scheduler = WantScheduler()
+
+        # requested packets per feed: {fid: (last requested seq, ticks)}
+        self.window_lock = allocate_lock()
+        self.windows = {}
+
+        # unknown frames that may be packets ahead of the next expected one
+        # [(dmx, frame, ticks received)], oldest first
+        self.reorder_lock = allocate_lock()
+        self.reorder = []
+
+        # UDP group (not on pycom devices), maximum frames sent per datagram
         self.group = getaddrinfo("224.1.1.1", 5000)[0][-1]
+        self.batch_frames = batch_frames
+
+        # peers heard in the group: {id: [unpacks batches, ticks last heard]}
+        self.peer_lock = allocate_lock()
+        self.peers = {}
+        self.hello_sent = None
         self.http = enable_http
         self.version_manager = VersionManager(self.feed_manager)
 
@@ -140,155 +278,419 @@ class Node:
         """
         Listens for incoming UDP messages and filters out own messages using the
         random self.this bytes. NOT used with LoRa on pycom devices.
+        Frames are only classified and queued here, verifying and appending
+        them is left to _process_rx. This keeps the socket drained, however
+        long the verification of a packet takes.
+        Datagrams carrying several frames (see pack_frames) are split, their
+        sender is recorded as a peer that unpacks batches.
         """
         while True:
-            msg, _ = sock.recvfrom(1024)
+            msg, _ = sock.recvfrom(UDP_MAX_DATAGRAM)
             if msg[:8] == bytes(self.this):
                 # own message
                 continue
-            self._handle_packet(msg[8:])
+            payload = msg[8:]
+            frames = unpack_frames(payload)
+            # a (well-formed) batch starts with its number of frames
+            batch = len(payload) not in FRAME_LENGTHS
+            batch = batch and payload[:1] == bytes([len(frames)])
+            self._record_peer(bytes(msg[:8]), batch)
+            for frame in frames:
+                self._enqueue_rx(frame)
+
+    def _record_peer(self, peer: bytes, batch: bool) -> None:
+        """
+        Records that the given peer was heard (and sent a batch).
+        """
+        with self.peer_lock:
+            state = self.peers.get(peer)
+            if state is None:
+                state = self.peers[peer] = [False, 0]
+            state[0] = state[0] or batch
+            state[1] = ticks_ms()
+
+    def _batch_size(self) -> int:
+        """
+        Returns the number of frames that may be sent per datagram:
+        self.batch_frames if every peer heard within PEER_TIMEOUT_MS has sent
+        a batch (or the announcement of pack_frames), otherwise 1, so nodes
+        without batching can read every datagram.
+        """
+        if self.batch_frames <= 1:
+            return 1
+        now = ticks_ms()
+        with self.peer_lock:
+            for peer in list(self.peers.keys()):
+                batch, heard = self.peers[peer]
+                if ticks_diff(now, heard) > PEER_TIMEOUT_MS:
+                    del self.peers[peer]
+                elif not batch:
+                    return 1
+            return self.batch_frames if self.peers else 1
+
+    def _enqueue_rx(self, msg: bytes) -> None:
+        """
+        Classifies the given frame and appends it to the RX queue.
+        Frames are dropped (and counted) if the queue is full.
+        """
+        tpl = self._classify(msg)
+        if tpl is None:
+            return
 
-    def _handle_packet(self, msg: bytes) -> None:
+        with self.rx_lock:
+            if len(self.rx_queue) >= RX_QUEUE_SIZE:
+                self.rx_dropped += 1
+                return
+            self.rx_queue.append(tpl + (bytearray(msg),))
+            if len(self.rx_queue) == 1:
+                self.rx_wake.release()
+            if len(self.rx_queue) > self.rx_max_depth:
+                self.rx_max_depth = len(self.rx_queue)
+
+    def _process_rx(self) -> None:
+        """
+        Handles the frames of the RX queue in order of arrival. A single
+        worker, so the packets of a feed are appended one after the other.
+        Blocks while the queue is empty (on a lock that is only held while
+        the queue is empty, see TxScheduler).
+        Not used on pycom devices.
+        """
+        while True:
+            # wait until the queue is not empty
+            self.rx_wake.acquire()
+            self.rx_wake.release()
+
+            with self.rx_lock:
+                item = self.rx_queue.pop(0)
+                if not self.rx_queue:
+                    self.rx_wake.acquire(0)
+
+            fn, fid, is_pkt, msg = item
+            del item
+            self._dispatch(fn, fid, is_pkt, msg)
+            if is_pkt:
+                self._drain_reorder()
+
+    def rx_stats(self) -> Tuple[int, int, int]:
+        """
+        Returns the current and maximum depth of the RX queue and the number
+        of frames dropped because it was full.
         """
-        Used for handling incoming messages.
-        After a new packet is appended, the request for the next packet/blob
-        in the feed is inserted at the first position of the queue (greedy).
-        Runs on pycom and in UNIX.
+        with self.rx_lock:
+            return len(self.rx_queue), self.rx_max_depth, self.rx_dropped
+
+    def want_stats(self) -> Tuple[int, int, int]:
+        """
+        Returns the number of feeds asked for packets, the number of wants
+        sent and the number of useful responses (see WantScheduler).
+        """
+        return self.want_scheduler.stats()
+
+    def tx_stats(self) -> Tuple[int, int, int, float]:
+        """
+        Returns the length of the TX queue, the number of sent frames, the
+        number of suppressed duplicates and the achieved frames per second
+        since the previous call.
+        """
+        return self.tx.stats()
+
+    def prune(self) -> int:
+        """
+        Prunes the local feeds using the pruning policy of the version manager
+        and returns the number of bytes reclaimed.
+        """
+        reclaimed = self.feed_manager.prune(self.version_manager.prune_policy)
+        print("pruned feeds, {} bytes reclaimed".format(reclaimed))
+        return reclaimed
+
+    def _classify(
+        self, msg: bytes
+    ) -> Optional[Tuple[Callable[[bytearray, bytearray], None], bytearray, bool]]:
+        """
+        Looks up the handling function of an incoming message in the dmx table.
+        Returns the function, the feed ID and whether the message is a packet
+        (as opposed to a request or blob), or None if the message is unknown.
         Registers actions to the visualizer (not on pycom).
         """
         msg_len = len(msg)
 
         if msg_len > 128:
             print("message discarded, too long")
-            return
+            return None
 
-        # packet or blob request
-        if msg_len == 43 or msg_len == 63:
-            tpl = self.feed_manager.consult_dmx(bytearray(msg[:7]))
-            if tpl:
-                fn, fid = tpl
+        tpl = None
+        is_pkt = False
 
-                # register action in visualizer
-                if self.viz:
-                    self.viz.register_rx(fid)
-
-                # prepend requested packet/blob to queue
-                req_wire = fn(fid, bytearray(msg))
-                if req_wire:
-                    with self.queue_lock:
-                        self.queue.insert(0, req_wire)
-                return
+        # packet (range) or blob request, anchor of pruned packets
+        if msg_len == 43 or msg_len == 44 or msg_len == 63 or msg_len == 31:
+            tpl = self.feed_manager.consult_dmx(bytearray(msg[:7]))
 
         # new packet or blob
         elif msg_len == 128:
             # check packet first -> avoid hashing for regular packets
             tpl = self.feed_manager.consult_dmx(bytearray(msg[8:15]))
-            if tpl:
-                fn, fid = tpl
+            is_pkt = tpl is not None
+            if not tpl:
+                # not a packet -> check whether it is a blob
+                # check if hash is in table
+                hash = bytearray(sha256(msg[8:]).digest()[:20])
+                tpl = self.feed_manager.consult_dmx(hash)
+        else:
+            print("received invalid packet")
 
-                # register action in visualizer
-                if self.viz:
-                    self.viz.register_rx(fid)
+        if not tpl:
+            if msg_len == 128:
+                self._reorder(msg)
+            return None
 
-                # execute handler
-                # FIXME: can/should this be done in a new thread?
-                fn(fid, bytearray(msg))
+        fn, fid = tpl
 
-                # maybe new packet contains update feed -> start version manager
-                if not self.version_manager.is_configured():
-                    self._start_version_manager()
+        # register action in visualizer
+        if self.viz:
+            self.viz.register_rx(fid)
 
-                # prepend want to next packet of feed (greedy)
-                with self.queue_lock:
-                    self.queue.insert(0, get_want(get_feed(fid)))
-                return
+        return fn, fid, is_pkt
 
-            # not a packet -> check whether it is a blob
-            # check if hash is in table
-            hash = bytearray(sha256(msg[8:]).digest()[:20])
+    def _dispatch(
+        self,
+        fn: Callable[[bytearray, bytearray], None],
+        fid: bytearray,
+        is_pkt: bool,
+        msg: bytearray,
+    ) -> None:
+        """
+        Executes the handling function of a classified message.
+        After a new packet is appended, the request for the next packets/blob
+        in the feed is inserted at the first position of the queue (greedy),
+        unless the packets are requested already (see _next_wants).
+        The message is dropped if its dmx value no longer leads to the given
+        feed (classified before the frames queued ahead of it were handled,
+        e.g. a duplicate of a packet appended since).
+        """
+        if len(msg) != 128:
+            key = msg[:7]
+        elif is_pkt:
+            key = msg[8:15]
+        else:
+            key = sha256(msg[8:]).digest()[:20]
+        # only the feed ID is compared: the handling functions are bound
+        # methods, created anew whenever a dmx value is set, and micropython
+        # does not compare them by function and instance
+        tpl = self.feed_manager.consult_dmx(key)
+        if tpl is None or tpl[1] != fid:
+            return
 
-            tpl = self.feed_manager.consult_dmx(hash)
-            if tpl:
-                fn, fid = tpl
+        if len(msg) != 128:
+            # the peer has newer packets -> ask it right away
+            if len(msg) == 31:
+                # anchor, the peer pruned the packets we asked for
+                peer_front = int.from_bytes(msg[7:11], "big") + 1
+            else:
+                peer_front = int.from_bytes(msg[39:43], "big")
+            if len(msg) == 43 or len(msg) == 44:
+                peer_front -= 1
+            if peer_front > get_feed(fid).front_seq:
+                self.want_scheduler.reset(fid)
+
+            # prepend requested packet(s)/blob to queue, in order
+            req_wire = fn(fid, msg)
+            if isinstance(req_wire, list):
+                for wire in reversed(req_wire):
+                    self.tx.push_front(wire)
+            elif req_wire:
+                self.tx.push_front(req_wire)
+            return
+
+        # execute handler, progress if the feed advanced: the want changes
+        # once a packet is appended (or buffered) or a blob is added, not for
+        # invalid or duplicate frames
+        before = self.feed_manager.get_want(fid)
+        fn(fid, msg)
+        if self.feed_manager.get_want(fid) != before:
+            self.want_scheduler.record_progress(fid)
+
+        # maybe new packet contains update feed -> start version manager
+        if is_pkt and not self.version_manager.is_configured():
+            self._start_version_manager()
 
-                # register action in visualizer
-                if self.viz:
-                    self.viz.register_rx(fid)
+        # prepend wants of next packets/blob of feed (greedy), in order
+        wants = self._next_wants(fid)
+        if wants:
+            for want in reversed(wants):
+                self.tx.push_front(want)
+            self.want_scheduler.record_sent(fid)
 
-                # execute handler
-                # FIXME: can/should this be done in a new thread?
-                fn(fid, bytearray(msg))
+    def _next_wants(self, fid: bytearray, restart: bool = False) -> List[bytearray]:
+        """
+        Returns the wants for the next packets (WANT_WINDOW at once) or blob
+        of the given feed, or an empty list if they are requested already.
+        The next window is requested once half of the current one arrived,
+        so packets keep flowing. If the window did not arrive within
+        WANT_WINDOW_MS (or restart=True), it is requested again from the
+        front of the feed.
+        A window is requested with a plain want of its first packet, which
+        nodes without range wants answer as well, followed by the range want.
+        """
+        want = self.feed_manager.get_want(fid, WANT_WINDOW)
+        if len(want) != 44:
+            return [want]
+
+        seq = int.from_bytes(want[39:43], "big")
+        b_fid = bytes(fid)
+        now = ticks_ms()
+        with self.window_lock:
+            window = self.windows.get(b_fid)
+            if (
+                not restart
+                and window is not None
+                and seq <= window[0]
+                and ticks_diff(now, window[1]) < WANT_WINDOW_MS
+            ):
+                if seq <= window[0] - WANT_WINDOW // 2:
+                    return []  # in flight
+                # more than half arrived -> request the next window
+                seq = window[0] + 1
+                want[39:43] = seq.to_bytes(4, "big")
+            self.windows[b_fid] = (seq + WANT_WINDOW - 1, now)
+        return [want[:43], want]
+
+    def _reorder(self, msg: bytes) -> None:
+        """
+        Keeps the given unknown frame while a window of packets is requested
+        (see _next_wants), it may be a packet that arrived before the
+        packets it follows. Only the dmx value of a packet is on the wire,
+        not its feed ID and sequence number, so duplicates are recognized by
+        their dmx value (derived from these). Frames are kept for
+        WANT_WINDOW_MS and REORDER_SIZE frames at most, the oldest one is
+        dropped first.
+        """
+        now = ticks_ms()
+        with self.window_lock:
+            for b_fid in list(self.windows.keys()):
+                if ticks_diff(now, self.windows[b_fid][1]) >= WANT_WINDOW_MS:
+                    del self.windows[b_fid]
+            if not self.windows:
+                return
 
-                # prepend want to next packet/blob of feed (greedy)
-                with self.queue_lock:
-                    self.queue.insert(0, get_want(get_feed(fid)))
+        dmx = bytes(msg[8:15])
+        with self.reorder_lock:
+            self._expire_reorder(now)
+            for kept in self.reorder:
+                if kept[0] == dmx:
                     return
-        else:
-            print("received invalid packet")
+            self.reorder.append((dmx, msg, now))
+            if len(self.reorder) > REORDER_SIZE:
+                self.reorder.pop(0)
+
+    def _expire_reorder(self, now: int) -> None:
+        # called with the reorder lock held, oldest first
+        while self.reorder and ticks_diff(now, self.reorder[0][2]) >= WANT_WINDOW_MS:
+            self.reorder.pop(0)
+
+    def _drain_reorder(self) -> None:
+        """
+        Handles the kept frames whose dmx values became known, i.e. packets
+        whose predecessors were appended in the meantime.
+        """
+        while True:
+            item = None
+            with self.reorder_lock:
+                self._expire_reorder(ticks_ms())
+                for i in range(len(self.reorder)):
+                    tpl = self.feed_manager.consult_dmx(self.reorder[i][0])
+                    if tpl:
+                        item = tpl + (self.reorder.pop(i)[1],)
+                        break
+            if item is None:
+                return
+            fn, fid, msg = item
+            del item
+            self._dispatch(fn, fid, True, bytearray(msg))
+
+    def _handle_packet(self, msg: bytes) -> None:
+        """
+        Used for handling incoming messages in place (pycom).
+        """
+        tpl = self._classify(msg)
+        if tpl:
+            fn, fid, is_pkt = tpl
+            self._dispatch(fn, fid, is_pkt, bytearray(msg))
+            if is_pkt:
+                self._drain_reorder()
 
     def _send(self, sock: socket) -> None:
         """
-        Removes the first item of the queue and sends it via UDP.
+        Removes the first item of the queue and sends it via UDP, as soon as
+        the TX scheduler allows it (blocks while the queue is empty).
+        With self.batch_frames > 1, up to that many queued items are sent in
+        a single datagram once every peer unpacks batches (see _batch_size),
+        and this is announced every PEER_HELLO_MS.
         Not used on pycom devices.
         """
         while True:
-            msg = None
-            with self.queue_lock:
-                # check if queue is empty
-                if self.queue:
-                    msg = self.queue.pop(0)
+            msgs = self.tx.get_many(self._batch_size())
 
-            if msg is None:
-                continue
+            if self.batch_frames > 1 and (
+                self.hello_sent is None
+                or ticks_diff(ticks_ms(), self.hello_sent) >= PEER_HELLO_MS
+            ):
+                try:
+                    sock.sendto(self.this + pack_frames([]), self.group)
+                except:
+                    print("error send: announcement")
+                self.hello_sent = ticks_ms()
 
             # register action in visualizer
             if self.viz:
-                # check which feed the dmx value belongs to (want)
-                tpl = self.feed_manager.consult_dmx(msg[:7])
-                if tpl:
-                    _, fid = tpl
-                    self.viz.register_tx(fid)
-                else:
-                    # check which feed the dmx value belongs to (packet/blob)
-                    tpl = self.feed_manager.consult_dmx(msg[8:15])
-                    if tpl:
-                        _, fid = tpl
-                        self.viz.register_tx(fid)
+                for msg in msgs:
+                    self._register_tx(msg)
 
-            # now actually send message
+            # now actually send message(s)
             try:
-                sock.sendto(self.this + bytes(msg), self.group)
+                sock.sendto(self.this + pack_frames(msgs), self.group)
             except:
-                print("error send: ", type(msg), " ", msg)
-            sleep(0.4)
+                print("error send: ", len(msgs), " frames")
+            del msgs
+
+    def _register_tx(self, msg: bytearray) -> None:
+        """
+        Registers an outgoing message in the visualizer.
+        """
+        # check which feed the dmx value belongs to (want)
+        tpl = self.feed_manager.consult_dmx(msg[:7])
+        if tpl:
+            _, fid = tpl
+            self.viz.register_tx(fid)
+        else:
+            # check which feed the dmx value belongs to (packet/blob)
+            tpl = self.feed_manager.consult_dmx(msg[8:15])
+            if tpl:
+                _, fid = tpl
+                self.viz.register_tx(fid)
 
     def _lora_loop(self, sock: socket) -> None:
         """
         Lora RX/TX loop. Only run on pycom devices.
         Unlike with UDP, sending and receiving is handled in a single loop.
+        The next message is sent once it fits into the airtime budget of the
+        TX scheduler, the loop only pauses if there was nothing to do.
         """
         sock.setblocking(False)
         while True:
-            msg = None
-
-            # get next message
-            with self.queue_lock:
-                if self.queue:
-                    msg = self.queue.pop(0)
-
-            # send message
-            if msg:
+            # send next message (if the airtime budget allows it)
+            msg = self.tx.poll()
+            sent = msg is not None
+            if sent:
                 try:
                     sock.send(bytes(msg))
                 except Exception:
                     print("failed to send")
 
-            # FIXME: remove this sleep
-            sleep(0.5)
-
             # check for incoming messages
             msg = sock.recv(128)
             if len(msg) == 0:
+                if not sent:
+                    sleep(LORA_POLL_INTERVAL)
                 continue
 
             # DEBUG
@@ -301,17 +703,27 @@ class Node:
     def _fill_wants(self) -> None:
         """
         Periodically checks if the queue is empty.
-        If so, it is filled with wants for every locally saved feed
-        (for which no key is found -> consumer).
+        If so, it is filled with wants for the locally saved feeds (for which
+        no key is found -> consumer) that are due according to the want
+        scheduler, requesting their windows again from the front.
+        Also flushes batches of received packets that stopped growing.
         """
         while True:
-            with self.queue_lock:
-                if not self.queue:
-                    for fid in self.feed_manager.listfids():
-                        if bytes(fid) not in self.feed_manager.keys:
-                            want = get_want(get_feed(fid))
-                            if want:
-                                self.queue.append(want)
+            self.feed_manager.flush_pending()
+            if self.tx.is_empty():
+                keys = self.feed_manager.keys
+                fids = [
+                    fid
+                    for fid in self.feed_manager.listfids()
+                    if bytes(fid) not in keys
+                ]
+                wants = []
+                for fid in self.want_scheduler.due(fids):
+                    next_wants = self._next_wants(fid, restart=True)
+                    if next_wants:
+                        wants.extend(next_wants)
+                        self.want_scheduler.record_sent(fid)
+                self.tx.fill(wants)
             sleep(0.5)
 
     def io(self) -> None:
@@ -354,6 +766,7 @@ class Node:
                 mreq = bytes([int(i) for i in "224.1.1.1".split(".")]) + bytes(4)
                 rx.setsockopt(0, 12, mreq)
             start_new_thread(self._fill_wants, ())
+            start_new_thread(self._process_rx, ())
 
             if self.http:
                 # http server at address localhost:8000
@@ -1,7 +1,7 @@
 from .util import PYCOM, to_var_int
 from math import ceil
 from micropython import const
-from pure25519 import VerifyingKey, SigningKey
+from pure25519 import VerifyingKey, SigningKey, verify_batch
 from sys import byteorder, implementation
 from uctypes import (
     ARRAY,
@@ -18,7 +18,7 @@ from uhashlib import sha256
 
 # helps with debugging in vim
 if implementation.name != "micropython":
-    from typing import Optional, Tuple, List
+    from typing import Optional, Tuple, List, Union
 
 
 # packet types
@@ -39,6 +39,10 @@ PKTFORK = const(0x11)
 PKT_PREFIX = bytearray(b"tiny-v02")
 
 
+# max. number of decoded verifying keys kept in memory
+VK_CACHE_SIZE = const(32)
+
+
 # struct definitions
 WIRE_PACKET = {
     "reserved": (0 | ARRAY, 8 | UINT8),
@@ -65,6 +69,53 @@ BLOB = {
 }
 
 
+class VerifyingKeyCache:
+    """
+    Bounded LRU cache mapping feed IDs to VerifyingKey instances.
+    A cached key keeps its decoded and subgroup-checked public key element,
+    so only the first verified packet of a feed pays for decoding it.
+    """
+
+    __slots__ = (
+        "_keys",
+        "_order",
+        "hits",
+        "misses",
+        "size",
+    )
+
+    def __init__(self, size: int) -> None:
+        self.size = size
+        self._keys = {}
+        self._order = []  # least recently used first
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, fid: bytearray) -> VerifyingKey:
+        """
+        Returns the verifying key of the given feed ID.
+        """
+        b_fid = bytes(fid)
+        if b_fid in self._keys:
+            self.hits += 1
+            if self._order[-1] != b_fid:
+                self._order.remove(b_fid)
+                self._order.append(b_fid)
+            return self._keys[b_fid]
+
+        self.misses += 1
+        vkey = VerifyingKey(b_fid)
+        self._keys[b_fid] = vkey
+        self._order.append(b_fid)
+        if len(self._order) > self.size:
+            del self._keys[self._order.pop(0)]
+        return vkey
+
+
+# shared by every received packet
+vk_cache = VerifyingKeyCache(VK_CACHE_SIZE)
+
+
 # struct methods
 def new_packet(
     fid: bytearray,
@@ -72,19 +123,27 @@ def new_packet(
     prev_mid: bytearray,
     payload: bytearray,
     pkt_type: bytearray,
-    key: bytearray,
+    key: Union[bytearray, SigningKey],
 ) -> struct[PACKET]:
     """
     Creates an instance of the PACKET struct for the given data.
     The packet consists of a WIRE_PACKET (pointer) and the 'virtual' information.
-    It is signed using pure25519 with the given key.
+    It is signed using pure25519 with the given key. The key is either the
+    32B seed or a prepared SigningKey (see FeedManager.keys), which saves
+    hashing the seed for every packet.
     """
     assert len(fid) == 32
     assert len(seq) == 4
     assert len(prev_mid) == 20
     assert len(payload) == 48
     assert len(pkt_type) == 1
-    assert len(key) == 32
+    if isinstance(key, SigningKey):
+        assert key.vk_s == bytes(fid)
+        skey = key
+    else:
+        assert len(key) == 32
+        # the feed ID is the public key -> no need to derive it from the seed
+        skey = SigningKey(bytes(key) + bytes(fid))
 
     # create wire packet
     wpkt = struct(addressof(bytearray(sizeof(WIRE_PACKET))), WIRE_PACKET, BIG_ENDIAN)
@@ -117,7 +176,6 @@ def new_packet(
     full_array[72:120] = payload
 
     # calculate full packet
-    skey = SigningKey(bytes(key))
     full_array[120:] = skey.sign(bytes(full_array[:120]))
     wpkt.signature[:] = full_array[120:]
 
@@ -126,15 +184,12 @@ def new_packet(
     return pkt
 
 
-def pkt_from_wire(
+def _expand_wire(
     fid: bytearray, seq: bytearray, prev_mid: bytearray, pkt_wire: bytearray
-) -> Optional[struct[PACKET]]:
+) -> Tuple[struct[PACKET], bytearray]:
     """
-    Constructs a PACKET struct from the given wire packet (as bytearray).
-    The signature of this packet is checked. If it cannot be confirmed,
-    None is returned.
-    The check is currently skipped on pycom devices, since the pure25519
-    library is not optimized and leads to stack overflows on these devices.
+    Constructs a PACKET struct (without message ID) from the given wire packet.
+    Also returns the full 184B packet name, including the signature.
     """
     assert len(fid) == 32
     assert len(seq) == 4
@@ -163,27 +218,92 @@ def pkt_from_wire(
     full_array[64:71] = wpkt.dmx
     full_array[71:72] = wpkt.type
     full_array[72:120] = wpkt.payload
+    full_array[120:] = wpkt.signature
+    return pkt, full_array
+
+
+def pkt_from_wire(
+    fid: bytearray,
+    seq: bytearray,
+    prev_mid: bytearray,
+    pkt_wire: bytearray,
+    verify: bool = True,
+) -> Optional[struct[PACKET]]:
+    """
+    Constructs a PACKET struct from the given wire packet (as bytearray).
+    The signature of this packet is checked. If it cannot be confirmed,
+    None is returned. The check can be skipped with verify=False, e.g. for
+    computing the message ID of a packet that is verified later on.
+    The check is currently skipped on pycom devices, since the pure25519
+    library is not optimized and leads to stack overflows on these devices.
+    """
+    pkt, full_array = _expand_wire(fid, seq, prev_mid, pkt_wire)
 
     # verify signature
-    if not PYCOM:
+    if verify and not PYCOM:
         # do not verify on pycom devices -> stack overflow (pure25519 is not optimized)
-        vkey = VerifyingKey(bytes(fid))
+        vkey = vk_cache.get(fid)
         try:
-            vkey.verify(bytes(wpkt.signature), bytes(full_array[:120]))
+            vkey.verify(bytes(full_array[120:]), bytes(full_array[:120]))
         except Exception as e:
             print(e)
             return None
 
-    # verified packet, fill in signature
-    full_array[120:] = wpkt.signature
-
     # calculate mid
     bytearray_at(addressof(pkt) + 68, 20)[:] = sha256(full_array).digest()[:20]
     return pkt
 
 
+def pkts_from_wires(
+    fid: bytearray, seq: bytearray, prev_mid: bytearray, wires: List[bytearray]
+) -> List[struct[PACKET]]:
+    """
+    Constructs PACKET structs from consecutive wire packets of the same feed,
+    the first one having the given sequence number and previous message ID.
+    All signatures are checked together in a single batch verification.
+    If the batch fails, the packets are checked one by one and only the
+    packets in front of the first invalid one are returned.
+    """
+    pkts = []
+    batch = []
+    vkey = vk_cache.get(fid)
+    int_seq = int.from_bytes(seq, "big")
+
+    for wire in wires:
+        pkt, full_array = _expand_wire(
+            fid, int_seq.to_bytes(4, "big"), prev_mid, wire
+        )
+        bytearray_at(addressof(pkt) + 68, 20)[:] = sha256(full_array).digest()[:20]
+        batch.append((vkey, bytes(full_array[:120]), bytes(full_array[120:])))
+        pkts.append(pkt)
+        prev_mid = pkt.mid
+        int_seq += 1
+        del full_array
+
+    if PYCOM:
+        # no verification on pycom devices, see pkt_from_wire
+        return pkts
+
+    try:
+        verify_batch(batch)
+        return pkts
+    except Exception:
+        pass
+
+    # find the invalid packet
+    for i in range(len(batch)):
+        _, msg, sig = batch[i]
+        try:
+            vkey.verify(sig, msg)
+        except Exception as e:
+            print(e)
+            return pkts[:i]
+
+    return pkts
+
+
 def create_genesis_pkt(
-    fid: bytearray, payload: bytearray, skey: bytearray
+    fid: bytearray, payload: bytearray, skey: Union[bytearray, SigningKey]
 ) -> struct[PACKET]:
     """
     Creates an instance of a genesis packet.
@@ -199,7 +319,7 @@ def create_parent_pkt(
     seq: bytearray,
     prev_mid: bytearray,
     child_fid: bytearray,
-    skey: bytearray,
+    skey: Union[bytearray, SigningKey],
 ) -> struct[PACKET]:
     """
     Creates an instance of a parent packet (type MKCHILD).
@@ -212,7 +332,7 @@ def create_parent_pkt(
 
 
 def create_child_pkt(
-    fid: bytearray, payload: bytearray, skey: bytearray
+    fid: bytearray, payload: bytearray, skey: Union[bytearray, SigningKey]
 ) -> struct[PACKET]:
     """
     Creates an instance of a child packet (type ISCHILD).
@@ -229,7 +349,7 @@ def create_end_pkt(
     seq: bytearray,
     prev_mid: bytearray,
     contn_fid: bytearray,
-    skey: bytearray,
+    skey: Union[bytearray, SigningKey],
 ) -> struct[PACKET]:
     """
     Creates an instance of an "end" packet (type CONTDAS).
@@ -242,7 +362,7 @@ def create_end_pkt(
 
 
 def create_contn_pkt(
-    fid: bytearray, payload: bytearray, skey: bytearray
+    fid: bytearray, payload: bytearray, skey: Union[bytearray, SigningKey]
 ) -> struct[PACKET]:
     """
     Creates an instance of a continuation packet (type ISCONTN).
@@ -260,7 +380,7 @@ def create_upd_pkt(
     prev_mid: bytearray,
     file_name: bytearray,
     v_number: bytearray,
-    key: bytearray,
+    key: Union[bytearray, SigningKey],
 ) -> struct[PACKET]:
     """
     Creates an instance of an update packet (type UPDFILE).
@@ -289,7 +409,7 @@ def create_apply_pkt(
     prev_mid: bytearray,
     file_fid: bytearray,
     update_seq: bytearray,
-    key: bytearray,
+    key: Union[bytearray, SigningKey],
 ) -> struct[PACKET]:
     """
     Creates an instance of an apply packet (type APPLYUP).
@@ -311,7 +431,7 @@ def create_chain(
     seq: bytearray,
     prev_mid: bytearray,
     content: bytearray,
-    key: bytearray,
+    key: Union[bytearray, SigningKey],
 ) -> Tuple[struct[PACKET], List[struct[BLOB]]]:
     """
     Creates a blob chain containing the given payload (no size limit).
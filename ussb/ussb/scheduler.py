@@ -0,0 +1,358 @@
+from _thread import allocate_lock
+from sys import implementation
+from time import sleep
+
+try:
+    from heapq import heappop, heappush
+except ImportError:
+    from uheapq import heappop, heappush
+
+try:
+    from time import ticks_add, ticks_ms, ticks_diff
+except ImportError:
+    # regular python
+    from time import time
+
+    ticks_ms = lambda: int(time() * 1000)
+    ticks_add = lambda ticks, delta: ticks + delta
+    ticks_diff = lambda end, start: end - start
+
+
+# helps with debugging in vim
+if implementation.name != "micropython":
+    from typing import Callable, List, Optional, Tuple
+
+
+# UDP: frames per second and burst size (frames)
+UDP_TX_RATE = 20
+UDP_TX_BURST = 8
+
+# LoRa: airtime per second and burst size (ms of airtime)
+LORA_AIRTIME_RATE = 400
+LORA_AIRTIME_BURST = 1000
+
+# LoRa modulation used for the airtime estimate (as configured in main.py)
+LORA_SF = 7
+LORA_BW = 250  # kHz
+LORA_CR = 1  # coding rate 4/5
+LORA_PREAMBLE = 8
+
+
+def lora_airtime(msg: bytearray) -> float:
+    """
+    Returns the estimated airtime (in ms) of sending the given message
+    via LoRa (explicit header, CRC, no low data rate optimization).
+    """
+    t_sym = (1 << LORA_SF) / LORA_BW
+    bits = 8 * len(msg) - 4 * LORA_SF + 28 + 16
+    symbols = 8 + max(-(-bits // (4 * LORA_SF)) * (LORA_CR + 4), 0)
+    return (LORA_PREAMBLE + 4.25 + symbols) * t_sym
+
+
+def tx_key(msg: bytearray) -> bytes:
+    """
+    Returns the identity of an outgoing message: the want dmx and the
+    requested sequence number (and blob pointer) of a want, the whole frame
+    of a packet or blob.
+    """
+    if len(msg) < 128:
+        return bytes(msg[:7]) + bytes(msg[39:])
+    return bytes(msg)
+
+
+class TxScheduler:
+    """
+    Priority queue of outgoing messages, paced by a token bucket.
+    Messages pushed to the front are sent first (newest first), the others
+    in order of arrival. A message that is already queued (same tx_key) is
+    not added again, but raised: pushing it to the front moves it there,
+    pushing it to the back moves it ahead of the messages pushed to the
+    back (it was asked for again). Both count as duplicates.
+    The queue is a heap of (priority, key) plus an index {key: (priority,
+    message)}: priorities below 0 are pushed to the front, 0 is raised from
+    the back and above 0 is pushed to the back. Entries of raised messages
+    stay in the heap until popped.
+    Sending a message costs cost(msg) tokens (1 per frame by default, e.g.
+    the airtime with lora_airtime), and rate tokens are added per second,
+    up to burst.
+    The sender blocks in get while the queue is empty (on a lock that is
+    only held while the queue is empty) and sleeps until the bucket allows
+    the next message, instead of polling. Loops that must not block (LoRa)
+    use poll instead.
+    Achieved frames per second are reported by stats.
+    """
+
+    __slots__ = (
+        "_burst",
+        "_back",
+        "_cost",
+        "_front",
+        "_heap",
+        "_index",
+        "_lock",
+        "_rate",
+        "_refilled",
+        "_tokens",
+        "_wake",
+        "_window_sent",
+        "_window_start",
+        "duplicates",
+        "sent",
+    )
+
+    def __init__(
+        self,
+        rate: float,
+        burst: float,
+        cost: Optional[Callable[[bytearray], float]] = None,
+    ) -> None:
+        self._rate = rate
+        self._burst = burst
+        self._cost = cost
+        self._tokens = burst
+        self._refilled = ticks_ms()
+        self._heap = []  # [(priority, key)], lowest first
+        self._index = {}  # {key: (priority, message)}
+        self._front = 0  # priority of the last message pushed to the front
+        self._back = 0  # priority of the last message pushed to the back
+        self._lock = allocate_lock()
+        self._wake = allocate_lock()  # held while the queue is empty
+        self._wake.acquire()
+        self.duplicates = 0
+        self.sent = 0
+        self._window_start = ticks_ms()
+        self._window_sent = 0
+
+    def push(self, msg: bytearray) -> None:
+        """
+        Appends the given message to the queue. If it is queued already, it
+        is moved ahead of the other messages pushed to the back.
+        """
+        with self._lock:
+            self._push(msg, False)
+
+    def push_front(self, msg: bytearray) -> None:
+        """
+        Inserts the given message at the first position of the queue
+        (moves it there if it is queued already).
+        """
+        with self._lock:
+            self._push(msg, True)
+
+    def fill(self, msgs: List[bytearray]) -> bool:
+        """
+        Appends the given messages if the queue is empty.
+        Returns False if it was not empty.
+        """
+        with self._lock:
+            if self._index:
+                return False
+            for msg in msgs:
+                self._push(msg, False)
+        return True
+
+    def _push(self, msg: bytearray, front: bool) -> None:
+        # called with the lock held
+        key = tx_key(msg)
+        entry = self._index.get(key)
+        queued = entry is not None
+        if queued:
+            self.duplicates += 1
+        if front:
+            self._front -= 1
+            priority = self._front
+        elif queued:
+            if entry[0] <= 0:
+                return  # at the front or raised already
+            priority = 0
+        else:
+            self._back += 1
+            priority = self._back
+        heappush(self._heap, (priority, key))
+        self._index[key] = (priority, msg)
+        if not queued and len(self._index) == 1:
+            self._wake.release()
+
+    def _first(self) -> bytes:
+        # called with the lock held, the queue is not empty
+        # drops heap entries of messages that were raised (or sent) since
+        while True:
+            priority, key = self._heap[0]
+            entry = self._index.get(key)
+            if entry is not None and entry[0] == priority:
+                return key
+            heappop(self._heap)
+
+    def is_empty(self) -> bool:
+        with self._lock:
+            return not self._index
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._index)
+
+    def get(self) -> bytearray:
+        """
+        Removes and returns the first message of the queue, blocking until
+        there is one and the token bucket allows sending it.
+        Only meant for a single sending thread.
+        """
+        while True:
+            # wait until the queue is not empty
+            self._wake.acquire()
+            self._wake.release()
+
+            with self._lock:
+                wait = self._wait()
+                if wait <= 0:
+                    return self._take()
+            sleep(wait)
+
+    def get_many(self, n: int) -> List[bytearray]:
+        """
+        Same as get, but also removes up to n - 1 further messages if the
+        token bucket allows sending them right away (for batched sending).
+        """
+        msgs = [self.get()]
+        with self._lock:
+            while len(msgs) < n and self._index and self._wait() <= 0:
+                msgs.append(self._take())
+        return msgs
+
+    def poll(self) -> Optional[bytearray]:
+        """
+        Removes and returns the first message of the queue if the token
+        bucket allows sending it, otherwise returns None (never blocks).
+        """
+        with self._lock:
+            if not self._index or self._wait() > 0:
+                return None
+            return self._take()
+
+    def _wait(self) -> float:
+        # called with the lock held, seconds until the first message may be sent
+        now = ticks_ms()
+        elapsed = ticks_diff(now, self._refilled)
+        self._tokens = min(self._burst, self._tokens + self._rate * elapsed / 1000)
+        self._refilled = now
+        cost = 1
+        if self._cost is not None:
+            cost = self._cost(self._index[self._first()][1])
+        return (min(cost, self._burst) - self._tokens) / self._rate
+
+    def _take(self) -> bytearray:
+        # called with the lock held, the queue is not empty
+        key = self._first()
+        heappop(self._heap)
+        msg = self._index.pop(key)[1]
+        self._tokens -= 1 if self._cost is None else self._cost(msg)
+        if not self._index:
+            self._heap = []
+            self._wake.acquire(0)
+        self.sent += 1
+        self._window_sent += 1
+        return msg
+
+    def stats(self) -> Tuple[int, int, int, float]:
+        """
+        Returns the length of the queue, the number of sent messages, the
+        number of duplicates that were not queued again and the achieved
+        frames per second since the previous call.
+        """
+        with self._lock:
+            now = ticks_ms()
+            elapsed = ticks_diff(now, self._window_start)
+            fps = 1000 * self._window_sent / elapsed if elapsed > 0 else 0.0
+            self._window_start = now
+            self._window_sent = 0
+            return len(self._index), self.sent, self.duplicates, fps
+
+
+# interval between wants of a feed without progress: starts at WANT_MIN_MS,
+# doubles after every unanswered want, up to WANT_MAX_MS
+WANT_MIN_MS = 500
+WANT_MAX_MS = 60000
+
+
+class WantScheduler:
+    """
+    Decides which feeds are asked for new packets (periodic wants).
+    Tracks the time of the next want and the current backoff per feed:
+    every want sent doubles the backoff (up to WANT_MAX_MS), progress of
+    the feed or a hint that a peer has newer packets resets it, so the
+    feed is asked again immediately. Idle feeds are thus asked rarely.
+    Counts the wants sent and the useful responses (progress after a want).
+    """
+
+    __slots__ = (
+        "_feeds",
+        "_lock",
+        "sent",
+        "useful",
+    )
+
+    def __init__(self) -> None:
+        self._feeds = {}  # {fid: [ticks of next want, backoff, waiting]}
+        self._lock = allocate_lock()
+        self.sent = 0
+        self.useful = 0
+
+    def due(self, fids: List[bytearray]) -> List[bytearray]:
+        """
+        Returns the given feed IDs whose next want is due (feeds that were
+        never asked before are due immediately).
+        """
+        now = ticks_ms()
+        with self._lock:
+            return [
+                fid
+                for fid in fids
+                if bytes(fid) not in self._feeds
+                or ticks_diff(now, self._feeds[bytes(fid)][0]) >= 0
+            ]
+
+    def record_sent(self, fid: bytearray) -> None:
+        """
+        Records a want sent for the given feed and schedules the next one.
+        """
+        b_fid = bytes(fid)
+        with self._lock:
+            state = self._feeds.get(b_fid)
+            if state is None:
+                state = self._feeds[b_fid] = [0, WANT_MIN_MS, False]
+            state[0] = ticks_add(ticks_ms(), state[1])
+            state[1] = min(2 * state[1], WANT_MAX_MS)
+            state[2] = True
+            self.sent += 1
+
+    def record_progress(self, fid: bytearray) -> None:
+        """
+        Records that the given feed advanced (packet or blob appended).
+        """
+        self._reset(fid, True)
+
+    def reset(self, fid: bytearray) -> None:
+        """
+        Makes the want of the given feed due immediately, e.g. because a
+        peer revealed that it has newer packets.
+        """
+        self._reset(fid, False)
+
+    def _reset(self, fid: bytearray, progress: bool) -> None:
+        b_fid = bytes(fid)
+        with self._lock:
+            state = self._feeds.get(b_fid)
+            if state is None:
+                return  # due anyway
+            if progress and state[2]:
+                self.useful += 1
+            state[0] = ticks_ms()
+            state[1] = WANT_MIN_MS
+            state[2] = False
+
+    def stats(self) -> Tuple[int, int, int]:
+        """
+        Returns the number of tracked feeds, wants sent and useful responses.
+        """
+        with self._lock:
+            return len(self._feeds), self.sent, self.useful
@@ -0,0 +1,638 @@
+from .util import PYCOM, listdir, sync_file
+from _thread import allocate_lock
+from sys import implementation
+from ubinascii import hexlify, unhexlify
+from uos import remove, rename, stat
+
+
+# helps with debugging in vim
+if implementation.name != "micropython":
+    from typing import Callable, List, Optional, Union
+
+
+FEEDS_DIR = "_feeds"
+
+# storage backend used if the FeedManager is not given one (see open_store),
+# the single-file backend ("packed") is opt-in (see default_backend)
+FEED_BACKEND = "file"
+
+# number of .log files kept open for reading (pycom: few file descriptors)
+LOG_POOL_SIZE = 2 if PYCOM else 8
+
+# bytes copied at once when rewriting a file
+COPY_CHUNK = 1024 if PYCOM else 8192
+
+
+class LogHandlePool:
+    """
+    Bounded LRU pool of .log files that are kept open for reading, keyed by
+    feed ID. Scanning a feed then costs a seek and a read per packet instead
+    of opening and closing the file every time.
+    Every read seeks first, and appending to a feed drops its handle (the
+    size of a file opened earlier may be cached by the file system).
+    A size of 0 disables the pool.
+    """
+
+    __slots__ = (
+        "_files",
+        "_lock",
+        "_log_fn",
+        "_order",
+        "hits",
+        "misses",
+        "size",
+    )
+
+    def __init__(self, size: int, log_fn: Callable[[bytes], str]) -> None:
+        self.size = size
+        self._log_fn = log_fn
+        self._files = {}
+        self._order = []  # least recently used first
+        self._lock = allocate_lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _get(self, b_fid: bytes):
+        # returns the open handle of the given feed, called with the lock held
+        if b_fid in self._files:
+            self.hits += 1
+            if self._order[-1] != b_fid:
+                self._order.remove(b_fid)
+                self._order.append(b_fid)
+            return self._files[b_fid]
+
+        self.misses += 1
+        f = open(self._log_fn(b_fid), "rb")
+        self._files[b_fid] = f
+        self._order.append(b_fid)
+        while len(self._order) > self.size:
+            self._drop(self._order.pop(0))
+        return f
+
+    def _drop(self, b_fid: bytes) -> None:
+        # called with the lock held
+        self._files.pop(b_fid).close()
+
+    def read(self, fid: bytearray, offset: int, buf: bytearray) -> None:
+        """
+        Fills buf with the content of the .log file of the given feed,
+        starting at the given offset.
+        """
+        if self.size <= 0:
+            f = open(self._log_fn(fid), "rb")
+            f.seek(offset)
+            f.readinto(buf)
+            f.close()
+            return
+
+        with self._lock:
+            f = self._get(bytes(fid))
+
+            # shared handle -> seek and read under the lock
+            f.seek(offset)
+            f.readinto(buf)
+
+    def invalidate(self, fid: bytearray) -> None:
+        """
+        Closes the handle of the given feed, if it is open.
+        """
+        b_fid = bytes(fid)
+        with self._lock:
+            if b_fid in self._files:
+                self._order.remove(b_fid)
+                self._drop(b_fid)
+
+    def resize(self, size: int) -> None:
+        """
+        Changes the maximum number of open handles, closing surplus ones.
+        """
+        with self._lock:
+            self.size = size
+            while len(self._order) > max(size, 0):
+                self._drop(self._order.pop(0))
+
+    def close_all(self) -> None:
+        """
+        Closes every open handle.
+        """
+        with self._lock:
+            for f in self._files.values():
+                f.close()
+            self._files = {}
+            self._order = []
+
+
+class FileStore:
+    """
+    Storage backend with separate files per feed in the given directory:
+    the FEED header (.head), the wire packets (.log) and the packet types
+    (.idx, see feed.get_types). Reads of .log files go through a
+    LogHandlePool. The directory is listed once, the feed IDs are kept.
+    Every backend offers the same methods (see PackedStore), offsets and
+    sizes of a log are in bytes, starting at the first packet after the
+    anchor. Missing headers raise OSError.
+    """
+
+    __slots__ = (
+        "_fid_set",
+        "_fids",
+        "_lock",
+        "pool",
+        "root",
+    )
+
+    def __init__(self, root: str = FEEDS_DIR, pool_size: int = LOG_POOL_SIZE) -> None:
+        self.root = root
+        self.pool = LogHandlePool(pool_size, lambda fid: self._fn(fid, "log"))
+        self._fids = None  # listed on first use
+        self._fid_set = set()
+        self._lock = allocate_lock()
+
+    def _fn(self, fid: bytearray, ext: str) -> str:
+        return "{}/{}.{}".format(self.root, hexlify(fid).decode(), ext)
+
+    def fids(self) -> List[bytearray]:
+        with self._lock:
+            if self._fids is None:
+                self._fids = [
+                    unhexlify(fn[:-5].encode())
+                    for fn in listdir(self.root)
+                    if fn.endswith(".head")
+                ]
+                self._fid_set = set(self._fids)
+            return [bytearray(fid) for fid in self._fids]
+
+    def read_header(self, fid: bytearray) -> bytearray:
+        header = bytearray(128)
+        f = open(self._fn(fid, "head"), "rb")
+        f.readinto(header)
+        f.close()
+        return header
+
+    def write_header(self, fid: bytearray, header: bytearray) -> None:
+        f = open(self._fn(fid, "head"), "wb")
+        f.write(header)
+        f.close()
+        b_fid = bytes(fid)
+        with self._lock:
+            if self._fids is not None and b_fid not in self._fid_set:
+                self._fids.append(b_fid)
+                self._fid_set.add(b_fid)
+
+    def log_size(self, fid: bytearray) -> int:
+        try:
+            return stat(self._fn(fid, "log"))[6]
+        except OSError:
+            return 0
+
+    def read_log(self, fid: bytearray, offset: int, buf: bytearray) -> None:
+        self.pool.read(fid, offset, buf)
+
+    def append_log(self, fid: bytearray, data: bytearray) -> None:
+        # pooled read handle would miss the new packets
+        self.pool.invalidate(fid)
+        f = open(self._fn(fid, "log"), "ab")
+        f.write(data)
+        f.close()
+
+    def write_log(self, fid: bytearray, offset: int, data: bytearray) -> None:
+        self.pool.invalidate(fid)
+        size = self.log_size(fid)
+        f = open(self._fn(fid, "log"), "r+b" if size else "wb")
+        f.seek(offset)
+        f.write(data)
+        f.close()
+
+    def cut_log(self, fid: bytearray, start: int, end: int) -> None:
+        """
+        Only keeps the bytes [start:end) of the log (copied to a new file).
+        """
+        self.pool.invalidate(fid)
+        log_fn = self._fn(fid, "log")
+        src = open(log_fn, "rb")
+        src.seek(start)
+        dst = open(log_fn + ".tmp", "wb")
+        left = end - start
+        while left > 0:
+            chunk = src.read(min(COPY_CHUNK, left))
+            if not chunk:
+                break
+            dst.write(chunk)
+            left -= len(chunk)
+        src.close()
+        dst.close()
+        remove(log_fn)
+        rename(log_fn + ".tmp", log_fn)
+
+    def read_types(self, fid: bytearray) -> Optional[bytearray]:
+        try:
+            f = open(self._fn(fid, "idx"), "rb")
+            types = bytearray(f.read())
+            f.close()
+            return types
+        except OSError:
+            return None
+
+    def types_size(self, fid: bytearray) -> int:
+        try:
+            return stat(self._fn(fid, "idx"))[6]
+        except OSError:
+            return 0
+
+    def write_types(self, fid: bytearray, types: bytearray) -> None:
+        f = open(self._fn(fid, "idx"), "wb")
+        f.write(types)
+        f.close()
+
+    def append_types(self, fid: bytearray, types: bytearray) -> None:
+        f = open(self._fn(fid, "idx"), "ab")
+        f.write(types)
+        f.close()
+
+    def drop_types(self, fid: bytearray) -> None:
+        try:
+            remove(self._fn(fid, "idx"))
+        except OSError:
+            pass
+
+    def sync(self, fid: bytearray) -> None:
+        for ext in ("log", "head"):
+            f = open(self._fn(fid, ext), "ab")
+            sync_file(f)
+            f.close()
+
+    def close(self) -> None:
+        self.pool.close_all()
+
+
+PACK_FN = "_feeds/feeds.pack"
+
+# the pack consists of extents of EXTENT_SLOTS 128B slots, the first slot of
+# an extent describes it: magic (4B), kind (1B), feed ID (32B), number of the
+# extent in the log (4B) and the number of pruned slots in front (2B)
+EXTENT_SLOTS = 32
+EXTENT_SIZE = 128 * EXTENT_SLOTS
+EXTENT_MAGIC = b"uxt1"
+KIND_FREE = 0
+KIND_HEADERS = 1  # every other slot holds a FEED header (or zeros)
+KIND_LOG = 2  # every other slot holds a wire packet of the feed (or zeros)
+
+
+class PackedStore:
+    """
+    Storage backend keeping all feeds in the single file PACK_FN, made of
+    preallocated extents of fixed 128B slots (see EXTENT_SLOTS).
+    The directory (feed ID -> header slot, log extents, log size) is built
+    once from the extent descriptors when the store is first used. The
+    packet types stay in the .idx files of the FileStore layout (one byte
+    per packet, appended with the packets).
+    Extents freed by pruning are reused. Feeds stored as files (FileStore)
+    are moved into the pack on first use.
+    Same methods as FileStore.
+    """
+
+    __slots__ = (
+        "_count",
+        "_extents",
+        "_f",
+        "_files",
+        "_free",
+        "_free_headers",
+        "_headers",
+        "_lock",
+        "_order",
+        "_size",
+        "_skip",
+        "loaded",
+    )
+
+    def __init__(self) -> None:
+        self._f = None
+        self._count = 0  # number of extents
+        self._free = []  # free extents
+        self._headers = {}  # {fid: offset of the header slot}
+        self._free_headers = []
+        self._order = []  # feed IDs in order of creation
+        self._extents = {}  # {fid: [extents of the log, in order]}
+        self._skip = {}  # {fid: pruned slots in the first extent}
+        self._size = {}  # {fid: log size in bytes}
+        self._files = FileStore(pool_size=0)  # .idx files, feeds to migrate
+        self._lock = allocate_lock()
+        self.loaded = False
+
+    def _load(self) -> None:
+        # called with the lock held
+        try:
+            size = stat(PACK_FN)[6]
+        except OSError:
+            size = 0
+        self._f = open(PACK_FN, "r+b" if size else "w+b")
+        self._count = size // EXTENT_SIZE
+
+        logs = {}  # {fid: [(number, extent, skip)]}
+        desc = bytearray(128)
+        for ext in range(self._count):
+            self._f.seek(ext * EXTENT_SIZE)
+            self._f.readinto(desc)
+            if desc[:4] != EXTENT_MAGIC or desc[4] == KIND_FREE:
+                self._free.append(ext)
+            elif desc[4] == KIND_HEADERS:
+                slots = self._f.read(EXTENT_SIZE - 128)
+                for i in range(EXTENT_SLOTS - 1):
+                    offset = ext * EXTENT_SIZE + 128 * (i + 1)
+                    b_fid = bytes(slots[128 * i + 12 : 128 * i + 44])
+                    if b_fid == bytes(32):
+                        self._free_headers.append(offset)
+                    else:
+                        self._headers[b_fid] = offset
+                        self._order.append(b_fid)
+            else:
+                number = int.from_bytes(desc[37:41], "big")
+                skip = int.from_bytes(desc[41:43], "big")
+                logs.setdefault(bytes(desc[5:37]), []).append((number, ext, skip))
+
+        for b_fid, parts in logs.items():
+            parts.sort()
+            self._extents[b_fid] = [ext for _, ext, _ in parts]
+            self._skip[b_fid] = parts[0][2]
+
+            # count the used slots of the last extent (unused ones are zeros)
+            self._f.seek(parts[-1][1] * EXTENT_SIZE + 128)
+            slots = self._f.read(EXTENT_SIZE - 128)
+            used = EXTENT_SLOTS - 1
+            while used > 0 and slots[128 * (used - 1) : 128 * used] == bytes(128):
+                used -= 1
+            n = (len(parts) - 1) * (EXTENT_SLOTS - 1) + used - self._skip[b_fid]
+            self._size[b_fid] = 128 * n
+
+        self.loaded = True
+        self._migrate()
+
+    def _migrate(self) -> None:
+        # moves feeds of the file-per-feed layout into the pack, the header
+        # last: a feed without header was interrupted and is copied again.
+        # The files are only removed once the pack is synced, the .idx files
+        # are kept (type index of both layouts)
+        files = self._files
+        fids = files.fids()
+        for fid in fids:
+            b_fid = bytes(fid)
+            if b_fid not in self._headers:
+                self._free_log(b_fid)
+                size = files.log_size(fid)
+                for offset in range(0, size, COPY_CHUNK):
+                    chunk = bytearray(min(COPY_CHUNK, size - offset))
+                    files.read_log(fid, offset, chunk)
+                    self._append(b_fid, chunk)
+                self._write_header(b_fid, files.read_header(fid))
+        if not fids:
+            return
+
+        sync_file(self._f)
+        for fid in fids:
+            for ext in ("head", "log"):
+                try:
+                    remove(files._fn(fid, ext))
+                except OSError:
+                    pass
+        # listed again on next use
+        self._files = FileStore(pool_size=0)
+
+    def _free_log(self, b_fid: bytes) -> None:
+        # frees all extents of the given log
+        for ext in self._extents.pop(b_fid, []):
+            self._describe(ext, KIND_FREE, bytes(32), 0, 0)
+            self._free.append(ext)
+        self._skip.pop(b_fid, None)
+        self._size.pop(b_fid, None)
+
+    def _ensure(self) -> None:
+        # called with the lock held
+        if not self.loaded:
+            self._load()
+
+    def _alloc(self, kind: int, b_fid: bytes, number: int) -> int:
+        # returns a new extent (zeroed, with descriptor)
+        if self._free:
+            ext = self._free.pop(0)
+        else:
+            ext = self._count
+            self._count += 1
+        extent = bytearray(EXTENT_SIZE)
+        extent[:4] = EXTENT_MAGIC
+        extent[4] = kind
+        extent[5:37] = b_fid
+        extent[37:41] = number.to_bytes(4, "big")
+        self._f.seek(ext * EXTENT_SIZE)
+        self._f.write(extent)
+        return ext
+
+    def _describe(
+        self, ext: int, kind: int, b_fid: bytes, number: int, skip: int
+    ) -> None:
+        desc = bytearray(43)
+        desc[:4] = EXTENT_MAGIC
+        desc[4] = kind
+        desc[5:37] = b_fid
+        desc[37:41] = number.to_bytes(4, "big")
+        desc[41:43] = skip.to_bytes(2, "big")
+        self._f.seek(ext * EXTENT_SIZE)
+        self._f.write(desc)
+
+    def _slot(self, b_fid: bytes, offset: int) -> int:
+        # file offset of the given log offset
+        s = self._skip[b_fid] + offset // 128
+        ext = self._extents[b_fid][s // (EXTENT_SLOTS - 1)]
+        return ext * EXTENT_SIZE + 128 * (1 + s % (EXTENT_SLOTS - 1)) + offset % 128
+
+    def fids(self) -> List[bytearray]:
+        with self._lock:
+            self._ensure()
+            return [bytearray(b_fid) for b_fid in self._order]
+
+    def read_header(self, fid: bytearray) -> bytearray:
+        header = bytearray(128)
+        with self._lock:
+            self._ensure()
+            offset = self._headers.get(bytes(fid))
+            if offset is None:
+                raise OSError("feed not found")
+            self._f.seek(offset)
+            self._f.readinto(header)
+        return header
+
+    def write_header(self, fid: bytearray, header: bytearray) -> None:
+        with self._lock:
+            self._ensure()
+            self._write_header(bytes(fid), header)
+
+    def _write_header(self, b_fid: bytes, header: bytearray) -> None:
+        offset = self._headers.get(b_fid)
+        if offset is None:
+            if not self._free_headers:
+                ext = self._alloc(KIND_HEADERS, bytes(32), 0)
+                self._free_headers = [
+                    ext * EXTENT_SIZE + 128 * i for i in range(1, EXTENT_SLOTS)
+                ]
+            offset = self._free_headers.pop(0)
+            self._headers[b_fid] = offset
+            self._order.append(b_fid)
+        self._f.seek(offset)
+        self._f.write(header)
+
+    def log_size(self, fid: bytearray) -> int:
+        with self._lock:
+            self._ensure()
+            return self._size.get(bytes(fid), 0)
+
+    def read_log(self, fid: bytearray, offset: int, buf: bytearray) -> None:
+        b_fid = bytes(fid)
+        view = memoryview(buf)
+        with self._lock:
+            self._ensure()
+            # read extent by extent
+            done = 0
+            while done < len(buf):
+                pos = self._slot(b_fid, offset + done)
+                n = min(len(buf) - done, EXTENT_SIZE - pos % EXTENT_SIZE)
+                self._f.seek(pos)
+                self._f.readinto(view[done : done + n])
+                done += n
+
+    def append_log(self, fid: bytearray, data: bytearray) -> None:
+        with self._lock:
+            self._ensure()
+            self._append(bytes(fid), data)
+
+    def _append(self, b_fid: bytes, data: bytearray) -> None:
+        if b_fid not in self._extents:
+            self._extents[b_fid] = []
+            self._skip[b_fid] = 0
+            self._size[b_fid] = 0
+        extents = self._extents[b_fid]
+        done = 0
+        while done < len(data):
+            s = self._skip[b_fid] + self._size[b_fid] // 128
+            if s == len(extents) * (EXTENT_SLOTS - 1):
+                number = 0
+                if extents:
+                    number = int.from_bytes(self._descriptor(extents[-1])[37:41], "big")
+                    number += 1
+                extents.append(self._alloc(KIND_LOG, b_fid, number))
+            pos = self._slot(b_fid, self._size[b_fid])
+            n = min(len(data) - done, EXTENT_SIZE - pos % EXTENT_SIZE)
+            self._f.seek(pos)
+            self._f.write(data[done : done + n])
+            done += n
+            self._size[b_fid] += n
+
+    def _descriptor(self, ext: int) -> bytearray:
+        desc = bytearray(128)
+        self._f.seek(ext * EXTENT_SIZE)
+        self._f.readinto(desc)
+        return desc
+
+    def write_log(self, fid: bytearray, offset: int, data: bytearray) -> None:
+        b_fid = bytes(fid)
+        with self._lock:
+            self._ensure()
+            size = self._size.get(b_fid, 0)
+            # overwrite the existing part, append the rest
+            done = 0
+            while offset + done < size and done < len(data):
+                pos = self._slot(b_fid, offset + done)
+                n = min(len(data) - done, EXTENT_SIZE - pos % EXTENT_SIZE)
+                n = min(n, size - offset - done)
+                self._f.seek(pos)
+                self._f.write(data[done : done + n])
+                done += n
+            if done < len(data):
+                self._append(b_fid, data[done:])
+
+    def cut_log(self, fid: bytearray, start: int, end: int) -> None:
+        """
+        Only keeps the bytes [start:end) of the log. Cut packets are zeroed,
+        extents that became empty are freed.
+        """
+        assert start % 128 == 0 and end % 128 == 0
+        b_fid = bytes(fid)
+        per_extent = EXTENT_SLOTS - 1
+        with self._lock:
+            self._ensure()
+            extents = self._extents.get(b_fid, [])
+            size = self._size.get(b_fid, 0)
+
+            # zero the cut slots at the end, free unused extents
+            zeros = bytes(128)
+            for offset in range(end, size, 128):
+                self._f.seek(self._slot(b_fid, offset))
+                self._f.write(zeros)
+            used = self._skip[b_fid] + end // 128 if extents else 0
+            while len(extents) > (used + per_extent - 1) // per_extent:
+                ext = extents.pop()
+                self._describe(ext, KIND_FREE, bytes(32), 0, 0)
+                self._free.append(ext)
+
+            # skip the cut slots at the start, free passed extents
+            skip = self._skip.get(b_fid, 0) + start // 128
+            while extents and skip >= per_extent:
+                ext = extents.pop(0)
+                self._describe(ext, KIND_FREE, bytes(32), 0, 0)
+                self._free.append(ext)
+                skip -= per_extent
+            if extents:
+                number = int.from_bytes(self._descriptor(extents[0])[37:41], "big")
+                self._describe(extents[0], KIND_LOG, b_fid, number, skip)
+            self._skip[b_fid] = skip if extents else 0
+            self._size[b_fid] = end - start
+
+    def read_types(self, fid: bytearray) -> Optional[bytearray]:
+        return self._files.read_types(fid)
+
+    def types_size(self, fid: bytearray) -> int:
+        return self._files.types_size(fid)
+
+    def write_types(self, fid: bytearray, types: bytearray) -> None:
+        self._files.write_types(fid, types)
+
+    def append_types(self, fid: bytearray, types: bytearray) -> None:
+        self._files.append_types(fid, types)
+
+    def drop_types(self, fid: bytearray) -> None:
+        self._files.drop_types(fid)
+
+    def sync(self, fid: bytearray) -> None:
+        with self._lock:
+            if self._f is not None:
+                sync_file(self._f)
+
+    def close(self) -> None:
+        with self._lock:
+            if self._f is not None:
+                self._f.close()
+                self._f = None
+            self.loaded = False
+
+
+def default_backend() -> str:
+    """
+    Returns the storage backend of a node that was not given one: "packed"
+    if its feeds were moved into PACK_FN before, else FEED_BACKEND.
+    """
+    try:
+        stat(PACK_FN)
+        return "packed"
+    except OSError:
+        return FEED_BACKEND
+
+
+def open_store(backend: str = FEED_BACKEND) -> Union[FileStore, PackedStore]:
+    """
+    Returns a new storage backend: "file" (FileStore) or "packed"
+    (PackedStore).
+    """
+    if backend == "file":
+        return FileStore()
+    if backend == "packed":
+        return PackedStore()
+    raise ValueError("unknown storage backend: {}".format(backend))
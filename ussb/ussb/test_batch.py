@@ -0,0 +1,136 @@
+"""
+Checks the batch verification of received packets (FeedManager). Run it in
+a node directory, e.g.:
+    micropython -c "import ussb.test_batch as t; t.run()"
+Everything happens in the scratch directory _test, which is removed again.
+"""
+
+from .blobs import blob_store
+from .feed import create_feed, get_feed, journal
+from .feed_manager import FeedManager
+from .packet import PLAIN48, new_packet
+from .util import listdir
+from os import urandom
+from pure25519 import SigningKey, create_keypair
+from sys import implementation
+from uctypes import addressof, bytearray_at
+from uos import chdir, mkdir, remove, rmdir
+
+
+# helps with debugging in vim
+if implementation.name != "micropython":
+    from typing import List, Tuple
+
+
+TEST_DIR = "_test"
+
+
+def make_wires(key: SigningKey, count: int) -> List[bytearray]:
+    """
+    Returns the first count wire packets of the feed of the given key.
+    """
+    fid = bytearray(key.vk_s)
+    prev_mid = fid[:20]
+    wires = []
+    for seq in range(1, count + 1):
+        pkt = new_packet(
+            fid,
+            seq.to_bytes(4, "big"),
+            prev_mid,
+            bytearray(urandom(48)),
+            PLAIN48.to_bytes(1, "big"),
+            key,
+        )
+        wires.append(bytearray(bytearray_at(addressof(pkt.wire[0]), 128)))
+        prev_mid = bytearray(pkt.mid)
+    return wires
+
+
+def forge(wire: bytearray) -> bytearray:
+    """
+    Returns a frame with the (public) dmx value of the given wire packet,
+    but an invalid signature.
+    """
+    forged = bytearray(wire)
+    forged[-1] ^= 1
+    return forged
+
+
+def new_feed(fm: FeedManager) -> Tuple[bytearray, SigningKey]:
+    """
+    Creates a feed of someone else, which the given FeedManager expects.
+    """
+    key, _ = create_keypair()
+    fid = bytearray(key.vk_s)
+    create_feed(fid)
+    fm.update_dmx(fid)
+    return fid, key
+
+
+def test_forged_before_packet(fm: FeedManager) -> None:
+    fid, key = new_feed(fm)
+    wires = make_wires(key, 2)
+
+    fm.handle_packet(fid, forge(wires[0]))
+    # the dmx value stays armed until the batch is verified
+    assert fm.consult_dmx(wires[0][8:15]) is not None
+    fm.handle_packet(fid, wires[0])
+    fm.handle_packet(fid, wires[1])
+    fm.flush_pending(force=True)
+    assert get_feed(fid).front_seq == 2
+
+
+def test_forged_after_packet(fm: FeedManager) -> None:
+    fid, key = new_feed(fm)
+    wires = make_wires(key, 2)
+
+    fm.handle_packet(fid, wires[0])
+    fm.handle_packet(fid, forge(wires[0]))
+    fm.handle_packet(fid, wires[1])
+    fm.flush_pending(force=True)
+    assert get_feed(fid).front_seq == 2
+
+
+def test_forged_in_batch(fm: FeedManager) -> None:
+    fid, key = new_feed(fm)
+    wires = make_wires(key, 4)
+
+    fm.handle_packet(fid, wires[0])
+    fm.handle_packet(fid, wires[1])
+    fm.handle_packet(fid, forge(wires[2]))
+    fm.handle_packet(fid, wires[3])
+    fm.flush_pending(force=True)
+    assert get_feed(fid).front_seq == 2
+    assert fm.consult_dmx(wires[2][8:15]) is not None
+    assert fm.consult_dmx(wires[3][8:15]) is None
+
+    # the packets after the invalid one are received again
+    fm.handle_packet(fid, wires[2])
+    fm.handle_packet(fid, wires[3])
+    fm.flush_pending(force=True)
+    assert get_feed(fid).front_seq == 4
+
+
+def _clean(directory: str) -> None:
+    for file in listdir(directory):
+        remove("{}/{}".format(directory, file))
+    rmdir(directory)
+
+
+def run() -> None:
+    mkdir(TEST_DIR)
+    chdir(TEST_DIR)
+    try:
+        fm = FeedManager()
+        fm.batch_size = 8
+        test_forged_before_packet(fm)
+        test_forged_after_packet(fm)
+        test_forged_in_batch(fm)
+        print("batch verification ok")
+    finally:
+        journal.commit()
+        blob_store.close()
+        _clean("_feeds")
+        _clean("_blobs")
+        chdir("..")
+        rmdir(TEST_DIR)
@@ -0,0 +1,120 @@
+"""
+Checks the reception of blob chains. Run it in a node directory, e.g.:
+    micropython -c "import ussb.test_blobs as t; t.run()"
+Everything happens in the scratch directory _test, which is removed again.
+"""
+
+from . import feed as feeds
+from .blobs import blob_store
+from .feed import (
+    FEED,
+    create_feed,
+    get_feed,
+    get_payload,
+    use_backend,
+    verify_and_append_blob,
+    verify_and_append_bytes,
+    waiting_for_blob,
+)
+from .packet import create_chain
+from .storage import FEED_BACKEND
+from .util import listdir
+from os import urandom
+from pure25519 import SigningKey, create_keypair
+from sys import implementation
+from uctypes import addressof, bytearray_at, sizeof, struct
+from uos import chdir, mkdir, remove, rmdir
+
+
+# helps with debugging in vim
+if implementation.name != "micropython":
+    from typing import List, Tuple
+
+
+TEST_DIR = "_test"
+
+
+def make_chain(
+    feed: struct[FEED], payload: bytearray, key: SigningKey
+) -> Tuple[bytearray, List[bytearray]]:
+    """
+    Returns the wire packet of the next blob chain of the given feed and
+    its blobs (in chain order), without appending or storing anything.
+    """
+    pkt, blobs = create_chain(
+        feed.fid, (feed.front_seq + 1).to_bytes(4, "big"), feed.front_mid, payload, key
+    )
+    wire = bytearray(bytearray_at(addressof(pkt.wire[0]), 128))
+    return wire, [bytearray(bytearray_at(addressof(b), sizeof(b))) for b in blobs]
+
+
+def receive_chain(
+    feed: struct[FEED],
+    wire: bytearray,
+    blobs: List[bytearray],
+    skip_first: bool = False,
+) -> struct[FEED]:
+    """
+    Appends the given chain as a peer would receive it. The first blob can
+    be delayed until the others were offered (out of order).
+    """
+    assert verify_and_append_bytes(feed, wire)
+    assert waiting_for_blob(feed) == wire[44:64]
+
+    if skip_first:
+        # not the missing blob, rejected
+        for blob in blobs[1:]:
+            assert not verify_and_append_blob(feed, blob)
+        assert waiting_for_blob(feed) == wire[44:64]
+
+        # the cursor survives reloading the header
+        feeds.header_cache.clear()
+        feed = get_feed(feed.fid)
+        assert waiting_for_blob(feed) == wire[44:64]
+
+    for blob in blobs:
+        assert verify_and_append_blob(feed, blob)
+    assert waiting_for_blob(feed) is None
+    return feed
+
+
+def test_chains_in_sequence() -> None:
+    key, _ = create_keypair()
+    fid = bytearray(key.vk_s)
+    feed = create_feed(fid)
+
+    payload1 = bytearray(urandom(300))
+    wire, blobs = make_chain(feed, payload1, key)
+    feed = receive_chain(feed, wire, blobs)
+
+    # the first blob of the second chain is missing
+    payload2 = bytearray(urandom(250))
+    wire, blobs = make_chain(feed, payload2, key)
+    feed = receive_chain(feed, wire, blobs, skip_first=True)
+
+    assert get_payload(feed, 1) == payload1
+    assert get_payload(feed, 2) == payload2
+
+
+def _clean(directory: str) -> None:
+    for file in listdir(directory):
+        remove("{}/{}".format(directory, file))
+    rmdir(directory)
+
+
+def run() -> None:
+    mkdir(TEST_DIR)
+    chdir(TEST_DIR)
+    try:
+        mkdir("_feeds")
+        mkdir("_blobs")
+        use_backend(FEED_BACKEND)
+        test_chains_in_sequence()
+        print("blob chains ok")
+    finally:
+        use_backend(FEED_BACKEND)
+        blob_store.close()
+        _clean("_feeds")
+        _clean("_blobs")
+        chdir("..")
+        rmdir(TEST_DIR)
@@ -0,0 +1,112 @@
+"""
+Checks the snapshot of the dmx table (FeedManager.save_dmx). Run it in a
+node directory, e.g.:
+    micropython -c "import ussb.test_dmx as t; t.run()"
+Everything happens in the scratch directory _test, which is removed again.
+"""
+
+from .blobs import blob_store
+from .feed import (
+    create_feed,
+    get_feed,
+    get_next_dmx,
+    journal,
+    verify_and_append_bytes,
+)
+from .feed_manager import DMX_RECORD_SIZE, DMX_SNAPSHOT_FN, FeedManager
+from .test_batch import make_wires, new_feed
+from .test_blobs import make_chain
+from .util import listdir
+from os import urandom
+from sys import implementation
+from uos import chdir, mkdir, remove, rmdir
+
+
+# helps with debugging in vim
+if implementation.name != "micropython":
+    from typing import Dict
+
+
+TEST_DIR = "_test"
+
+
+def dmx_values(fm: FeedManager) -> Dict[bytes, bytes]:
+    """
+    Returns the dmx table as {dmx value: feed ID}.
+    """
+    return {dmx: value[1] for dmx, value in fm.dmx_table.items()}
+
+
+def replace_next_dmx(fid: bytearray, dmx: bytes) -> None:
+    """
+    Replaces the dmx value of the next packet of the given feed in the
+    saved snapshot.
+    """
+    f = open(DMX_SNAPSHOT_FN, "rb")
+    content = bytearray(f.read())
+    f.close()
+    for i in range(5, len(content), DMX_RECORD_SIZE):
+        if content[i : i + 32] == fid:
+            content[i + 56 : i + 63] = dmx
+    f = open(DMX_SNAPSHOT_FN, "wb")
+    f.write(content)
+    f.close()
+
+
+def test_snapshot() -> None:
+    fm = FeedManager()
+    fm.batch_size = 1
+
+    # own feed, feed expecting a packet, feed expecting a blob
+    key, fid = fm.generate_keypair()
+    create_feed(fid)
+    fm.update_dmx(fid)
+    packet_fid, packet_key = new_feed(fm)
+    wires = make_wires(packet_key, 3)
+    # handling functions get the feed ID from the dmx table (bytes)
+    fm.handle_packet(bytes(packet_fid), wires[0])
+    fm.handle_packet(bytes(packet_fid), wires[1])
+    blob_fid, blob_key = new_feed(fm)
+    wire, _ = make_chain(get_feed(blob_fid), bytearray(urandom(200)), blob_key)
+    fm.handle_packet(bytes(blob_fid), wire)
+    fm.save_dmx()
+
+    # restored as it was
+    values = dmx_values(fm)
+    fm = FeedManager()
+    assert dmx_values(fm) == values
+
+    # the snapshot is used while the feed did not change...
+    replace_next_dmx(packet_fid, b"7 bytes")
+    fm = FeedManager()
+    assert fm.consult_dmx(b"7 bytes") is not None
+
+    # ... and no longer once it did
+    replace_next_dmx(packet_fid, b"7 bytes")
+    assert verify_and_append_bytes(get_feed(packet_fid), wires[2])
+    fm = FeedManager()
+    assert fm.consult_dmx(b"7 bytes") is None
+    next_dmx = get_next_dmx(get_feed(packet_fid))
+    assert fm.consult_dmx(next_dmx)[1] == packet_fid
+
+
+def _clean(directory: str) -> None:
+    for file in listdir(directory):
+        remove("{}/{}".format(directory, file))
+    rmdir(directory)
+
+
+def run() -> None:
+    mkdir(TEST_DIR)
+    chdir(TEST_DIR)
+    try:
+        test_snapshot()
+        print("dmx snapshot ok")
+    finally:
+        journal.commit()
+        blob_store.close()
+        _clean("_feeds")
+        _clean("_blobs")
+        remove("fm_config.json")
+        chdir("..")
+        rmdir(TEST_DIR)
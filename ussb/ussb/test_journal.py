@@ -0,0 +1,167 @@
+"""
+Checks the recovery of feeds after a crash (feed.recover_feeds): replaying
+the append journal and matching headers with their logs. Run it in a node
+directory, e.g.:
+    micropython -c "import ussb.test_journal as t; t.run()"
+Everything happens in the scratch directory _test, which is removed again.
+"""
+
+from . import feed as feeds
+from .blobs import blob_store
+from .feed import (
+    append_bytes,
+    create_child_feed,
+    create_feed,
+    get_children,
+    get_feed,
+    get_payload,
+    journal,
+    recover_feeds,
+    use_backend,
+)
+from .storage import FEED_BACKEND
+from .tree import TREE_FN
+from .util import SYNC, listdir
+from os import urandom
+from pure25519 import SigningKey, create_keypair
+from sys import implementation
+from uos import chdir, mkdir, remove, rmdir
+
+
+# helps with debugging in vim
+if implementation.name != "micropython":
+    from typing import List, Optional, Tuple
+
+
+TEST_DIR = "_test"
+
+
+def new_feed() -> Tuple[bytearray, SigningKey]:
+    key, _ = create_keypair()
+    fid = bytearray(key.vk_s)
+    feed = create_feed(fid)
+    for _ in range(2):
+        append_bytes(feed, bytearray(urandom(48)), key)
+    return fid, key
+
+
+def read_tree() -> Optional[str]:
+    try:
+        f = open(TREE_FN)
+        content = f.read()
+        f.close()
+        return content
+    except OSError:
+        return None
+
+
+def restore_tree(content: Optional[str]) -> None:
+    """
+    Puts the saved feed tree back as it was, and forgets the loaded one.
+    """
+    if content is None:
+        try:
+            remove(TREE_FN)
+        except OSError:
+            pass
+    else:
+        f = open(TREE_FN, "w")
+        f.write(content)
+        f.close()
+    feeds.feed_tree.clear()
+    feeds.feed_tree.loaded = False
+
+
+def crash(fid: bytearray, header: bytearray, size: int, cut: bool) -> None:
+    """
+    Puts the header of the given feed back as it was, and its log if cut is
+    set (the writes did not reach the storage), and forgets cached headers.
+    """
+    feeds.store.write_header(fid, header)
+    if cut:
+        feeds.store.cut_log(fid, 0, size)
+    feeds.header_cache.clear()
+
+
+def append_child(fid: bytearray, key: SigningKey) -> Tuple[bytearray, List[bytes]]:
+    """
+    Appends a packet and a MKCHILD packet to the given (own) feed.
+    Returns the feed ID of the child and the payloads of all packets.
+    """
+    feed = get_feed(fid)
+    append_bytes(feed, bytearray(urandom(48)), key)
+    child_key, _ = create_keypair()
+    child_fid = bytearray(child_key.vk_s)
+    create_child_feed(feed, key, child_fid, child_key)
+    feed = get_feed(fid)
+    return child_fid, [get_payload(feed, i) for i in range(1, 5)]
+
+
+def test_replay() -> None:
+    # the header and the log lost the last two packets, the journal has them
+    fid, key = new_feed()
+    header = feeds.store.read_header(fid)
+    size = feeds.store.log_size(fid)
+    tree = read_tree()
+    child_fid, payloads = append_child(fid, key)
+    journal.commit()
+
+    crash(fid, header, size, True)
+    restore_tree(tree)
+    assert recover_feeds() >= 1
+    feed = get_feed(fid)
+    assert feed.front_seq == 4
+    assert [get_payload(feed, i) for i in range(1, 5)] == payloads
+    assert get_children(feed) == [child_fid]
+
+    # nothing to do anymore
+    assert recover_feeds() == 0
+
+
+def test_match_log() -> None:
+    # the log has two packets more than the header, and a torn one
+    fid, key = new_feed()
+    header = feeds.store.read_header(fid)
+    tree = read_tree()
+    child_fid, payloads = append_child(fid, key)
+    journal.commit()
+    journal.reset()
+    feeds.store.append_log(fid, bytearray(50))
+
+    crash(fid, header, 0, False)
+    restore_tree(tree)
+    assert recover_feeds() == 1
+    feed = get_feed(fid)
+    assert feed.front_seq == 4
+    assert feeds.store.log_size(fid) == 4 * 128
+    assert [get_payload(feed, i) for i in range(1, 5)] == payloads
+    assert get_children(feed) == [child_fid]
+
+
+def _clean(directory: str) -> None:
+    for file in listdir(directory):
+        remove("{}/{}".format(directory, file))
+    rmdir(directory)
+
+
+def run() -> None:
+    mkdir(TEST_DIR)
+    chdir(TEST_DIR)
+    try:
+        mkdir("_feeds")
+        mkdir("_blobs")
+        use_backend(FEED_BACKEND)
+        if SYNC:
+            test_replay()
+        else:
+            print("files cannot be synced, no journal to replay")
+        test_match_log()
+        print("feed recovery ok")
+    finally:
+        journal.commit()
+        blob_store.close()
+        _clean("_feeds")
+        _clean("_blobs")
+        restore_tree(None)
+        chdir("..")
+        rmdir(TEST_DIR)
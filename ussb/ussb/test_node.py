@@ -0,0 +1,244 @@
+"""
+Checks the handling of received frames by the node (without sockets). Run it
+in a node directory, e.g.:
+    micropython -c "import ussb.test_node as t; t.run()"
+Everything happens in the scratch directory _test, which is removed again.
+"""
+
+from .blobs import blob_store
+from .feed import get_feed, journal
+from .node import (
+    FRAME_LENGTHS,
+    PEER_TIMEOUT_MS,
+    RX_QUEUE_SIZE,
+    UDP_BATCH_FRAMES,
+    WANT_WINDOW,
+    WANT_WINDOW_MS,
+    Node,
+    pack_frames,
+    unpack_frames,
+)
+from .test_batch import forge, make_wires, new_feed
+from .util import listdir
+from _thread import start_new_thread
+from sys import implementation
+from time import sleep
+from uos import chdir, mkdir, remove, rmdir
+
+
+# helps with debugging in vim
+if implementation.name != "micropython":
+    from typing import Callable, List, Tuple
+
+
+TEST_DIR = "_test"
+
+
+class FakeSocket:
+    """
+    Hands out the given datagrams, then fails (ends Node._listen).
+    """
+
+    def __init__(self, datagrams: List[bytes]) -> None:
+        self.datagrams = datagrams
+
+    def recvfrom(self, size: int) -> Tuple[bytes, None]:
+        if not self.datagrams:
+            raise OSError("no more datagrams")
+        return self.datagrams.pop(0), None
+
+
+def wait_for(condition: Callable[[], bool]) -> None:
+    """
+    Waits (at most 5s) until the given condition holds.
+    """
+    for _ in range(500):
+        if condition():
+            return
+        sleep(0.01)
+    assert False, "timeout"
+
+
+def test_rx_queue(node: Node) -> None:
+    fid, key = new_feed(node.feed_manager)
+    wires = make_wires(key, 2)
+
+    # full queue -> dropped
+    for _ in range(RX_QUEUE_SIZE + 2):
+        node._enqueue_rx(bytes(wires[0]))
+    assert node.rx_stats() == (RX_QUEUE_SIZE, RX_QUEUE_SIZE, 2)
+
+    # the worker empties the queue (the duplicates are dropped) and waits
+    start_new_thread(node._process_rx, ())
+    wait_for(lambda: node.rx_stats()[0] == 0)
+    assert not node.rx_wake.acquire(0)
+    assert get_feed(fid).front_seq == 1
+
+    # ... until the next frame arrives
+    node._enqueue_rx(bytes(wires[1]))
+    wait_for(lambda: get_feed(fid).front_seq == 2)
+
+
+def test_stale_frame(node: Node) -> None:
+    fid, key = new_feed(node.feed_manager)
+    wire = make_wires(key, 1)[0]
+
+    # a frame and its duplicate, both classified before they are handled
+    fn, b_fid, is_pkt = node._classify(bytes(wire))
+
+    # the dmx value set again in the meantime still leads to the feed
+    node.feed_manager.update_dmx(fid)
+    sent = node.want_stats()[1]
+    node._dispatch(fn, b_fid, is_pkt, bytearray(wire))
+    assert get_feed(fid).front_seq == 1
+    assert node.want_stats()[1] == sent + 1
+
+    # the duplicate is dropped
+    node._dispatch(fn, b_fid, is_pkt, bytearray(wire))
+    assert get_feed(fid).front_seq == 1
+    assert node.want_stats()[1] == sent + 1
+
+
+def test_progress(node: Node) -> None:
+    fid, key = new_feed(node.feed_manager)
+    wires = make_wires(key, 1)
+    node.want_scheduler.record_sent(fid)
+    useful = node.want_stats()[2]
+
+    # an invalid frame is no response to the want
+    fn, b_fid, is_pkt = node._classify(bytes(wires[0]))
+    node._dispatch(fn, b_fid, is_pkt, forge(wires[0]))
+    assert get_feed(fid).front_seq == 0
+    assert node.want_stats()[2] == useful
+
+    node._dispatch(fn, b_fid, is_pkt, bytearray(wires[0]))
+    assert get_feed(fid).front_seq == 1
+    assert node.want_stats()[2] == useful + 1
+
+
+def test_windows(node: Node) -> None:
+    fid, key = new_feed(node.feed_manager)
+    b_fid = bytes(fid)
+    half = WANT_WINDOW // 2
+    wires = make_wires(key, half + 2)
+
+    # a plain want of the first packet, followed by the range want
+    wants = node._next_wants(fid)
+    assert [len(want) for want in wants] == [43, 44]
+    assert wants[1][:43] == wants[0]
+    assert int.from_bytes(wants[0][39:43], "big") == 1
+    assert wants[1][43] == WANT_WINDOW
+    assert node._next_wants(fid) == []
+
+    # a packet ahead of the next one is kept once, until it fits
+    node._handle_packet(bytes(wires[1]))
+    node._handle_packet(bytes(wires[1]))
+    assert len(node.reorder) == 1
+    node._handle_packet(bytes(wires[0]))
+    assert node.reorder == []
+    assert get_feed(fid).front_seq == 2
+
+    # the next window is requested once half of it arrived
+    for wire in wires[2 : half - 1]:
+        node._handle_packet(bytes(wire))
+    assert node.windows[b_fid][0] == WANT_WINDOW
+    node._handle_packet(bytes(wires[half - 1]))
+    assert node.windows[b_fid][0] == 2 * WANT_WINDOW
+
+    # no frames are kept once the windows expired
+    for window_fid, (last, requested) in list(node.windows.items()):
+        node.windows[window_fid] = (last, requested - WANT_WINDOW_MS)
+    node._handle_packet(bytes(wires[half + 1]))
+    assert node.reorder == []
+    assert node.windows == {}
+
+
+def test_answer_wants(node: Node) -> None:
+    fid, key = new_feed(node.feed_manager)
+    wires = make_wires(key, 3)
+    for wire in wires:
+        node._handle_packet(bytes(wire))
+    node.feed_manager.flush_pending(force=True)
+
+    # a single packet, a range (up to the front) and a missing packet
+    want = node.feed_manager.get_want(fid, 4)
+    want[39:43] = (2).to_bytes(4, "big")
+    assert node.feed_manager.handle_want(fid, want[:43]) == wires[1]
+    assert node.feed_manager.handle_want(fid, want) == wires[1:]
+    want[39:43] = (4).to_bytes(4, "big")
+    assert node.feed_manager.handle_want(fid, want[:43]) is None
+
+
+def test_framing() -> None:
+    frames = [bytes([i]) * length for i, length in enumerate(FRAME_LENGTHS)]
+    for frame in frames:
+        assert pack_frames([frame]) == frame
+        assert unpack_frames(frame) == [frame]
+
+    payload = pack_frames(frames)
+    assert len(payload) not in FRAME_LENGTHS
+    assert unpack_frames(payload) == frames
+    # truncated or too long
+    assert unpack_frames(payload[:-1]) == []
+    assert unpack_frames(payload + b"x") == []
+
+    # the announcement is no frame for nodes without batching
+    assert len(pack_frames([])) not in FRAME_LENGTHS
+    assert unpack_frames(pack_frames([])) == []
+
+
+def test_older_peers(node: Node) -> None:
+    node.batch_frames = UDP_BATCH_FRAMES
+    assert node._batch_size() == 1
+
+    # a node that announces batching
+    sock = FakeSocket([b"a" * 8 + pack_frames([])])
+    try:
+        node._listen(sock)
+    except OSError:
+        pass
+    assert node._batch_size() == UDP_BATCH_FRAMES
+
+    # a node without batching sends single frames only
+    sock = FakeSocket([b"b" * 8 + bytes(43)])
+    try:
+        node._listen(sock)
+    except OSError:
+        pass
+    assert node._batch_size() == 1
+
+    # ... until it is no longer heard
+    node.peers[b"b" * 8][1] -= PEER_TIMEOUT_MS + 1
+    assert node._batch_size() == UDP_BATCH_FRAMES
+    assert list(node.peers.keys()) == [b"a" * 8]
+    node.batch_frames = 1
+
+
+def _clean(directory: str) -> None:
+    for file in listdir(directory):
+        remove("{}/{}".format(directory, file))
+    rmdir(directory)
+
+
+def run() -> None:
+    mkdir(TEST_DIR)
+    chdir(TEST_DIR)
+    try:
+        node = Node()
+        # append every packet right away
+        node.feed_manager.batch_size = 1
+        test_rx_queue(node)
+        test_stale_frame(node)
+        test_progress(node)
+        test_windows(node)
+        test_answer_wants(node)
+        test_framing()
+        test_older_peers(node)
+        print("node ok")
+    finally:
+        journal.commit()
+        blob_store.close()
+        _clean("_feeds")
+        _clean("_blobs")
+        chdir("..")
+        rmdir(TEST_DIR)
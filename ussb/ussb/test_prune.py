@@ -0,0 +1,232 @@
+"""
+Checks pruning feeds (FeedManager.prune) and continuing a feed of which the
+other nodes pruned the packets (anchor, see FeedManager.handle_want). Run it
+in a node directory, e.g.:
+    micropython -c "import ussb.test_prune as t; t.run()"
+Everything happens in the scratch directory _test, which is removed again.
+"""
+
+from . import feed as feeds
+from .blobs import PACK_FN, PTRS_FN, blob_store
+from .feed import (
+    collect_blobs,
+    get_anchor,
+    get_feed,
+    get_payload,
+    get_wire,
+    journal,
+    waiting_for_blob,
+)
+from .feed_manager import FeedManager
+from .packet import pkt_from_wire
+from .test_batch import forge, make_wires, new_feed
+from .test_blobs import make_chain
+from .util import listdir
+from _thread import start_new_thread
+from os import urandom
+from sys import implementation
+from time import sleep
+from uhashlib import sha256
+from uos import chdir, mkdir, remove, rmdir
+
+
+# helps with debugging in vim
+if implementation.name != "micropython":
+    from typing import Dict, List, Optional
+
+
+TEST_DIR = "_test"
+
+
+def mid_of(fid: bytearray, wires: List[bytearray], seq: int) -> bytearray:
+    """
+    Returns the message ID of the packet with the given sequence number.
+    """
+    mid = fid[:20]
+    for i in range(1, seq + 1):
+        pkt = pkt_from_wire(fid, i.to_bytes(4, "big"), mid, wires[i - 1], False)
+        mid = bytearray(pkt.mid)
+    return mid
+
+
+def test_answer_pruned(fm: FeedManager) -> None:
+    fid, key = new_feed(fm)
+    wires = make_wires(key, 6)
+    for wire in wires:
+        fm.handle_packet(bytes(fid), wire)
+    fm.flush_pending(force=True)
+
+    # the front packet is always kept
+    assert fm.prune(lambda feed: 9 if bytes(feed.fid) == fid else None) > 0
+    feed = get_feed(fid)
+    assert (feed.anchor_seq, feed.front_seq) == (5, 6)
+    fm.prune(lambda feed: None)
+    assert get_wire(feed, 6) == wires[5]
+
+    # a want of a pruned packet is answered with the anchor
+    want = fm.get_want(fid)
+    want[39:43] = (1).to_bytes(4, "big")
+    anchor = fm.handle_want(bytes(fid), want)
+    assert anchor == get_anchor(feed)
+    assert anchor[:7] == want[:7]
+    assert int.from_bytes(anchor[7:11], "big") == 5
+    assert anchor[11:31] == mid_of(fid, wires, 5)
+    want[39:43] = (6).to_bytes(4, "big")
+    assert fm.handle_want(bytes(fid), want) == wires[5]
+
+
+def test_continue_after_anchor(fm: FeedManager) -> None:
+    # a new node (empty feed) and a node that only has the first packet,
+    # the others pruned up to seq 4
+    for received in (0, 1):
+        fid, key = new_feed(fm)
+        wires = make_wires(key, 6)
+        for wire in wires[:received]:
+            fm.handle_packet(bytes(fid), wire)
+        fm.flush_pending(force=True)
+        anchor = bytearray(31)
+        anchor[:7] = fm.get_want(fid)[:7]
+        anchor[7:11] = (4).to_bytes(4, "big")
+        anchor[11:31] = mid_of(fid, wires, 4)
+
+        # the packet after the anchor is asked for, the feed stays as it is
+        assert fm.handle_want(bytes(fid), anchor) is None
+        assert int.from_bytes(fm.get_want(fid)[39:43], "big") == 5
+        assert len(fm.get_want(fid, 4)) == 44
+        feed = get_feed(fid)
+        assert (feed.anchor_seq, feed.front_seq) == (0, received)
+
+        # the anchor is trusted once the packet after it is verified
+        fn, b_fid = fm.consult_dmx(wires[4][8:15])
+        fn(b_fid, forge(wires[4]))
+        assert (feed.anchor_seq, feed.front_seq) == (0, received)
+        fn(b_fid, wires[4])
+        assert (feed.anchor_seq, feed.front_seq) == (4, 5)
+        assert feeds.store.log_size(fid) == 128
+        assert get_wire(feed, 5) == wires[4]
+        assert fm.consult_dmx(wires[4][8:15]) is None
+
+        # and continues as usual
+        fm.handle_packet(bytes(fid), wires[5])
+        fm.flush_pending(force=True)
+        assert feed.front_seq == 6
+        assert int.from_bytes(fm.get_want(fid)[39:43], "big") == 7
+
+        # anchors behind the feed are ignored
+        fm.handle_want(bytes(fid), anchor)
+        assert int.from_bytes(fm.get_want(fid)[39:43], "big") == 7
+
+
+def read_file(fn: str) -> bytes:
+    f = open(fn, "rb")
+    content = f.read()
+    f.close()
+    return content
+
+
+def write_files(files: Dict[str, Optional[bytes]]) -> None:
+    """
+    Writes the given files ({file name: content}), removes the ones
+    without content and forgets the loaded blobs.
+    """
+    blob_store.close()
+    for fn, content in files.items():
+        if content is None:
+            if fn[len("_blobs/") :] in listdir("_blobs"):
+                remove(fn)
+        else:
+            f = open(fn, "wb")
+            f.write(content)
+            f.close()
+
+
+def test_compact_crash() -> None:
+    blobs = [bytearray(urandom(128)) for _ in range(3)]
+    ptrs = [sha256(blob[8:]).digest()[:20] for blob in blobs]
+    blob_store.put_many(list(zip(ptrs, blobs)))
+    old_pack, old_ptrs = read_file(PACK_FN), read_file(PTRS_FN)
+    assert blob_store.compact(set([ptrs[0], ptrs[2]])) == 128 + 20
+    new_pack, new_ptrs = read_file(PACK_FN), read_file(PTRS_FN)
+    pack_tmp, ptrs_tmp = PACK_FN + ".tmp", PTRS_FN + ".tmp"
+
+    # interrupted while writing the new files, the old ones are used
+    write_files(
+        {
+            PACK_FN: old_pack,
+            PTRS_FN: old_ptrs,
+            pack_tmp: new_pack[:100],
+            ptrs_tmp: None,
+        }
+    )
+    assert [blob_store.get(ptr) for ptr in ptrs] == blobs
+
+    # old pointers removed, the old pack is still used
+    write_files({PACK_FN: old_pack, PTRS_FN: None, pack_tmp: new_pack})
+    assert [blob_store.get(ptr) for ptr in ptrs] == blobs
+
+    # old pack removed, the new one is used
+    write_files({PACK_FN: None, pack_tmp: new_pack, ptrs_tmp: new_ptrs})
+    assert [blob_store.get(ptr) for ptr in ptrs] == [blobs[0], None, blobs[2]]
+    write_files({PACK_FN: new_pack, pack_tmp: None, ptrs_tmp: new_ptrs})
+    assert [blob_store.get(ptr) for ptr in ptrs] == [blobs[0], None, blobs[2]]
+
+    # pointers of another pack are not used
+    write_files({PACK_FN: new_pack, PTRS_FN: old_ptrs})
+    assert [blob_store.get(ptr) for ptr in ptrs] == [blobs[0], None, blobs[2]]
+    assert read_file(PTRS_FN) == new_ptrs
+    for fn in listdir("_blobs"):
+        assert not fn.endswith(".tmp")
+
+
+def test_blob_while_pruning(fm: FeedManager) -> None:
+    fid, key = new_feed(fm)
+    payload = bytearray(urandom(200))
+    wire, blobs = make_chain(get_feed(fid), payload, key)
+    fm.handle_packet(bytes(fid), wire)
+
+    # a blob arriving while unused blobs are collected waits for it
+    done = []
+
+    def receive() -> None:
+        for blob in blobs:
+            fm.handle_blob(bytes(fid), blob)
+        done.append(True)
+
+    with fm.pending_lock:
+        start_new_thread(receive, ())
+        sleep(0.1)
+        assert not blob_store.contains(wire[44:64])
+        collect_blobs()
+
+    for _ in range(500):
+        if done:
+            break
+        sleep(0.01)
+    feed = get_feed(fid)
+    assert waiting_for_blob(feed) is None
+    assert get_payload(feed, 1) == payload
+
+
+def _clean(directory: str) -> None:
+    for file in listdir(directory):
+        remove("{}/{}".format(directory, file))
+    rmdir(directory)
+
+
+def run() -> None:
+    mkdir(TEST_DIR)
+    chdir(TEST_DIR)
+    try:
+        fm = FeedManager()
+        test_answer_pruned(fm)
+        test_continue_after_anchor(fm)
+        test_compact_crash()
+        test_blob_while_pruning(fm)
+        print("pruning ok")
+    finally:
+        journal.commit()
+        blob_store.close()
+        _clean("_feeds")
+        _clean("_blobs")
+        chdir("..")
+        rmdir(TEST_DIR)
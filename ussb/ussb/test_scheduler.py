@@ -0,0 +1,129 @@
+"""
+Checks the queue of outgoing frames (TxScheduler) and the scheduling of
+periodic wants (WantScheduler). Run it, e.g.:
+    micropython -c "import ussb.test_scheduler as t; t.run()"
+"""
+
+from .scheduler import WANT_MIN_MS, TxScheduler, WantScheduler
+from sys import implementation
+from time import sleep
+
+
+# helps with debugging in vim
+if implementation.name != "micropython":
+    from typing import List
+
+
+def want(feed: int, seq: int) -> bytearray:
+    """
+    Returns a (fake) want of the given feed for the given sequence number.
+    """
+    msg = bytearray(43)
+    msg[:7] = bytes([feed]) * 7
+    msg[39:43] = seq.to_bytes(4, "big")
+    return msg
+
+
+def drain(tx: TxScheduler) -> List[bytearray]:
+    msgs = []
+    while not tx.is_empty():
+        msgs.append(tx.get())
+    return msgs
+
+
+def test_dedup() -> None:
+    tx = TxScheduler(1000, 1000)
+    tx.push(want(1, 1))
+    tx.push(want(1, 1))
+    tx.push(want(1, 2))
+    assert len(tx) == 2
+    assert tx.duplicates == 1
+    assert drain(tx) == [want(1, 1), want(1, 2)]
+
+
+def test_priorities() -> None:
+    tx = TxScheduler(1000, 1000)
+    for feed in (1, 2, 3):
+        tx.push(want(feed, 1))
+
+    # asked for again -> ahead of the others pushed to the back
+    tx.push(want(3, 1))
+    # newest first
+    tx.push_front(want(4, 1))
+    tx.push_front(want(5, 1))
+    # moved to the front
+    tx.push_front(want(2, 1))
+    # stays at the front
+    tx.push(want(2, 1))
+
+    assert len(tx) == 5
+    assert tx.duplicates == 3
+    assert drain(tx) == [
+        want(2, 1),
+        want(5, 1),
+        want(4, 1),
+        want(3, 1),
+        want(1, 1),
+    ]
+
+
+def test_token_bucket() -> None:
+    # 2 frames at once, then one every 50ms
+    tx = TxScheduler(20, 2)
+    for seq in range(4):
+        tx.push(want(1, seq))
+    assert tx.poll() == want(1, 0)
+    assert tx.poll() == want(1, 1)
+    assert tx.poll() is None
+    sleep(0.06)
+    assert tx.poll() == want(1, 2)
+    assert tx.poll() is None
+
+    # get waits for the next token, get_many only takes what is allowed
+    assert tx.get_many(4) == [want(1, 3)]
+    assert tx.sent == 4
+
+    # the cost of a frame is taken from the bucket
+    tx = TxScheduler(100, 10, lambda msg: 5)
+    for seq in range(3):
+        tx.push(want(1, seq))
+    assert tx.get_many(3) == [want(1, 0), want(1, 1)]
+    assert tx.poll() is None
+
+
+def test_want_backoff() -> None:
+    ws = WantScheduler()
+    a, b = bytearray(b"a" * 32), bytearray(b"b" * 32)
+    assert ws.due([a, b]) == [a, b]
+
+    # every want doubles the interval
+    ws.record_sent(a)
+    ws.record_sent(b)
+    ws.record_sent(b)
+    assert ws.due([a, b]) == []
+    sleep(1.1 * WANT_MIN_MS / 1000)
+    assert ws.due([a, b]) == [a]
+
+    # progress after a want is useful and makes the feed due again
+    ws.record_progress(b)
+    assert ws.due([a, b]) == [a, b]
+    assert ws.stats() == (2, 3, 1)
+
+    # a hint of newer packets as well, but it is no response
+    ws.record_sent(a)
+    ws.reset(a)
+    assert ws.due([a]) == [a]
+    assert ws.stats() == (2, 4, 1)
+
+    # back to the shortest interval
+    ws.record_sent(b)
+    sleep(1.1 * WANT_MIN_MS / 1000)
+    assert ws.due([b]) == [b]
+
+
+def run() -> None:
+    test_dedup()
+    test_priorities()
+    test_token_bucket()
+    test_want_backoff()
+    print("scheduler ok")
@@ -0,0 +1,128 @@
+"""
+Checks moving feeds from the file-per-feed layout into the packed store and
+scanning logs. Run it in a node directory, e.g.:
+    micropython -c "import ussb.test_storage as t; t.run()"
+Everything happens in the scratch directory _test, which is removed again.
+"""
+
+from . import feed as feeds
+from .blobs import blob_store
+from .feed import (
+    LOG_SCAN_CHUNK,
+    create_feed,
+    get_feed,
+    get_payload,
+    get_types,
+    journal,
+    list_fids,
+    use_backend,
+    verify_and_append_bytes,
+)
+from .packet import CHAIN20, PLAIN48
+from .storage import FEED_BACKEND, default_backend
+from .test_batch import make_wires
+from .test_blobs import make_chain, receive_chain
+from .util import listdir
+from os import urandom
+from pure25519 import create_keypair
+from sys import implementation
+from uos import chdir, mkdir, remove, rmdir
+
+
+# helps with debugging in vim
+if implementation.name != "micropython":
+    from typing import Dict, List
+
+
+TEST_DIR = "_test"
+
+
+def new_feed(count: int) -> bytearray:
+    """
+    Creates a feed with count plain packets and a blob chain, returns its
+    feed ID.
+    """
+    key, _ = create_keypair()
+    fid = bytearray(key.vk_s)
+    feed = create_feed(fid)
+    for wire in make_wires(key, count):
+        assert verify_and_append_bytes(feed, wire)
+    wire, blobs = make_chain(feed, bytearray(urandom(300)), key)
+    receive_chain(feed, wire, blobs)
+    return fid
+
+
+def contents(fids: List[bytearray]) -> Dict[bytes, List[bytearray]]:
+    """
+    Returns the payloads of all packets of the given feeds.
+    """
+    result = {}
+    for fid in fids:
+        feed = get_feed(fid)
+        payloads = [get_payload(feed, i) for i in range(1, feed.front_seq + 1)]
+        result[bytes(fid)] = payloads
+    return result
+
+
+def test_migration() -> None:
+    use_backend("file")
+    fids = [new_feed(3), new_feed(40)]
+    expected = contents(fids)
+
+    # the files are moved into the pack
+    use_backend("packed")
+    assert contents(fids) == expected
+    assert default_backend() == "packed"
+    for file in listdir("_feeds"):
+        assert not file.endswith(".head") and not file.endswith(".log")
+
+    # feeds that are added in the file layout later are moved as well
+    use_backend("file")
+    assert list_fids() == []
+    fids.append(new_feed(5))
+    expected.update(contents(fids[2:]))
+    use_backend("packed")
+    assert contents(fids) == expected
+
+    # and stay there
+    use_backend("packed")
+    assert sorted([bytes(fid) for fid in list_fids()]) == sorted(expected.keys())
+    assert contents(fids) == expected
+
+
+def test_scan() -> None:
+    # the type index is rebuilt in chunks of LOG_SCAN_CHUNK packets
+    for backend in ("file", "packed"):
+        use_backend(backend)
+        fid = new_feed(LOG_SCAN_CHUNK + 3)
+        feed = get_feed(fid)
+        types = bytearray(get_types(feed))
+        assert len(types) == LOG_SCAN_CHUNK + 4
+        assert types[0] == PLAIN48 and types[-1] == CHAIN20
+        feeds.store.drop_types(fid)
+        assert get_types(feed) == types
+
+
+def _clean(directory: str) -> None:
+    for file in listdir(directory):
+        remove("{}/{}".format(directory, file))
+    rmdir(directory)
+
+
+def run() -> None:
+    mkdir(TEST_DIR)
+    chdir(TEST_DIR)
+    try:
+        mkdir("_feeds")
+        mkdir("_blobs")
+        test_migration()
+        test_scan()
+        print("storage ok")
+    finally:
+        journal.commit()
+        use_backend(FEED_BACKEND)
+        blob_store.close()
+        _clean("_feeds")
+        _clean("_blobs")
+        chdir("..")
+        rmdir(TEST_DIR)
@@ -0,0 +1,138 @@
+"""
+Checks that batch verification (pure25519.verify_batch) and verification
+one by one (VerifyingKey.verify) agree, also on signatures crafted by the
+key holder. Run it in a node directory, e.g.:
+    micropython -c "import ussb.test_verify as t; t.run()"
+"""
+
+from os import urandom
+from pure25519 import (
+    BadSignatureError,
+    Hint,
+    SigningKey,
+    VerifyingKey,
+    create_keypair,
+    verify_batch,
+)
+from pure25519.basic import (
+    Base,
+    L,
+    Q,
+    add_elements,
+    encodepoint,
+    scalar_to_bytes,
+    xform_affine_to_extended,
+    xform_extended_to_affine,
+)
+from sys import implementation
+
+
+# helps with debugging in vim
+if implementation.name != "micropython":
+    from typing import List, Tuple
+
+
+# element of order 2
+TORSION = xform_affine_to_extended((0, Q - 1))
+
+
+def sign_with(key: SigningKey, msg: bytes, r: int, torsion: bool) -> bytes:
+    """
+    Signs msg with the nonce r, adding an element of order 2 to R if
+    torsion is set (R = r*B + T, a mixed-order R). Only the key holder can
+    do this.
+    """
+    R = Base.scalarmult(r).XYTZ
+    if torsion:
+        R = add_elements(R, TORSION)
+    R_bytes = encodepoint(xform_extended_to_affine(R))
+    S = r + Hint(R_bytes + key.vk_s + msg) * key.a
+    return R_bytes + scalar_to_bytes(S)
+
+
+def sign_small_order(key: SigningKey, msg: bytes) -> bytes:
+    """
+    Signs msg with R = T (order 2), S = h*a, so S*B - h*A - R = -T.
+    """
+    R_bytes = encodepoint(xform_extended_to_affine(TORSION))
+    h = Hint(R_bytes + key.vk_s + msg)
+    return R_bytes + scalar_to_bytes(h * key.a)
+
+
+def accepted_one_by_one(items: List[Tuple[bytes, bytes, bytes]]) -> bool:
+    for vk, msg, sig in items:
+        try:
+            VerifyingKey(vk).verify(sig, msg)
+        except BadSignatureError:
+            return False
+    return True
+
+
+def accepted_in_batch(items: List[Tuple[bytes, bytes, bytes]]) -> bool:
+    try:
+        verify_batch(items)
+        return True
+    except BadSignatureError:
+        return False
+
+
+def check_agreement(items: List[Tuple[bytes, bytes, bytes]], expected: bool) -> None:
+    assert accepted_one_by_one(items) == expected
+    assert accepted_in_batch(items) == expected
+
+
+def test_valid_and_invalid() -> None:
+    key, vk = create_keypair()
+    items = []
+    for i in range(8):
+        msg = urandom(120)
+        items.append((vk.vk_s, msg, key.sign(msg)))
+    check_agreement(items, True)
+
+    # one changed message
+    vk_s, msg, sig = items[3]
+    items[3] = (vk_s, msg[:-1] + bytes([msg[-1] ^ 1]), sig)
+    check_agreement(items, False)
+
+
+def test_mixed_order_r() -> None:
+    # the order 2 parts of two R would cancel out without the cofactor
+    key, vk = create_keypair()
+    items = []
+    for _ in range(2):
+        msg = urandom(120)
+        r = int.from_bytes(urandom(32), "little") % L
+        items.append((vk.vk_s, msg, sign_with(key, msg, r, True)))
+    check_agreement(items, True)
+    check_agreement(items[:1], True)
+
+
+def test_small_order_r() -> None:
+    key, vk = create_keypair()
+    items = []
+    for _ in range(2):
+        msg = urandom(120)
+        items.append((vk.vk_s, msg, sign_small_order(key, msg)))
+    check_agreement(items, False)
+    check_agreement(items[:1], False)
+
+
+def test_non_canonical_r() -> None:
+    # y + Q instead of y (only possible for y < 19)
+    key, vk = create_keypair()
+    msg = urandom(120)
+    sig = key.sign(msg)
+    for y in range(19):
+        R_bytes = (y + Q).to_bytes(32, "little")
+        check_agreement([(vk.vk_s, msg, R_bytes + sig[32:])], False)
+    # x == 0 with the sign bit set (y = -1)
+    R_bytes = ((Q - 1) | (1 << 255)).to_bytes(32, "little")
+    check_agreement([(vk.vk_s, msg, R_bytes + sig[32:])], False)
+
+
+def run() -> None:
+    test_valid_and_invalid()
+    test_mixed_order_r()
+    test_small_order_r()
+    test_non_canonical_r()
+    print("signature verification ok")
@@ -0,0 +1,172 @@
+from _thread import allocate_lock
+from json import dumps, loads
+from sys import implementation
+from ubinascii import hexlify, unhexlify
+
+
+# helps with debugging in vim
+if implementation.name != "micropython":
+    from typing import List, Optional, Tuple, Union
+
+
+TREE_FN = "feed_tree.json"
+
+
+class FeedTree:
+    """
+    Persistent map of the feed tree: the children of every feed (with the
+    sequence number of their MKCHILD packet), the parent of every child
+    feed and the continuation/predecessor of ending feeds.
+    Kept up to date by feed.append_packets, which records MKCHILD, ISCHILD,
+    CONTDAS and ISCONTN packets, and saved to TREE_FN after every change.
+    All feed IDs are stored as bytes, queries return bytearrays.
+    Use feed.get_tree() to get the loaded instance.
+    """
+
+    __slots__ = (
+        "_children",
+        "_contn",
+        "_lock",
+        "_parents",
+        "_prev",
+        "loaded",
+    )
+
+    def __init__(self) -> None:
+        self._children = {}  # {fid: [(child fid, seq)]}
+        self._parents = {}  # {child fid: parent fid}
+        self._contn = {}  # {fid: continuation fid}
+        self._prev = {}  # {continuation fid: ending fid}
+        self._lock = allocate_lock()
+        self.loaded = False
+
+    def load(self) -> bool:
+        """
+        Loads the tree from TREE_FN.
+        Returns False if the file does not exist (or is broken).
+        """
+        try:
+            f = open(TREE_FN)
+            content = loads(f.read())
+            f.close()
+        except Exception:
+            return False
+
+        to_b = lambda h: unhexlify(h.encode())
+        with self._lock:
+            self._children = {
+                to_b(k): [(to_b(c), s) for c, s in v]
+                for k, v in content["children"].items()
+            }
+            self._parents = {to_b(k): to_b(v) for k, v in content["parents"].items()}
+            self._contn = {to_b(k): to_b(v) for k, v in content["contn"].items()}
+            self._prev = {to_b(k): to_b(v) for k, v in content["prev"].items()}
+            self.loaded = True
+        return True
+
+    def save(self) -> None:
+        """
+        Saves the tree to TREE_FN.
+        """
+        to_h = lambda b: hexlify(b).decode()
+        with self._lock:
+            content = dumps(
+                {
+                    "children": {
+                        to_h(k): [[to_h(c), s] for c, s in v]
+                        for k, v in self._children.items()
+                    },
+                    "parents": {to_h(k): to_h(v) for k, v in self._parents.items()},
+                    "contn": {to_h(k): to_h(v) for k, v in self._contn.items()},
+                    "prev": {to_h(k): to_h(v) for k, v in self._prev.items()},
+                }
+            )
+        f = open(TREE_FN, "w")
+        f.write(content)
+        f.close()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._children = {}
+            self._parents = {}
+            self._contn = {}
+            self._prev = {}
+            self.loaded = True
+
+    def add_child(self, fid: bytearray, child_fid: bytearray, seq: int) -> bool:
+        """
+        Records a MKCHILD packet (at seq) in the feed with the given feed ID.
+        Returns False if it was already known.
+        """
+        b_fid, b_child = bytes(fid), bytes(child_fid)
+        with self._lock:
+            children = self._children.setdefault(b_fid, [])
+            if (b_child, seq) in children:
+                return False
+            children.append((b_child, seq))
+            children.sort(key=lambda c: c[1])
+        return True
+
+    def set_parent(self, fid: bytearray, parent_fid: bytearray) -> bool:
+        """
+        Records the ISCHILD packet of the feed with the given feed ID.
+        Returns False if it was already known.
+        """
+        return self._set(self._parents, fid, parent_fid)
+
+    def set_contn(self, fid: bytearray, contn_fid: bytearray) -> bool:
+        """
+        Records the CONTDAS packet of the feed with the given feed ID.
+        Returns False if it was already known.
+        """
+        return self._set(self._contn, fid, contn_fid)
+
+    def set_prev(self, fid: bytearray, prev_fid: bytearray) -> bool:
+        """
+        Records the ISCONTN packet of the feed with the given feed ID.
+        Returns False if it was already known.
+        """
+        return self._set(self._prev, fid, prev_fid)
+
+    def _set(self, table: dict, fid: bytearray, other: bytearray) -> bool:
+        b_fid, b_other = bytes(fid), bytes(other)
+        with self._lock:
+            if table.get(b_fid) == b_other:
+                return False
+            table[b_fid] = b_other
+        return True
+
+    def get_children(
+        self, fid: bytearray, index: bool = False
+    ) -> Union[List[bytearray], List[Tuple[bytearray, int]]]:
+        """
+        Returns the feed IDs of the children of the given feed (ordered by
+        the sequence number of their MKCHILD packet), together with that
+        sequence number if index=True.
+        """
+        with self._lock:
+            children = self._children.get(bytes(fid), [])
+            if index:
+                return [(bytearray(c), s) for c, s in children]
+            return [bytearray(c) for c, _ in children]
+
+    def get_parent(self, fid: bytearray) -> Optional[bytearray]:
+        return self._get(self._parents, fid)
+
+    def get_contn(self, fid: bytearray) -> Optional[bytearray]:
+        return self._get(self._contn, fid)
+
+    def get_prev(self, fid: bytearray) -> Optional[bytearray]:
+        return self._get(self._prev, fid)
+
+    def _get(self, table: dict, fid: bytearray) -> Optional[bytearray]:
+        with self._lock:
+            other = table.get(bytes(fid))
+        return None if other is None else bytearray(other)
+
+    def get_roots(self, fids: List[bytearray]) -> List[bytearray]:
+        """
+        Returns the given feed IDs that do not have a parent feed.
+        """
+        with self._lock:
+            return [fid for fid in fids if bytes(fid) not in self._parents]
@@ -17,6 +17,34 @@ else:
     from uos import ilistdir
 
 
+# syncing files down to the storage (see sync_file): os.fsync (regular
+# python), fsync of the C library via ffi (unix port, whose os module has
+# neither fsync nor sync) or the file system wide os.sync (pycom and other
+# bare-metal ports). SYNC is False if none of them exists.
+_fsync = None
+_sync = None
+try:
+    from os import fsync as _fsync
+except ImportError:
+    try:
+        import ffi
+
+        for name in ("libc.so.6", "libc.so", "libc.dylib"):
+            try:
+                _fsync = ffi.open(name).func("i", "fsync", "i")
+                break
+            except OSError:
+                pass
+    except ImportError:
+        pass
+if _fsync is None:
+    try:
+        from os import sync as _sync
+    except ImportError:
+        pass
+SYNC = _fsync is not None or _sync is not None
+
+
 def listdir(path: Optional[str] = None) -> List[str]:
     """
     Returns a list of all files in the given directory (including subdirectories).
@@ -35,6 +63,18 @@ def listdir(path: Optional[str] = None) -> List[str]:
             return [name for name, _, _ in list(ilistdir(path))]
 
 
+def sync_file(f) -> None:
+    """
+    Flushes the given open file down to the storage (see SYNC). Without a
+    way to sync, the file is only flushed.
+    """
+    f.flush()
+    if _fsync is not None:
+        _fsync(f.fileno())
+    elif _sync is not None:
+        _sync()
+
+
 def walk() -> List[str]:
     """
     Returns a list of all files contained in the current directory and
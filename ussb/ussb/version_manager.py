@@ -8,6 +8,7 @@ from .feed import (
     get_feed,
     get_parent,
     get_payload,
+    get_types,
     get_upd,
     get_wire,
     length,
@@ -35,6 +36,10 @@ if implementation.name != "micropython":
     from typing import List, Tuple, Dict, Callable, Optional
 
 
+# APPLYUP packets per file that survive pruning the version control feed
+KEEP_APPLIES = 3
+
+
 class VersionManager:
     """
     Responsible for managing, applying and reverting updates.
@@ -189,6 +194,11 @@ class VersionManager:
                 and not f.endswith(".log")
                 and not f.endswith(".json")
                 and not f.endswith(".head")
+                and not f.endswith(".idx")
+                and not f.endswith(".jnl")
+                and not f.endswith(".pack")
+                and not f.endswith(".snap")
+                and not f.startswith("_blobs/")
             ):
 
                 # create update and emergency update of file
@@ -633,6 +643,32 @@ class VersionManager:
         self._apply_update(fid, bytearray(v_num.to_bytes(4, "big")))
         add_apply(get_feed(self.vc_fid), fid, v_num, key)
 
+    def prune_policy(self, feed: struct[FEED]) -> Optional[int]:
+        """
+        Pruning policy for FeedManager.prune.
+        The version control feed keeps the last KEEP_APPLIES APPLYUP packets
+        of every file, everything in front of them is pruned.
+        Other feeds are not pruned: file update feeds need their UPDFILE
+        packet (seq 2, see get_upd) and every update, since reverting to
+        an older version walks back through the version graph.
+        """
+        if self.vc_fid is None or bytes(feed.fid) != bytes(self.vc_fid):
+            return None
+
+        types = get_types(feed)
+        counts = {}
+        keep_from = feed.front_seq
+        for i in range(len(types) - 1, -1, -1):
+            if types[i] != APPLYUP:
+                continue
+            seq = feed.anchor_seq + 1 + i
+            b_fid = bytes(get_wire(feed, seq)[16:48])
+            counts[b_fid] = counts.get(b_fid, 0) + 1
+            if counts[b_fid] <= KEEP_APPLIES:
+                keep_from = seq
+
+        return keep_from - 1
+
     def execute_updates(self) -> None:
         """
         Bodge to fix stack overflows on pycom devices.
@@ -691,9 +727,9 @@ class VersionManager:
         self.apply_dict[file_name] = 0
         self._save_config()
 
-        # update dmx values
-        # FIXME: only add dmx values of new feeds
-        self.feed_manager._fill_dmx()
+        # add dmx values of the new feeds
+        self.feed_manager.update_dmx(cfid)
+        self.feed_manager.update_dmx(efid)
 
 
 # ------------------------------------UTIL--------------------------------------
@@ -944,10 +980,7 @@ def extract_version_graph(
 
         # get parent feed ID
         try:
-            wire = bytearray(48)
-            f = open("_feeds/" + hexlify(current_feed.fid).decode() + ".log", "rb")
-            wire[:] = f.read(48)
-            f.close()
+            wire = get_wire(current_feed, 1)
         except Exception:
             # no ISCHILD packet found
             break